@@ -0,0 +1,159 @@
+import numpy as np
+
+
+class Nesterov(object):
+    '''
+    Nesterov extrapolation of the iterates of fit_direct(): the next
+    iteration starts from X_k + beta_k * (X_k - X_{k-1}), where X_k is the
+    output of the state step and beta_k = (t_{k-1} - 1) / t_k grows towards
+    1, as in FISTA (Beck, Teboulle [2009]).
+    '''
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        '''
+        This restarts the momentum.
+        '''
+
+        self.t = 1.
+        self.prev = None
+
+    def get_state(self):
+        '''
+        The momentum as a dictionary of arrays, e.g. to save it in a
+        checkpoint.
+        '''
+
+        if(self.prev is None):
+            return {'t': np.array(self.t)}
+        return {'t': np.array(self.t), 'prev': self.prev.copy()}
+
+    def set_state(self, state):
+        '''
+        This restores the momentum returned by get_state().
+        '''
+
+        self.t = float(state['t'])
+        self.prev = state.get('prev')
+
+    def __call__(self, x, g):
+        '''
+        Input:
+            x: The input of the last iteration (unused).
+            g: The output of the last iteration.
+        Output:
+            The input of the next iteration.
+        '''
+
+        if(self.prev is None):
+            self.prev = g
+            return g
+        t = (1 + np.sqrt(1 + 4 * self.t ** 2)) / 2
+        beta = (self.t - 1) / t
+        y = g + beta * (g - self.prev)
+        self.prev, self.t = g, t
+        return y
+
+
+class Anderson(object):
+    '''
+    Anderson mixing (type II) of the iterates of fit_direct(). One iteration
+    of BCD-prox is a fixed point map x -> g(x) over the states. The next
+    input is the combination of the last m outputs whose residuals
+    g(x) - x have the smallest (regularized) least squares combination
+    (Walker, Ni [2011]).
+    '''
+
+    def __init__(self, m=5, reg=1e-10):
+        '''
+        Input:
+            m: Number of the previous iterations that are mixed.
+            reg: Tikhonov regularization of the least squares problem,
+                relative to the norm of the differences of the residuals.
+        '''
+
+        self.m = m
+        self.reg = reg
+        self.reset()
+
+    def reset(self):
+        '''
+        This clears the history.
+        '''
+
+        self.prev_f = None
+        self.prev_g = None
+        self.dF = []
+        self.dG = []
+
+    def get_state(self):
+        '''
+        The history as a dictionary of arrays, e.g. to save it in a
+        checkpoint.
+        '''
+
+        if(self.prev_f is None):
+            return {}
+        state = {'prev_f': self.prev_f.copy(), 'prev_g': self.prev_g.copy()}
+        if(self.dF):
+            state['dF'], state['dG'] = np.array(self.dF), np.array(self.dG)
+        return state
+
+    def set_state(self, state):
+        '''
+        This restores the history returned by get_state().
+        '''
+
+        self.reset()
+        self.prev_f = state.get('prev_f')
+        self.prev_g = state.get('prev_g')
+        if('dF' in state):
+            self.dF, self.dG = list(state['dF']), list(state['dG'])
+
+    def __call__(self, x, g):
+        '''
+        Input:
+            x: The input of the last iteration.
+            g: The output of the last iteration.
+        Output:
+            The input of the next iteration.
+        '''
+
+        shape = g.shape
+        g = g.ravel()
+        f = g - x.ravel()
+        if(self.prev_f is not None):
+            self.dF.append(f - self.prev_f)
+            self.dG.append(g - self.prev_g)
+            if(len(self.dF) > self.m):
+                self.dF.pop(0)
+                self.dG.pop(0)
+        self.prev_f, self.prev_g = f, g
+        if(not self.dF):
+            return g.reshape(shape)
+        dF, dG = np.array(self.dF).T, np.array(self.dG).T
+        A = dF.T.dot(dF)
+        A = A + self.reg * np.trace(A) * np.eye(A.shape[0])
+        try:
+            gamma = np.linalg.solve(A, dF.T.dot(f))
+        except np.linalg.LinAlgError:
+            self.reset()
+            return g.reshape(shape)
+        return (g - dG.dot(gamma)).reshape(shape)
+
+
+def make_accelerator(acceleration, anderson_m=5):
+    '''
+    This returns the accelerator object for the acceleration option of
+    fit_direct(): None, "nesterov" or "anderson".
+    '''
+
+    if(acceleration is None):
+        return None
+    if(acceleration == 'nesterov'):
+        return Nesterov()
+    if(acceleration == 'anderson'):
+        return Anderson(anderson_m)
+    raise ValueError('Unknown acceleration: %r' % (acceleration,))
@@ -0,0 +1,141 @@
+import numpy as np
+import os
+import threading
+
+
+def flatten_state(state, prefix=''):
+    '''
+    This flattens a nested dictionary of arrays into one dictionary, with
+    the keys of the nested dictionaries joined by dots, so it can be saved
+    with np.savez(). The entries that are None are left out.
+    '''
+
+    flat = {}
+    for key, value in state.items():
+        if(value is None):
+            continue
+        if(isinstance(value, dict)):
+            flat.update(flatten_state(value, prefix + key + '.'))
+        else:
+            flat[prefix + key] = np.asarray(value)
+    return flat
+
+
+def unflatten_state(flat):
+    '''
+    This is the inverse of flatten_state().
+    '''
+
+    state = {}
+    for key, value in flat.items():
+        node = state
+        parts = key.split('.')
+        for part in parts[:-1]:
+            node = node.setdefault(part, {})
+        node[parts[-1]] = value
+    return state
+
+
+def save_checkpoint(path, state):
+    '''
+    This writes a checkpoint to an uncompressed .npz file. The file is first
+    written next to path and then renamed, so path always contains a
+    complete checkpoint, even if the process is killed while writing.
+
+    Input:
+        path: Name of the .npz file.
+        state: A nested dictionary of arrays and scalars.
+    '''
+
+    tmp = path + '.tmp.npz'
+    np.savez(tmp, **flatten_state(state))
+    os.replace(tmp, path)
+
+
+def load_checkpoint(path):
+    '''
+    This reads a checkpoint written by save_checkpoint().
+
+    Output:
+        state: The nested dictionary of arrays. The scalars are 0-dimensional
+            arrays.
+    '''
+
+    with np.load(path) as data:
+        return unflatten_state({key: data[key] for key in data.files})
+
+
+class Checkpointer(object):
+    '''
+    This writes the checkpoints of a fit in a background thread, so the
+    iterations do not wait for the disk. Only the last submitted checkpoint
+    is pending: if a new one arrives before the previous one is written, the
+    previous one is skipped.
+
+    Usage:
+        checkpointer = Checkpointer('fit.npz')
+        for k in range(n):
+            ...
+            checkpointer.submit(state)
+        checkpointer.close()
+    '''
+
+    def __init__(self, path):
+        '''
+        Input:
+            path: Name of the .npz file, overwritten by each checkpoint.
+        '''
+
+        self.path = path
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.pending = None
+        self.closed = False
+        self.error = None
+        self.n_written = 0
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def submit(self, state):
+        '''
+        This schedules a checkpoint. The arrays of state must not be
+        modified afterwards (the caller passes copies of the buffers that
+        are updated in place).
+        '''
+
+        with self.lock:
+            self.pending = state
+            self.wake.set()
+
+    def run(self):
+        '''
+        The loop of the writer thread.
+        '''
+
+        while True:
+            self.wake.wait()
+            with self.lock:
+                state, self.pending = self.pending, None
+                closed = self.closed
+                self.wake.clear()
+            if(state is not None):
+                try:
+                    save_checkpoint(self.path, state)
+                    self.n_written = self.n_written + 1
+                except Exception as e:
+                    self.error = e
+            if(closed):
+                return
+
+    def close(self):
+        '''
+        This writes the pending checkpoint, stops the thread, and raises the
+        error of the last failed write, if any.
+        '''
+
+        with self.lock:
+            self.closed = True
+            self.wake.set()
+        self.thread.join()
+        if(self.error is not None):
+            raise self.error
@@ -0,0 +1,294 @@
+import numpy as np
+import time
+from simulate import predict
+from discretization import duration
+
+
+class ConvergenceMonitor(object):
+    '''
+    This decides when fit_direct() stops, instead of its tol test on the
+    objective over the parameters. At the end of each iteration, it tracks:
+        - the joint objective of BCD-prox, the objective of the state step
+          at its solution (the residuals plus the proximal term), which
+          includes the two blocks;
+        - the relative change of the parameters;
+        - every eval_every iterations, the error of predict() on held-out
+          observations that follow the fitted series, started from the last
+          estimated state. It only integrates the held-out steps.
+    The fit stops at the first of:
+        - "converged": the joint objective decreased by less than rtol
+          (relative) and the parameters changed by less than param_rtol
+          (relative), in patience consecutive iterations. An increase of the
+          objective is not counted as convergence. The states of BCD-prox
+          keep moving towards a solution of the ODE, so the joint objective
+          often decreases slowly for a long time: the held-out error and the
+          budgets are then the useful stops;
+        - "holdout": the held-out error did not improve by more than
+          holdout_rtol (relative) in holdout_patience evaluations. Then
+          fit_direct() returns the parameters and the states of the
+          iteration with the smallest held-out error (best_iter), if
+          restore_best is True, and those of the last iteration otherwise;
+        - "time_budget": the wall time exceeded max_time seconds;
+        - "eval_budget": the solvers evaluated the objectives max_evals
+          times in total.
+
+    Usage:
+        monitor = ConvergenceMonitor(holdout=Y_test, eval_every=20,
+                                     max_time=600)
+        params, X, pred_X, info = fit_direct(Y, dt, init_params, 'lorenz96',
+                                             convergence=monitor,
+                                             return_info=True)
+        print(info['stop_reason'], monitor.report())
+
+    Attributes:
+        history: For each iteration, a dictionary with 'iter', 'joint_cost',
+            'param_change', 'time' (since the start of the fit), 'evals' (the
+            total number of evaluations so far) and 'holdout_error' if it
+            was evaluated.
+        stop_reason: Why the fit stopped, or None.
+        best_params, best_X: Copies of the parameters and of the states of
+            the iteration with the smallest held-out error, if restore_best
+            is True.
+    '''
+
+    def __init__(self, rtol=1e-6, param_rtol=1e-6, patience=3, holdout=None,
+                 holdout_dt=None, eval_every=10, holdout_rtol=1e-4,
+                 holdout_patience=5, max_time=None, max_evals=None,
+                 restore_best=True):
+        '''
+        Input:
+            rtol: Tolerance on the relative decrease of the joint objective,
+                or None to only use param_rtol.
+            param_rtol: Tolerance on the relative change of the parameters,
+                or None to only use rtol. If both are None, the fit does not
+                stop on "converged".
+            patience: Number of consecutive iterations that have to satisfy
+                both tolerances.
+            holdout: T_h*d observations of the states after the last state of
+                the fitted series (NaN for the missing entries), or None.
+            holdout_dt: Time interval between the held-out observations (and
+                between the last fitted state and the first of them), or the
+                T_h-dimensional array of the intervals. By default, the dt of
+                the fit, which has to be uniform.
+            eval_every: Number of iterations between the evaluations of the
+                held-out error.
+            holdout_rtol: Minimum relative decrease of the held-out error
+                that counts as an improvement.
+            holdout_patience: Number of evaluations without improvement
+                before the fit stops, or None to only record the error.
+            max_time: Wall time budget in seconds, or None.
+            max_evals: Budget of evaluations of the objectives (the nfev of
+                the two solvers), or None.
+            restore_best: If True, a copy of the parameters and the states
+                of the best held-out error is kept (in memory, also for the
+                out of core fits), and returned after a "holdout" stop.
+        '''
+
+        self.rtol = rtol
+        self.param_rtol = param_rtol
+        self.patience = patience
+        self.holdout = None if holdout is None else np.asarray(holdout,
+                                                               dtype=float)
+        self.holdout_dt = holdout_dt
+        self.eval_every = eval_every
+        self.holdout_rtol = holdout_rtol
+        self.holdout_patience = holdout_patience
+        self.max_time = max_time
+        self.max_evals = max_evals
+        self.restore_best = restore_best
+
+    def start(self, model, appr, dt):
+        '''
+        This is called by fit_direct() before the first iteration. It resets
+        the history and the clock.
+        '''
+
+        self.model, self.appr = model, appr
+        if(self.holdout is not None and self.holdout_dt is None):
+            if(np.ndim(dt) != 0):
+                raise ValueError('holdout_dt is required for a non-uniform '
+                                 'time grid.')
+            self.holdout_dt = dt
+        self.history = []
+        self.stop_reason = None
+        self.n_evals = 0
+        self.n_small = 0
+        self.best_error, self.best_iter, self.n_worse = np.inf, None, 0
+        self.best_params, self.best_X = None, None
+        self.prev_cost, self.prev_params = None, None
+        self.tic = time.perf_counter()
+
+    def holdout_error(self, params, X):
+        '''
+        The mean squared error of the prediction of the held-out
+        observations from the last state of X, with the parameters params.
+        A prediction that diverges has an infinite error.
+        '''
+
+        T_h = self.holdout.shape[0]
+        pX = predict(np.asarray(X[-1], dtype=float),
+                     duration(self.holdout_dt, T_h + 1), self.holdout_dt,
+                     params, self.model, self.appr)
+        with np.errstate(over='ignore', invalid='ignore'):
+            error = np.nanmean((pX[1:] - self.holdout) ** 2)
+        return float(error) if np.isfinite(error) else np.inf
+
+    def update(self, k, params, X, joint_cost, n_evals, settled=True):
+        '''
+        This is called by fit_direct() at the end of the iteration k.
+
+        Input:
+            k: The iteration.
+            params: The parameters of the iteration.
+            X: The output of the state step.
+            joint_cost: The objective value of the state step.
+            n_evals: Number of evaluations of the objectives in the
+                iteration.
+            settled: False while fit_direct() uses a larger lambda than lam
+                (lam_schedule "adaptive"). The small steps are then not
+                counted as convergence.
+        Output:
+            True if the fit has to stop (see stop_reason).
+        '''
+
+        self.stop_reason = None
+        self.n_evals = self.n_evals + n_evals
+        params = np.array(params, dtype=float)
+        record = {'iter': k, 'joint_cost': float(joint_cost),
+                  'param_change': None,
+                  'time': time.perf_counter() - self.tic,
+                  'evals': self.n_evals}
+
+        small = self.prev_cost is not None and (
+            self.rtol is not None or self.param_rtol is not None)
+        if(small):
+            if(self.rtol is not None):
+                decrease = self.prev_cost - joint_cost
+                small = 0 <= decrease <= self.rtol * abs(self.prev_cost)
+            change = np.linalg.norm(params - self.prev_params) / \
+                max(np.linalg.norm(self.prev_params), 1e-12)
+            record['param_change'] = float(change)
+            if(self.param_rtol is not None):
+                small = small and change <= self.param_rtol
+        self.n_small = self.n_small + 1 if small and settled else 0
+        self.prev_cost, self.prev_params = joint_cost, params
+
+        if(self.holdout is not None and k % self.eval_every == 0):
+            error = self.holdout_error(params, X)
+            record['holdout_error'] = error
+            if(error < self.best_error * (1 - self.holdout_rtol)):
+                self.n_worse = 0
+            else:
+                self.n_worse = self.n_worse + 1
+            if(error < self.best_error):
+                self.best_error, self.best_iter = error, k
+                if(self.restore_best):
+                    self.best_params = params
+                    self.best_X = np.array(X, dtype=float)
+        self.history.append(record)
+
+        if(self.n_small >= self.patience):
+            self.stop_reason = 'converged'
+        elif(self.holdout_patience is not None and
+             self.n_worse >= self.holdout_patience):
+            self.stop_reason = 'holdout'
+        elif(self.max_time is not None and record['time'] > self.max_time):
+            self.stop_reason = 'time_budget'
+        elif(self.max_evals is not None and self.n_evals >= self.max_evals):
+            self.stop_reason = 'eval_budget'
+        return self.stop_reason is not None
+
+    def get_state(self):
+        '''
+        The state of the monitor as a dictionary of arrays, e.g. to save it
+        in a checkpoint: the history, the counters of the tests, the best
+        iterate and the elapsed time. The missing values of the history are
+        NaN, and best_iter is -1 before the first held-out evaluation.
+        '''
+
+        h = self.history
+        state = {'iter': np.array([r['iter'] for r in h], dtype=int),
+                 'evals': np.array([r['evals'] for r in h], dtype=int)}
+        for key in ('joint_cost', 'param_change', 'time', 'holdout_error'):
+            state[key] = np.array([np.nan if r.get(key) is None else r[key]
+                                   for r in h], dtype=float)
+        state['n_evals'] = np.array(self.n_evals)
+        state['n_small'] = np.array(self.n_small)
+        state['n_worse'] = np.array(self.n_worse)
+        state['best_error'] = np.array(self.best_error)
+        state['best_iter'] = np.array(-1 if self.best_iter is None
+                                      else self.best_iter)
+        state['elapsed'] = np.array(time.perf_counter() - self.tic)
+        if(self.stop_reason is not None):
+            state['stop_reason'] = np.array(self.stop_reason)
+        if(self.prev_cost is not None):
+            state['prev_cost'] = np.array(self.prev_cost)
+            state['prev_params'] = self.prev_params
+        if(self.best_params is not None):
+            state['best_params'] = self.best_params
+            state['best_X'] = self.best_X
+        return state
+
+    def set_state(self, state):
+        '''
+        This restores the state returned by get_state(), after start(). The
+        clock continues from the elapsed time, so max_time is the budget of
+        the whole fit.
+        '''
+
+        keys = ('iter', 'joint_cost', 'param_change', 'time', 'evals',
+                'holdout_error')
+        self.history = []
+        for values in zip(*[state[key] for key in keys]):
+            record = dict(zip(keys, values))
+            record['iter'], record['evals'] = (int(record['iter']),
+                                               int(record['evals']))
+            for key in ('joint_cost', 'param_change', 'time',
+                        'holdout_error'):
+                record[key] = float(record[key])
+            if(np.isnan(record['param_change'])):
+                record['param_change'] = None
+            if(np.isnan(record['holdout_error'])):
+                del record['holdout_error']
+            self.history.append(record)
+        self.n_evals = int(state['n_evals'])
+        self.n_small = int(state['n_small'])
+        self.n_worse = int(state['n_worse'])
+        self.best_error = float(state['best_error'])
+        self.best_iter = int(state['best_iter'])
+        if(self.best_iter < 0):
+            self.best_iter = None
+        self.tic = time.perf_counter() - float(state['elapsed'])
+        self.stop_reason = (str(state['stop_reason'])
+                            if 'stop_reason' in state else None)
+        if('prev_cost' in state):
+            self.prev_cost = float(state['prev_cost'])
+            self.prev_params = np.array(state['prev_params'], dtype=float)
+        if('best_params' in state):
+            self.best_params = np.array(state['best_params'], dtype=float)
+            self.best_X = np.array(state['best_X'], dtype=float)
+
+    def report(self):
+        '''
+        The summary of the run: the stop reason, the number of iterations,
+        the time, the number of evaluations, the last joint objective and,
+        with held-out observations, the best error and its iteration.
+        '''
+
+        last = self.history[-1] if self.history else {}
+        out = {'stop_reason': self.stop_reason,
+               'n_iters': len(self.history), 'time': last.get('time'),
+               'evals': self.n_evals, 'joint_cost': last.get('joint_cost')}
+        if(self.holdout is not None):
+            out['best_holdout_error'] = self.best_error
+            out['best_holdout_iter'] = self.best_iter
+            out['restored'] = self.restored()
+        return out
+
+    def restored(self):
+        '''
+        True if fit_direct() returns the best iterate instead of the last
+        one.
+        '''
+
+        return self.stop_reason == 'holdout' and self.best_X is not None
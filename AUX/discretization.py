@@ -0,0 +1,430 @@
+import autograd.numpy as np
+import numpy
+import re
+
+
+# The names of the discretizations of the paper.
+ALIASES = {'euler': 'ab1', 'ad2': 'ab2', 'ad3': 'ab3'}
+
+# The coefficient tables, keyed on appr, and the weight matrices, keyed on
+# (appr, n). The weights of the non-uniform time grids are keyed on
+# (appr, intervals), and only the last few grids are kept.
+TABLES = {}
+MATRICES = {}
+VARIABLE = {}
+MAX_VARIABLE = 16
+
+
+def parse(appr):
+    '''
+    This splits the name of a discretization into its family and its number
+    of steps k:
+        "abk": the k-step Adams-Bashforth method (explicit, order k),
+        "amk": the k-step Adams-Moulton method (implicit, order k+1), where
+            "am0" is the backward Euler method and "am1" the trapezoidal rule,
+        "bdfk": the k-step backward differentiation formula (implicit,
+            order k).
+    "euler", "ad2" and "ad3" of the paper are "ab1", "ab2" and "ab3".
+    '''
+
+    name = ALIASES.get(appr, appr)
+    match = re.match(r'^(ab|am|bdf)(\d+)$', str(name))
+    if(match is None):
+        raise ValueError('Unknown discretization: %r. Use "euler", "ad2", '
+                         '"ad3", "abk", "amk" or "bdfk".' % (appr,))
+    family, k = match.group(1), int(match.group(2))
+    if(k < 1 and family != 'am'):
+        raise ValueError('Unknown discretization: %r.' % (appr,))
+    return family, k
+
+
+def lagrange_basis(nodes):
+    '''
+    The Lagrange polynomials of the nodes, as numpy Polynomial objects.
+    '''
+
+    P = numpy.polynomial.Polynomial
+    basis = []
+    for j, s_j in enumerate(nodes):
+        L = P([1.])
+        for m, s_m in enumerate(nodes):
+            if(m != j):
+                L = L * P([-s_m, 1.]) / (s_j - s_m)
+        basis.append(L)
+    return basis
+
+
+def lmm_coefficients(family, k):
+    '''
+    This returns the coefficients of the linear multistep method
+        sum_j alpha[j] X[n+1-j] = dt * sum_j beta[j] f(X[n+1-j]), j=0..k,
+    with alpha[0] = 1. The time is measured in steps from t_n, so X[n+1-j]
+    is at s = 1-j.
+
+    Input:
+        family: "ab", "am" or "bdf".
+        k: Number of steps.
+    Output:
+        alpha, beta: (k+1)-dimensional numpy arrays.
+    '''
+
+    alpha = numpy.zeros(max(k, 1) + 1)
+    beta = numpy.zeros(max(k, 1) + 1)
+    if(family == 'bdf'):
+        # the derivative at s=1 of the polynomial through X[n+1-j]
+        nodes = 1. - numpy.arange(k + 1)
+        alpha = numpy.array([L.deriv()(1.) for L in lagrange_basis(nodes)])
+        beta = numpy.zeros(k + 1)
+        beta[0] = 1.
+        return alpha / alpha[0], beta / alpha[0]
+
+    # Adams methods: the integral from s=0 to s=1 of the polynomial through
+    # f(X[n+1-j])
+    alpha[0:2] = [1., -1.]
+    if(family == 'ab'):
+        nodes = -numpy.arange(k, dtype=float)
+        cols = numpy.arange(1, k + 1)
+    else:
+        nodes = 1. - numpy.arange(k + 1)
+        cols = numpy.arange(0, k + 1)
+    for j, L in zip(cols, lagrange_basis(nodes)):
+        integral = L.integ()
+        beta[j] = integral(1.) - integral(0.)
+    return alpha, beta
+
+
+def lmm_table(appr):
+    '''
+    This returns the coefficient table of a discretization. The first rows
+    are the start-up steps, where fewer previous states are available and
+    the same method with fewer steps is used, and the last row is used for
+    all the remaining steps. For "ad3": Euler, then the 2-step and the
+    3-step Adams-Bashforth methods, as in eq.(11) of the paper.
+
+    Input:
+        appr: The discretization, see parse().
+    Output:
+        A, B: K*(K+1) matrices, where K is the number of steps. In row r,
+            A[r, j] and B[r, j] are the weights of X[n+1-j] and f(X[n+1-j])
+            in the residual of a step n >= r (n = r for the start-up rows).
+    '''
+
+    if(appr in TABLES):
+        return TABLES[appr]
+    family, k = parse(appr)
+    # am0 (backward Euler) has one step, like am1
+    K = max(k, 1)
+    A = numpy.zeros((K, K + 1))
+    B = numpy.zeros((K, K + 1))
+    for r in range(K):
+        alpha, beta = lmm_coefficients(family, k if r == K - 1 else r + 1)
+        A[r, 0:len(alpha)] = alpha
+        B[r, 0:len(beta)] = beta
+    TABLES[appr] = (A, B)
+    return A, B
+
+
+def n_steps(appr):
+    '''
+    Number of steps K of a discretization: the residual of X[n+1] depends on
+    X[n+1], X[n], ..., X[n+1-K].
+    '''
+
+    return lmm_table(appr)[0].shape[0]
+
+
+def is_implicit(appr):
+    '''
+    True if the residuals depend on the derivative at the new state X[n+1]
+    (Adams-Moulton and BDF methods).
+    '''
+
+    return bool(numpy.any(lmm_table(appr)[1][:, 0] != 0))
+
+
+def weight_matrices(appr, n):
+    '''
+    This returns the coefficient table expanded to all the n = T-1 residuals.
+
+    Output:
+        A, B: n*(K+1) matrices. A[t, j] and B[t, j] are the weights of
+            X[t+1-j] and f(X[t+1-j]) in the residual of time step t.
+    '''
+
+    key = (appr, n)
+    if(key not in MATRICES):
+        A0, B0 = lmm_table(appr)
+        K = A0.shape[0]
+        rows = numpy.minimum(numpy.arange(n), K - 1)
+        MATRICES[key] = (A0[rows], B0[rows])
+    return MATRICES[key]
+
+
+def variable_coefficients(family, k, S):
+    '''
+    This is lmm_coefficients() for m steps of non-uniform sizes. The
+    coefficients are the solutions of the Vandermonde systems of the
+    interpolating polynomials: an Adams method integrates exactly the
+    polynomials of degree < k (k+1 for Adams-Moulton) from s=0 to s=1, and
+    a BDF method differentiates exactly the polynomials of degree <= k at
+    s=1.
+
+    Input:
+        family: "ab", "am" or "bdf".
+        k: Number of steps.
+        S: m*(k+1) matrix. S[:, j] is the time of X[n+1-j] relative to t_n,
+            in units of the step t_{n+1}-t_n, so S[:, 0] = 1 and S[:, 1] = 0.
+    Output:
+        alpha, beta: m*(max(k,1)+1) matrices with alpha[:, 0] = 1. The
+            residual is sum_j alpha[j] X[n+1-j] - h * sum_j beta[j]
+            f(X[n+1-j]), where h is the step.
+    '''
+
+    m = S.shape[0]
+    alpha = numpy.zeros((m, max(k, 1) + 1))
+    beta = numpy.zeros((m, max(k, 1) + 1))
+    if(family == 'bdf'):
+        cols = numpy.arange(k + 1)
+        rhs = cols.astype(float)  # d/ds s^q at s=1
+    else:
+        alpha[:, 0:2] = [1., -1.]
+        cols = numpy.arange(1, k + 1) if family == 'ab' else \
+            numpy.arange(0, k + 1)
+        rhs = 1. / numpy.arange(1, len(cols) + 1)  # integral of s^q
+    q = numpy.arange(len(cols))
+    # V[i, q, j] = S[i, j]^q
+    V = S[:, None, cols] ** q[None, :, None]
+    w = numpy.linalg.solve(V, numpy.broadcast_to(rhs, (m, len(cols)))[..., None])
+    w = w[..., 0]
+    if(family == 'bdf'):
+        alpha[:, cols] = w / w[:, 0:1]
+        beta[:, 0] = 1. / w[:, 0]
+    else:
+        beta[:, cols] = w
+    return alpha, beta
+
+
+def variable_weight_matrices(appr, h):
+    '''
+    This is weight_matrices() for a non-uniform time grid, with the step
+    sizes included in the weights of the derivatives. The start-up steps use
+    the same lower order methods as lmm_table().
+
+    Input:
+        appr: The discretization.
+        h: n-dimensional array of the intervals between the T = n+1 states.
+    Output:
+        A, H: n*(K+1) matrices. The residual of time step t is
+            sum_j A[t, j] X[t+1-j] - sum_j H[t, j] f(X[t+1-j]).
+    '''
+
+    family, k = parse(appr)
+    K = max(k, 1)
+    n = h.shape[0]
+    times = numpy.concatenate(([0.], numpy.cumsum(h)))
+    A = numpy.zeros((n, K + 1))
+    H = numpy.zeros((n, K + 1))
+    for r in range(min(K, n)):
+        # row r for the start-up step r, the last one for all the others
+        tt = numpy.arange(r, n) if r == K - 1 else numpy.array([r])
+        order = k if r == K - 1 else r + 1
+        j = numpy.arange(order + 1)
+        S = (times[tt[:, None] + 1 - j] - times[tt][:, None]) / h[tt][:, None]
+        alpha, beta = variable_coefficients(family, order, S)
+        A[tt, 0:alpha.shape[1]] = alpha
+        H[tt, 0:beta.shape[1]] = h[tt][:, None] * beta
+    return A, H
+
+
+def step_weights(appr, n, dt):
+    '''
+    This returns the weights of the residuals of n time steps, with the step
+    sizes included in the weights of the derivatives.
+
+    Input:
+        appr: The discretization.
+        n: Number of residuals, T-1.
+        dt: Time interval between the states, or an n-dimensional array of
+            the intervals between consecutive states (non-uniform grid).
+    Output:
+        A, H: n*(K+1) matrices. The residual of time step t is
+            sum_j A[t, j] X[t+1-j] - sum_j H[t, j] f(X[t+1-j]).
+    '''
+
+    if(numpy.ndim(dt) == 0):
+        A, B = weight_matrices(appr, n)
+        return A, dt * B
+    h = numpy.asarray(dt, dtype=float)
+    if(h.shape != (n,)):
+        raise ValueError('dt has %d intervals for %d time steps.'
+                         % (h.size, n))
+    key = (appr, h.tobytes())
+    if(key not in VARIABLE):
+        if(len(VARIABLE) >= MAX_VARIABLE):
+            VARIABLE.clear()
+        VARIABLE[key] = variable_weight_matrices(appr, h)
+    return VARIABLE[key]
+
+
+def window_weights(appr, dt, lo, hi):
+    '''
+    This returns the rows lo, ..., hi-2 of step_weights(), the weights of
+    the residuals between the states lo, ..., hi-1, without the matrices of
+    the whole time grid. It is used to evaluate the objectives in blocks of
+    time steps (see outofcore.py).
+
+    Input:
+        appr: The discretization.
+        dt: Time interval between the states, or the array of the intervals
+            of the whole time grid.
+        lo, hi: The window of states.
+    Output:
+        A, H: (hi-1-lo)*(K+1) matrices, new arrays.
+    '''
+
+    if(numpy.ndim(dt) == 0):
+        A0, B0 = lmm_table(appr)
+        rows = numpy.minimum(numpy.arange(lo, hi - 1), A0.shape[0] - 1)
+        return A0[rows], dt * B0[rows]
+    # The residual of step t depends on the intervals t+1-K, ..., t, so the
+    # rows from lo on are computed from the intervals from lo+1-K on.
+    a = max(lo + 1 - n_steps(appr), 0)
+    A, H = variable_weight_matrices(appr, numpy.asarray(dt[a:hi - 1],
+                                                        dtype=float))
+    return A[lo - a:], H[lo - a:]
+
+
+def n_states(end_t, dt):
+    '''
+    Number of states T of a time grid from 0 to end_t, with a uniform dt or
+    an array of intervals (then end_t is their sum).
+    '''
+
+    if(numpy.ndim(dt) == 0):
+        return int((end_t / dt) + 1)
+    return len(dt) + 1
+
+
+def duration(dt, T):
+    '''
+    The time between the first and the last of T states.
+    '''
+
+    if(numpy.ndim(dt) == 0):
+        return (T - 1) * dt
+    return float(numpy.sum(dt))
+
+
+def model_input(X, appr):
+    '''
+    This returns the states to pass to the *_vec functions of the model
+    (rhs_vec(), features(), jac_x(), vjp_x(), ...), which return the first
+    T-1 rows of their input. The explicit methods only need the derivatives
+    of X[0], ..., X[T-2]. For the implicit ones, the last state is repeated,
+    so they return the derivatives of all the T states.
+
+    Input:
+        X: T*d matrix of states, or a B*T*d array.
+        appr: The discretization.
+    '''
+
+    if(is_implicit(appr)):
+        return np.concatenate((X, X[..., -1:, :]), -2)
+    return X
+
+
+def combine(Z, C):
+    '''
+    This combines consecutive time steps with the weights C: the output at
+    step t is sum_j C[t, j] * Z[t+1-j]. It is one strided convolution along
+    the first axis, with the start-up rows included in C.
+
+    Input:
+        Z: Array whose first axis is time, e.g. the T*d states, the (T-1)*d
+            or T*d derivatives, or the (T-1)*d*p features. Row m is the time
+            step m. If Z has T-1 rows, C[:, 0] has to be zero.
+        C: n*(K+1) weights from weight_matrices().
+    Output:
+        Array with n rows and the trailing shape of Z.
+    '''
+
+    n, K1 = C.shape
+    shape = (n,) + (1,) * (np.ndim(Z) - 1)
+    out = 0.
+    for j in range(K1):
+        if(not numpy.any(C[:, j])):
+            continue
+        # the steps t < j-1 have no Z[t+1-j], and C[t, j] = 0 there
+        lo = max(j - 1, 0)
+        w = C[lo:, j].reshape((n - lo,) + shape[1:])
+        term = w * Z[lo + 1 - j:n + 1 - j]
+        if(lo > 0):
+            term = np.concatenate((np.zeros((lo,) + np.shape(term)[1:]),
+                                   term), 0)
+        out = out + term
+    return out
+
+
+def combine_adjoint(G, C, m):
+    '''
+    This is the adjoint (transpose) of combine(). If G is the derivative of
+    a function with respect to combine(Z, C), it returns the derivative with
+    respect to Z.
+
+    Input:
+        G: n*d matrix.
+        C: n*(K+1) weights.
+        m: Number of rows of Z (T or T-1).
+    Output:
+        m*d matrix.
+    '''
+
+    n, K1 = C.shape
+    out = numpy.zeros((m,) + G.shape[1:])
+    for j in range(K1):
+        if(not numpy.any(C[:, j])):
+            continue
+        lo, hi = max(j - 1, 0), min(n, m - 1 + j)
+        out[lo + 1 - j:hi + 1 - j] += C[lo:hi, j:j + 1] * G[lo:hi]
+    return out
+
+
+def residuals(X, terms, dt, appr):
+    '''
+    This returns the residuals of the discretized ODE, the terms inside the
+    sums of squares of eq.(7)/(8) [Euler] and eq.(13a)/(13b) [multistep] of
+    the paper:
+        R[t] = sum_j A[t, j] X[t+1-j] - dt * sum_j B[t, j] f(X[t+1-j]).
+
+    Input:
+        X: T*d matrix of states.
+        terms: The derivatives returned by model.rhs_vec(model_input(X,
+            appr), params): (T-1)*d for the explicit methods, T*d otherwise.
+        dt: Time interval between the states, or a (T-1)-dimensional array
+            of the intervals (see step_weights()).
+        appr: The discretization.
+    Output:
+        R: (T-1)*d matrix of residuals.
+    '''
+
+    A, H = step_weights(appr, X.shape[0] - 1, dt)
+    return combine(X, A) - combine(terms, H)
+
+
+def residuals_adjoint(G, dt, appr, T, n_terms):
+    '''
+    This backpropagates G = d(objective)/dR through residuals().
+
+    Input:
+        G: (T-1)*d matrix.
+        dt: Time interval between the states, or the array of intervals.
+        appr: The discretization.
+        T: Number of states.
+        n_terms: Number of rows of the derivatives (T-1 or T).
+    Output:
+        GX: T*d derivative with respect to X through the A weights.
+        GF: n_terms*d derivative with respect to the derivatives.
+    '''
+
+    A, H = step_weights(appr, T - 1, dt)
+    return combine_adjoint(G, A, T), -combine_adjoint(G, H, n_terms)
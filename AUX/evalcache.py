@@ -0,0 +1,183 @@
+import autograd.numpy as np
+import numpy
+from discretization import model_input, residuals, residuals_adjoint
+from objectives import param_obj
+from linear_params import linear_system, solve_linear_system
+
+
+class EvalCache(object):
+    '''
+    This caches the evaluations of the model within one iteration of
+    fit_direct(), so that they are shared by the parameter step, the
+    objective value of the iteration and the first evaluation of the state
+    step.
+
+    The cache is keyed on a version of the states set by the caller, which
+    calls new_states() whenever the states change (fit_direct() after the
+    state step and the extrapolation), and on the parameters by value. The
+    states are never compared, which would take O(T*d) operations per
+    evaluation. For each version of X, it keeps:
+        - for the models that are linear in the parameters, the features
+          Phi, c and the least squares problem b - M*params of the
+          residuals (see linear_params.py), so the objective over the
+          parameters and its gradient never evaluate the model;
+        - for the other models, the derivatives and the residuals of the
+          last few parameters.
+    The first evaluation of the state step is at the cached states: the
+    caller announces it with state_step(), and it reuses the cache.
+
+    The features Phi and the matrix M of the linear models take about
+    2*p*T*d floats, i.e. 2*p times the memory of the states, which can
+    matter for models with many parameters (use eval_cache=False in
+    fit_direct() then).
+
+    The methods param_obj(), param_obj_and_grad() and linear_param_step()
+    have the same arguments as the functions they replace.
+
+    Usage:
+        cache = EvalCache(model, appr, dt)
+        params = cache.linear_param_step(X, dt, appr, model)
+        cost = cache.param_obj(params, X, dt, appr, model)  # no evaluation
+        cache.state_step()
+        res = minimize(X_obj_and_grad, X.flatten('F'), jac=True,
+                       args=(params, dt, x0, lam, d, appr, model, None,
+                             cache))
+        X = res['x'].reshape((d, T)).T
+        cache.new_states()
+    '''
+
+    def __init__(self, model, appr, dt, size=4):
+        '''
+        Input:
+            model: The ODEModel object of the model.
+            appr: The type of discretization, e.g. "euler", "ad3" or "bdf2".
+            dt: Time interval between the states, or the array of the
+                intervals.
+            size: Number of parameters whose evaluations are kept.
+        '''
+
+        self.model, self.appr, self.dt = model, appr, dt
+        self.size = size
+        self.version = 0
+        self.invalidate()
+
+    def invalidate(self):
+        '''
+        This clears the cache.
+        '''
+
+        self.X = None
+        self.X_version = None
+        self.Z = None
+        self.linear = None
+        self.evals = {}
+        self.at_states = False
+
+    def new_states(self):
+        '''
+        This is called when the states change (a new array, or the same
+        array modified in place). The cached evaluations are dropped.
+        '''
+
+        self.version = self.version + 1
+        self.invalidate()
+
+    def state_step(self):
+        '''
+        This is called before the state step, whose first evaluation of
+        terms() is at the cached states.
+        '''
+
+        self.at_states = self.X is not None
+
+    def states(self, X):
+        '''
+        This returns model_input(X), computed once per version of the
+        states.
+        '''
+
+        if(self.X_version != self.version or X is not self.X):
+            self.invalidate()
+            self.X, self.X_version = X, self.version
+            self.Z = model_input(X, self.appr)
+        return self.Z
+
+    def least_squares(self, X):
+        '''
+        Phi, c, M and b of the models that are linear in the parameters,
+        computed once per X.
+        '''
+
+        self.states(X)
+        if(self.linear is None):
+            Phi, c = self.model.features(self.Z)
+            M, b = linear_system(X, self.dt, self.appr, self.model,
+                                 (Phi, c))
+            self.linear = Phi, c, M, b
+        return self.linear
+
+    def evaluate(self, params, X):
+        '''
+        The derivatives rhs_vec(model_input(X), params) and the residuals,
+        computed once per X and params.
+        '''
+
+        self.states(X)
+        key = numpy.asarray(params, dtype=float).tobytes()
+        if(key not in self.evals):
+            if(len(self.evals) >= self.size):
+                self.evals.pop(next(iter(self.evals)))
+            terms = self.model.rhs_vec(self.Z, params)
+            self.evals[key] = terms, residuals(X, terms, self.dt, self.appr)
+        return self.evals[key]
+
+    def terms(self, X, params):
+        '''
+        This returns model_input(X) and the derivatives at X. They come from
+        the cache for the first call after state_step(), which is at the
+        cached states.
+        '''
+
+        if(not self.at_states):
+            Z = model_input(X, self.appr)
+            return Z, self.model.rhs_vec(Z, params)
+        self.at_states = False
+        if(self.model.linear_in_params):
+            Phi, c = self.least_squares(self.X)[0:2]
+            return self.Z, numpy.einsum('tip,p->ti', Phi, params) + c
+        return self.Z, self.evaluate(params, self.X)[0]
+
+    def param_obj(self, params, X, dt, appr, model):
+        '''
+        param_obj() of objectives.py.
+        '''
+
+        if(self.model.linear_in_params):
+            M, b = self.least_squares(X)[2:4]
+            return np.sum((b - np.dot(M, params)) ** 2)
+        if(not isinstance(params, numpy.ndarray)):
+            # The parameters are traced by autograd.
+            return param_obj(params, X, dt, appr, model)
+        return numpy.sum(self.evaluate(params, X)[1] ** 2)
+
+    def param_obj_and_grad(self, params, X, dt, appr, model):
+        '''
+        param_obj_and_grad() of objectives.py.
+        '''
+
+        if(self.model.linear_in_params):
+            M, b = self.least_squares(X)[2:4]
+            R = b - numpy.dot(M, params)
+            return numpy.sum(R ** 2), -2 * numpy.dot(M.T, R)
+        terms, R = self.evaluate(params, X)
+        G = residuals_adjoint(2 * R, self.dt, self.appr, X.shape[0],
+                              terms.shape[0])[1]
+        return numpy.sum(R ** 2), self.model.vjp_params(self.Z, params, G)
+
+    def linear_param_step(self, X, dt, appr, model):
+        '''
+        linear_param_step() of linear_params.py.
+        '''
+
+        M, b = self.least_squares(X)[2:4]
+        return solve_linear_system(M, b)
@@ -0,0 +1,342 @@
+import autograd.numpy as np
+from scipy.optimize import minimize
+from autograd import grad
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..', 'ODEs'))
+from ode_model import get_model
+from discretization import (model_input, residuals, residuals_adjoint,
+                            duration, step_weights, combine)
+from linear_params import solve_linear_system
+from simulate import predict_batch
+
+
+def batch_residuals(X, params, dt, appr, model):
+    '''
+    This returns the residuals of eq.(8) [Euler] or eq.(13b) [multistep] of
+    the paper for a batch of B problems, with one evaluation of *_ode_vec()
+    over all of them.
+
+    Input:
+        X: B*T*d array of states.
+        params: B*1*p array of parameters, or p-dimensional parameters that
+            are shared by all the problems.
+        dt: Time interval between the states.
+        appr: The type of discretization (e.g. "euler", "ad3" or "bdf2").
+        model: The ODEModel object of the model.
+    Output:
+        R: B*(T-1)*d array of residuals.
+    '''
+
+    terms = model.rhs_vec(model_input(X, appr), params)
+    # residuals() works along the first axis, so time is moved there.
+    R = residuals(np.swapaxes(X, 0, 1), np.swapaxes(terms, 0, 1), dt, appr)
+    return np.swapaxes(R, 0, 1)
+
+
+def time_first(A):
+    '''
+    This moves the time axis of a B*T*... array first and flattens the
+    others, as the adjoints of discretization.py expect.
+    '''
+
+    A = np.swapaxes(A, 0, 1)
+    return A.reshape((A.shape[0], -1))
+
+
+def rowwise(fun, Z, n, *args):
+    '''
+    This evaluates a function of the model that takes the states of one
+    series and returns the values of its first rows (features(),
+    vjp_x(), ...) on the first n rows of each series of a batch, in one
+    call: the functions work row by row, so the series are stacked, with
+    one extra row at the end.
+
+    Input:
+        fun: The function of the model.
+        Z: B*T'*d array of states (T' > n).
+        n: Number of rows per series.
+        args: The other arguments of fun, e.g. params and G, where G is a
+            B*n*d array that is also stacked.
+    Output:
+        The output of fun, of B*n rows.
+    '''
+
+    B, d = Z.shape[0], Z.shape[2]
+    Zs = Z[:, 0:n].reshape((B * n, d))
+    Zs = np.concatenate((Zs, Zs[-1:]), 0)
+    args = [a.reshape((B * n,) + a.shape[2:]) if np.ndim(a) == 3 else a
+            for a in args]
+    return fun(Zs, *args)
+
+
+def batch_vjp(fun, Z, params, G, shared):
+    '''
+    This returns the vector-Jacobian products model.vjp_x() or
+    model.vjp_params() of a batch.
+
+    Input:
+        fun: model.vjp_x or model.vjp_params.
+        Z: B*T'*d array, the output of model_input().
+        params: The parameters of batch_residuals().
+        G: B*n*d derivatives with respect to the derivatives of the model.
+        shared: True if params are shared by all the series.
+    Output:
+        B*n*d array for vjp_x, p-dimensional (shared) or B*p array for
+        vjp_params.
+    '''
+
+    B, n = G.shape[0:2]
+    if(shared):
+        out = rowwise(fun, Z, n, params, G)
+        return out.reshape((B, n, -1)) if out.ndim == 2 else out
+    # the Jacobians of the model take one set of parameters
+    return np.stack([fun(Z[b, 0:n + 1], params[b, 0], G[b])
+                     for b in range(B)])
+
+
+def batch_adjoint(X, params, dt, appr, model):
+    '''
+    The sum of the squared residuals of a batch and its derivatives with
+    respect to the states (through the weights of the states) and to the
+    derivatives of the model.
+
+    Output:
+        objval: The sum of the squared residuals.
+        GX: B*T*d derivative with respect to X.
+        GF: B*n*d derivative with respect to the derivatives.
+        Z: The input of the model, model_input(X, appr).
+    '''
+
+    B, T, d = X.shape
+    Z = model_input(X, appr)
+    terms = model.rhs_vec(Z, params)
+    n = terms.shape[1]
+    R = residuals(np.swapaxes(X, 0, 1), np.swapaxes(terms, 0, 1), dt, appr)
+    GX, GF = residuals_adjoint(time_first(2 * np.swapaxes(R, 0, 1)), dt,
+                               appr, T, n)
+    GX = np.swapaxes(GX.reshape((T, B, d)), 0, 1)
+    GF = np.swapaxes(GF.reshape((n, B, d)), 0, 1)
+    return np.sum(R ** 2), GX, GF, Z
+
+
+def X_obj_and_grad_batch(x, params, dt, x0, lam, shape, appr, model, shared):
+    '''
+    This returns the value and the gradient of X_obj_batch() in one pass,
+    with the analytic Jacobians of the model, like X_obj_and_grad().
+
+    Input:
+        The same as X_obj_batch(). model.has_jacobians has to be True.
+        shared: True if params are shared by all the series.
+    Output:
+        objval: The objective value.
+        objgrad: The gradient with respect to x.
+    '''
+
+    X = x.reshape(shape)
+    objval, GX, GF, Z = batch_adjoint(X, params, dt, appr, model)
+    GX[:, 0:GF.shape[1]] += batch_vjp(model.vjp_x, Z, params, GF, shared)
+    objval = objval + lam * np.sum((x - x0) ** 2)
+    return objval, GX.ravel() + 2 * lam * (x - x0)
+
+
+def param_obj_and_grad_batch(params, X, dt, appr, model, shared):
+    '''
+    This returns the value and the gradient of param_obj_batch() in one
+    pass, with the analytic Jacobians of the model, like
+    param_obj_and_grad().
+    '''
+
+    if(not shared):
+        params = params.reshape((X.shape[0], 1, -1))
+    objval, GX, GF, Z = batch_adjoint(X, params, dt, appr, model)
+    return objval, batch_vjp(model.vjp_params, Z, params, GF,
+                             shared).ravel()
+
+
+def linear_param_step_batch(X, dt, appr, model, shared):
+    '''
+    This is linear_param_step() for a batch: the closed form least squares
+    solution of the parameters of each series (or of the shared
+    parameters), for the models that are linear in the parameters.
+
+    Output:
+        The flattened B*p parameters, or p-dimensional if shared is True.
+    '''
+
+    B, T, d = X.shape
+    Z = model_input(X, appr)
+    n = Z.shape[1] - 1
+    Phi, c = rowwise(model.features, Z, n)
+    p = Phi.shape[-1]
+    A, H = step_weights(appr, T - 1, dt)
+    # the residuals are b - M*params, as in linear_system()
+    M = combine(np.swapaxes(Phi.reshape((B, n, d, p)), 0, 1), H)
+    b = combine(np.swapaxes(X, 0, 1), A) - \
+        combine(np.swapaxes(c.reshape((B, n, d)), 0, 1), H)
+    M = np.swapaxes(M, 0, 1).reshape((B, -1, p))
+    b = np.swapaxes(b, 0, 1).reshape((B, -1))
+    if(shared):
+        return solve_linear_system(M.reshape((-1, p)), b.ravel())
+    G = np.einsum('bnp,bnq->bpq', M, M)
+    h = np.einsum('bnp,bn->bp', M, b)
+    try:
+        return np.linalg.solve(G, h[..., None])[..., 0].ravel()
+    except np.linalg.LinAlgError:
+        return np.concatenate([solve_linear_system(M[k], b[k])
+                               for k in range(B)])
+
+
+def X_obj_batch(x, params, dt, x0, lam, shape, appr, model):
+    '''
+    This is the sum of the objective functions over the states X,
+    eq.(8) [Euler] or eq. (13b) [multistep] of the paper, of B problems.
+    The problems are independent, so minimizing the sum minimizes each one.
+
+    Input:
+        x: The flattened B*T*d array of states.
+        params: B*1*p array of parameters, or p-dimensional shared parameters.
+        dt: Time interval between the states.
+        x0: The flattened previous states X^*(n-1).
+        lam: The hyperparameter lambda in our paper.
+        shape: The shape (B, T, d) of the states.
+        appr: The type of discretization (e.g. "euler", "ad3" or "bdf2").
+        model: The ODEModel object of the model.
+    Output:
+        objval: Return the objective value
+    '''
+
+    X = x.reshape(shape)
+    R = batch_residuals(X, params, dt, appr, model)
+    return np.sum(R ** 2) + lam * np.sum((x - x0) ** 2)
+
+
+def param_obj_batch(params, X, dt, appr, model, shared):
+    '''
+    This is the sum of the objective functions over the parameters,
+    eq.(7) [Euler] or eq. (13a) [multistep] of the paper, of B problems.
+
+    Input:
+        params: The flattened B*p parameters, or p-dimensional parameters if
+            shared is True.
+        X: B*T*d array of the current states.
+        dt: Time interval between the states.
+        appr: The type of discretization (e.g. "euler", "ad3" or "bdf2").
+        model: The ODEModel object of the model.
+        shared: True if all the problems share the same parameters.
+    Output:
+        objval: Return the objective value
+    '''
+
+    if(not shared):
+        params = params.reshape((X.shape[0], 1, -1))
+    R = batch_residuals(X, params, dt, appr, model)
+    return np.sum(R ** 2)
+
+
+def fit_direct_batch(Ys, dt, init_params, ODE_str, appr='euler', lam=1,
+                     max_iters=10000, tol=1e-8, shared_params=False,
+                     param_solver='auto', gradients='auto'):
+    '''
+    This function learns the ODE parameters of B problems (e.g. different
+    noisy series, or different initializations of the parameters) together.
+    It runs the same algorithm as fit_direct(), but each objective is
+    evaluated over all the problems in one pass.
+
+    Input:
+        Ys: B*T*d numpy array that contains B series of noisy observations.
+        dt: Time interval between the observations (states), or a
+            (T-1)-dimensional array of the intervals, shared by all the series.
+        init_params: p-dimensional initialization for the unknown parameters,
+            or a B*p array with one initialization per problem.
+        ODE_str: Name of the model as a string, or an ODEModel object.
+        appr: The type of discretization (e.g. "euler", "ad3" or "bdf2").
+        lam: The hyper-parameter lambda in our method.
+        max_iters: Maximum number of iterations.
+        tol: Tolerance value to stop the optimization, if the amount of changes
+            in the (total) objective is small.
+        shared_params: If True, one set of parameters is estimated jointly
+            from all the series, e.g. from many short series of the same
+            system. Otherwise, each series has its own parameters.
+        param_solver: 1) "lbfgs", 2) "linear" for the closed form solution
+            of each series, for the models that are linear in the parameters,
+            or 3) "auto" to use "linear" when the model supports it, as in
+            fit_direct().
+        gradients: 1) "autograd", 2) "analytic" for the analytic Jacobians
+            of the model, or 3) "auto" to use "analytic" when the model
+            supports it, as in fit_direct().
+    Output:
+        params: The estimated parameters, B*p (or p-dimensional if
+            shared_params is True).
+        X: B*T*d array of the estimated states.
+        pred_X: B*T*d array of the predicted states.
+    '''
+
+    model = get_model(ODE_str)
+
+    # Initialization of states and parameters
+    X = np.array(Ys, dtype=float)
+    B, T, d = X.shape
+    params = np.array(init_params, dtype=float)
+    if(shared_params):
+        params = params.reshape(-1)
+    else:
+        params = (params * np.ones((B, 1))).ravel()
+    new_cost = np.inf
+
+    if(param_solver == 'auto'):
+        param_solver = 'linear' if model.linear_in_params else 'lbfgs'
+    if(gradients == 'auto'):
+        gradients = 'analytic' if model.has_jacobians else 'autograd'
+    if(gradients == 'analytic'):
+        param_fun, param_grad = param_obj_and_grad_batch, True
+        X_fun, X_grad = X_obj_and_grad_batch, True
+        X_extra = (shared_params,)
+    else:
+        param_fun, param_grad = param_obj_batch, grad(param_obj_batch)
+        X_fun, X_grad = X_obj_batch, grad(X_obj_batch)
+        X_extra = ()
+
+    # main loop of our algorithm
+    for k in range(max_iters):
+
+        # optimization over parameters given states
+        if(param_solver == 'linear'):
+            params = linear_param_step_batch(X, dt, appr, model,
+                                             shared_params)
+            cost = param_obj_batch(params, X, dt, appr, model, shared_params)
+        else:
+            res = minimize(param_fun, params, method='L-BFGS-B',
+                           jac=param_grad,
+                           args=(X, dt, appr, model, shared_params),
+                           options={'disp': False, 'maxcor': 100})
+            params, cost = res['x'], res['fun']
+
+        # stop if the changes in the objective is smaller than tol
+        prev_cost = new_cost
+        new_cost = cost
+        if((prev_cost - new_cost) < tol and k > 1):
+            break
+
+        # print results every 500 iterations
+        if(k % 500 == 0):
+            print('iter', k, 'obj_val:', new_cost)
+
+        # optimization over the states given the parameters
+        batch_params = params if shared_params else params.reshape((B, 1, -1))
+        X0 = X.ravel()
+        res = minimize(X_fun, X0, method='L-BFGS-B', jac=X_grad,
+                       args=(batch_params, dt, X0 + 0.000001, lam, (B, T, d),
+                             appr, model) + X_extra,
+                       options={'disp': False, 'maxcor': 100})
+        X = res['x'].reshape((B, T, d))
+
+    if(not shared_params):
+        params = params.reshape((B, -1))
+
+    # predict the states using eq.(5) [Euler] or eq.(11) [multistep] of the paper
+    pred_X = predict_batch(X[:, 0, :], duration(dt, T), dt, params, model,
+                           appr)
+
+    return params, X, pred_X
@@ -1,93 +1,626 @@
 from scipy.optimize import minimize
+import os
+import time
 import sys
-sys.path.append('./ODEs/')
-sys.path.append('./AUX/')
-from fitzhugh_nagumo import *
-from rossler import *
-from lotka_volterra import *
-from lorenz96 import *
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..', 'ODEs'))
+from ode_model import get_model
 from objectives import *
 from autograd import grad
 from simulate import *
+from gauss_newton import gauss_newton_X_step
+from linear_params import linear_param_step
+from lbfgs import LBFGS, value_and_grad
+from acceleration import make_accelerator
+from workspace import StateWorkspace
+from discretization import duration
+from segments import SegmentedXStep
+from checkpoint import Checkpointer, load_checkpoint
+from outofcore import TimeBlocks, open_series, open_states
+from evalcache import EvalCache
+
+
+def solver_stats(block, res, elapsed):
+    '''
+    The telemetry of one block of an iteration, sent to the callback of
+    fit_direct(). res is the result of the solver, or None for the closed
+    form parameter step, which has no iterations.
+    '''
+
+    nit = None if res is None else int(res['nit'])
+    nfev = None if res is None else int(res['nfev'])
+    stats = {block + '_time': elapsed, block + '_nit': nit,
+             block + '_nfev': nfev}
+    if(block == 'X'):
+        stats['X_cost'] = float(res['fun'])
+    return stats
+
+
+def fill_missing(Y, mask, dt):
+    '''
+    This initializes the missing entries of the observations with a linear
+    interpolation in time of the observed entries of the same dimension.
+    The dimensions that have no observations are set to 0.
+
+    Input:
+        Y: T*d matrix of observations.
+        mask: T*d boolean matrix, True for the observed entries.
+        dt: Time interval between the observations, or a (T-1)-dimensional
+            array of the intervals.
+    Output:
+        X: T*d matrix.
+    '''
+
+    T, d = Y.shape
+    times = np.concatenate(([0.], np.cumsum(np.broadcast_to(dt, (T - 1,)))))
+    X = np.where(mask, Y, 0.)
+    for i in range(d):
+        obs = mask[:, i]
+        if(np.any(obs) and not np.all(obs)):
+            X[~obs, i] = np.interp(times[~obs], times[obs], Y[obs, i])
+    return X
 
 
 def fit_direct(Y, dt, init_params, ODE_str, appr='euler', lam=1,
-               max_iters=10000, tol=1e-8):
+               max_iters=10000, tol=1e-8, X_solver='lbfgs',
+               param_solver='auto', gradients='auto', return_info=False,
+               callback=None, inner_maxiter=None, acceleration=None,
+               anderson_m=5, lam_schedule=None, lam_max=None,
+               workspace=False, mask=None,
+               n_segments=None, max_workers=None, checkpoint=None,
+               checkpoint_every=100, resume=None, out=None, pred_out=None,
+               block_size=10000, init_X=None, eval_cache=True,
+               precision='double', convergence=None, min_iters=0):
     '''
     This function learns the ODE parameters given the noisy observations.
 
     Input:
-        Y: T*d numpy array that contains the noisy observations.
-        dt: Time interval between the observations (states).
+        Y: T*d numpy array that contains the noisy observations, or the
+            name of a .npy file, which is memory-mapped. With out, any
+            array that can be sliced in time (np.memmap, h5py dataset) is
+            accepted, and it is only read in blocks.
+        dt: Time interval between the observations (states), or a
+            (T-1)-dimensional array of the intervals between consecutive
+            observations for a non-uniform time grid.
         init_params: p-dimensional initialization for the unknown parameters.
         ODE_str: This is a string, with the name of ODE model.
             ODE_str can be set to 'fitzhugh_nagumo' or 'lotka_volterra' or
-            'rossler' or 'lorenz96'.
-        appr: This determines the type of discretization and takes one of the
-            three strings: 1)"euler" for 1-step Euler, 2) "ad2" for the 2-step
-            Adam-Bashforth, and 3) "ad3" for the 3-step Adam-Bashforth
+            'rossler' or 'lorenz96' or any other registered model. An
+            ODEModel object can also be passed (see ODEs/ode_model.py).
+        appr: This determines the type of discretization: 1)"euler" for
+            1-step Euler, 2) "ad2" for the 2-step Adam-Bashforth, 3) "ad3" for
+            the 3-step Adam-Bashforth, or any other method of
+            discretization.py, e.g. "ab4", "am2" or "bdf3".
         lam: The hyper-parameter lambda in our method.
         max_iters: Maximum number of iterations.
         tol: Tolerance value to stop the optimization, if the amount of changes
-            in the objective is small.
+            in the objective is small. It is not used with convergence.
+        X_solver: The method used for the optimization over the states:
+            1) "lbfgs" for L-BFGS over all the T*d variables, or
+            2) "gauss_newton" for the Gauss-Newton method, which exploits the
+            banded structure of the objective (see gauss_newton.py), or
+            3) "lbfgs_warm" for L-BFGS that keeps its curvature memory
+            between the iterations (see lbfgs.py), or 4) "segmented" to split
+            the time axis into n_segments chunks that are solved in parallel
+            worker processes (see SegmentedXStep in segments.py), for long
+            series on several cores (each chunk has at least 10000 entries,
+            so short series use a single chunk), or
+            5) "blockwise" to update chunks of block_size states one after
+            the other, in place (see TimeBlocks in outofcore.py). It is the
+            solver of the out of core fits.
+        param_solver: The method used for the optimization over the
+            parameters: 1) "lbfgs" for L-BFGS, 2) "linear" for the closed form
+            least squares solution, which requires a model that is linear in
+            the parameters (see linear_params.py), 3) "lbfgs_warm" as in
+            X_solver, or 4) "auto" to use "linear" when the model supports it
+            and "lbfgs" otherwise.
+        gradients: How the L-BFGS gradients are computed: 1) "autograd",
+            2) "analytic" for the analytic Jacobians of the model, where the
+            value and the gradient of the objectives are computed in one pass
+            (see X_obj_and_grad() and param_obj_and_grad()), or 3) "auto" to
+            use "analytic" when the model supports it.
+        return_info: If True, a dictionary with information about the run is
+            also returned.
     Output:
         params: The estimated parameters.
         X: The estimated states.
         pred_X: The predicted states.
+        info: Only if return_info is True. A dictionary with 'n_iters' (the
+            number of iterations), 'converged' (True if the tolerance was
+            reached before max_iters, or convergence stopped the fit with
+            "converged"), 'stop_reason' ("tol", "max_iters", "callback" or
+            the stop reason of convergence), 'cost' (the last objective
+            value) and 'costs' (the objective value of each iteration). With
+            convergence, it also has 'convergence', the report() of the
+            monitor. After its "holdout" stop, params, X and pred_X are
+            those of the iteration with the best held-out error (see
+            ConvergenceMonitor).
+        callback: If set, callback(record) is called at the end of each
+            iteration with a dictionary of telemetry: the wall time, the
+            number of iterations and function evaluations and the objective
+            value of the two blocks, and the norms of the steps of params
+            and X (see FitTrace in telemetry.py). The last record also has
+            'stop_reason'. If the callback returns True, the fit stops, and
+            'stop_reason' of its record is set to "callback" after the call
+            (unless the record was already the last one).
+        inner_maxiter: Maximum number of L-BFGS iterations of each block
+            update, or None to solve each block to convergence. A few
+            iterations per block (inexact BCD) are usually enough, especially
+            with "lbfgs_warm".
+        acceleration: Extrapolation of the states between the iterations:
+            1) None for the plain alternating minimization, 2) "nesterov" for
+            the Nesterov momentum, or 3) "anderson" for the Anderson mixing of
+            the last anderson_m iterations (see acceleration.py). If the
+            objective increases, the extrapolated states are dropped and the
+            acceleration is restarted. The tol test only stops the fit after
+            a plain (not extrapolated) step, and not on the restarts: when
+            it passes after an extrapolation, the acceleration is restarted
+            and the next iteration checks it again without extrapolation.
+        anderson_m: Number of iterations mixed by the Anderson acceleration.
+        lam_schedule: 1) None to use lam in all the iterations, or
+            2) "adaptive" to multiply lambda by 2 each time the acceleration
+            is restarted, up to lam_max, and divide it by 2 after each
+            successful iteration, down to lam. lam acts as the inverse of a
+            step size over the states, and the estimates depend on it, so
+            lambda never goes below lam. The tol test and the "converged"
+            test of convergence are skipped while lambda is above lam: a
+            large lambda makes the steps small, not the fit converged.
+        lam_max: The largest lambda of the "adaptive" schedule (100*lam by
+            default).
+        workspace: If True, the objective over the states is evaluated with
+            preallocated buffers and time-major flattened states (see
+            StateWorkspace in workspace.py), which avoids the copies of
+            X_obj_and_grad() for long series. It requires the analytic
+            gradients and X_solver "lbfgs" or "lbfgs_warm".
+        mask: T*d boolean matrix, True for the observed entries of Y, or None
+            to use the entries of Y that are not NaN. The proximal term only
+            includes the observed entries, so the missing ones (gaps,
+            dropouts or unobserved dimensions) are only determined by the
+            ODE. They are initialized with fill_missing().
+        n_segments: Number of chunks of X_solver "segmented" (twice the
+            number of workers by default).
+        max_workers: Number of worker processes of X_solver "segmented" (all
+            the cores by default).
+        checkpoint: Name of a .npz file where the state of the fit is saved
+            every checkpoint_every iterations and at the end: the states,
+            the parameters, the iteration, the objective values, lambda and
+            the memory of the acceleration and of the "lbfgs_warm" solvers.
+            The files are written by a background thread (see
+            checkpoint.py), so the iterations do not wait for the disk.
+        checkpoint_every: Number of iterations between the checkpoints.
+        resume: Name of a checkpoint file to continue a fit from, with the
+            same Y, dt, appr and options, or True to continue from the file
+            checkpoint if it exists. The iterations continue from the saved
+            one, up to max_iters in total. The checkpoints record the stop
+            reason of the fit, and a fit that stopped on "tol" (or
+            "converged" with convergence) is returned as it is. They also
+            hold the state of convergence (its history, tests, best iterate
+            and elapsed time), which continues from it.
+        out: Name of a .npy file, or a writable T*d array (e.g. np.memmap),
+            for the estimated states. If it is set, the fit runs out of
+            core: the states are only in this memory-mapped array, and the
+            objectives are evaluated in blocks of block_size time steps (see
+            outofcore.py), so the memory does not depend on T. It uses
+            X_solver "blockwise", and does not support the acceleration, the
+            workspace, the missing observations and the checkpoints. The
+            returned X is this array.
+        pred_out: Name of a .npy file, or a writable T*d array, for the
+            predicted states. By default, they are in memory.
+        block_size: Number of time steps of the blocks of the out of core
+            fits.
+        init_X: T*d initialization of the states, Y by default, e.g. the
+            states of a fit on a coarser time grid (see multilevel.py). The
+            missing entries are still those of Y (or mask).
+        eval_cache: If True, the evaluations of the model are cached within
+            each iteration (see EvalCache in evalcache.py): the objective
+            value of the iteration and the start of the state step reuse
+            the evaluations of the parameter step, and for the models that
+            are linear in the parameters, the parameter step evaluates the
+            features once. The features then take about 2*p times the
+            memory of the states.
+        precision: 1) "double" to compute everything in float64, or
+            2) "mixed" to evaluate the model and the residuals of the state
+            step in float32 (see StateWorkspace in workspace.py), and store
+            the curvature pairs of X_solver "lbfgs_warm" in float32. The
+            objective values, the states and the parameter step stay in
+            float64. It requires the analytic gradients and X_solver "lbfgs"
+            or "lbfgs_warm", and uses the workspace.
+        convergence: A ConvergenceMonitor (see convergence.py) that decides
+            when the fit stops instead of tol, from the joint objective, the
+            change of the parameters, the error on held-out observations and
+            the time and evaluation budgets. Its measures are also added to
+            the records of callback.
+        min_iters: Number of iterations before the tol test is applied,
+            e.g. after a warm start (init_X) whose first iterations decrease
+            the objective slowly.
     '''
 
     # Initialization of states and parameters
-    X = Y
+    X = open_series(Y)
     params = init_params
 
-    # autograd accepts float data
-    X = X.astype(float)
+    blocks = None
+    if(out is not None or X_solver == 'blockwise'):
+        if(X_solver not in ('lbfgs', 'blockwise') or acceleration is not None
+           or workspace or mask is not None or checkpoint is not None or
+           resume is not None):
+            raise ValueError('The out of core fits (X_solver "blockwise") '
+                             'do not support the acceleration, the '
+                             'workspace, the mask or the checkpoints.')
+        X_solver = 'blockwise'
+        blocks = TimeBlocks(block_size)
+
+    if(out is not None):
+        # The states are copied to the file out, one block at a time.
+        X = blocks.copy(X if init_X is None else open_series(init_X),
+                        open_states(out, X.shape))
+    else:
+        # autograd accepts float data
+        X = X.astype(float)
     params = params.astype(float)
 
 
     T, d = X.shape
     new_cost = 1000
 
-    # autograd computes the derivative of the objectives automatically
+    # The missing entries are left out of the proximal term.
+    if(mask is None and out is None and np.any(np.isnan(X))):
+        mask = ~np.isnan(X)
+    mask_F = None
+    if(mask is not None):
+        if(blocks is not None):
+            raise ValueError('X_solver "blockwise" does not support missing '
+                             'observations.')
+        mask = np.asarray(mask, dtype=bool)
+        X = fill_missing(X, mask, dt)
+        mask_F = mask.flatten('F').astype(float)
+    if(init_X is not None and out is None):
+        if(np.shape(init_X) != (T, d)):
+            raise ValueError('init_X has the shape %s instead of %s.'
+                             % (np.shape(init_X), (T, d)))
+        X = np.array(init_X, dtype=float)
+
+    # The model is resolved once and passed to the objectives.
+    model = get_model(ODE_str)
+
+    if(gradients == 'auto'):
+        gradients = 'analytic' if model.has_jacobians else 'autograd'
+
+    # floating point type of the state step
+    if(precision == 'mixed'):
+        if(gradients != 'analytic' or
+           X_solver not in ('lbfgs', 'lbfgs_warm')):
+            raise ValueError('precision="mixed" requires analytic gradients '
+                             'and X_solver "lbfgs" or "lbfgs_warm".')
+        workspace = True
+        X_dtype = np.float32
+    elif(precision == 'double'):
+        X_dtype = float
+    else:
+        raise ValueError('Unknown precision: %r' % (precision,))
+
+    # The objective over the parameters is summed over blocks of time
+    # steps by the blockwise solver.
+    param_cost, param_cost_and_grad = param_obj, param_obj_and_grad
+    linear_step = linear_param_step
+    if(blocks is not None):
+        param_cost = blocks.param_obj
+        param_cost_and_grad = blocks.param_obj_and_grad
+        linear_step = blocks.linear_param_step
+    # The evaluations of the model are shared by the two blocks of an
+    # iteration.
+    cache = None
+    if(eval_cache and blocks is None):
+        cache = EvalCache(model, appr, dt)
+        param_cost = cache.param_obj
+        param_cost_and_grad = cache.param_obj_and_grad
+        linear_step = cache.linear_param_step
+    X_cache = (cache,) if cache is not None and gradients == 'analytic' \
+        else ()
+
+    if(gradients == 'analytic'):
+        # The objectives return their value and gradient together.
+        param_fun, param_grad = param_cost_and_grad, True
+        X_fun, X_grad = X_obj_and_grad, True
+    else:
+        # autograd computes the derivative of the objectives automatically
+
+        # This returns gradient of eq.(7) for the Euler or eq.(13a) for the
+        #   multi-step method in the paper.
+        param_fun, param_grad = param_cost, grad(param_cost)
+
+        # This returns gradient of eq.(8) for the Euler or eq.(13b) for the
+        # multi-step method in the paper.
+        X_fun, X_grad = X_obj, grad(X_obj)
 
-    # This returns gradient of eq.(7) for the Euler or eq.(13a) for the
-    #   multi-step method in the paper.
-    param_grad = grad(param_obj)
+    if(param_solver == 'auto'):
+        param_solver = 'linear' if model.linear_in_params else 'lbfgs'
 
-    # This returns gradient of eq.(8) for the Euler or eq.(13b) for the
-    # multi-step method in the paper.
-    X_grad = grad(X_obj)
+    # scipy's default maximum number of L-BFGS-B iterations
+    maxiter = 15000 if inner_maxiter is None else inner_maxiter
+    # The warm started solvers keep their memory over the iterations.
+    if(param_solver == 'lbfgs_warm'):
+        param_lbfgs = LBFGS(maxcor=100, maxiter=maxiter)
+        param_fun_grad = value_and_grad(param_fun, param_grad)
+    if(X_solver == 'lbfgs_warm'):
+        X_lbfgs = LBFGS(maxcor=100, maxiter=maxiter, dtype=X_dtype)
+        X_fun_grad = value_and_grad(X_fun, X_grad)
+
+    def param_step(X, params):
+        '''
+        The optimization over the parameters given the states. It returns
+        the parameters and the result of the solver (None for "linear").
+        '''
+
+        if(param_solver == 'linear'):
+            return linear_step(X, dt, appr, model), None
+        elif(param_solver == 'lbfgs_warm'):
+            res = param_lbfgs.minimize(param_fun_grad, params,
+                                       args=(X, dt, appr, model))
+        else:
+            res = minimize(param_fun, params, method='L-BFGS-B', jac=param_grad, args=(X, dt,appr,model),
+                   options={'disp': False,'maxcor': 100, 'maxiter': maxiter})
+        return res['x'], res
+
+    ws = None
+    if(workspace):
+        if(gradients != 'analytic'):
+            raise ValueError('workspace=True requires analytic gradients.')
+        if(X_solver not in ('lbfgs', 'lbfgs_warm')):
+            raise ValueError('workspace=True requires X_solver "lbfgs" or '
+                             '"lbfgs_warm", not %r.' % (X_solver,))
+        ws = StateWorkspace(T, d, dt, appr, model, mask, dtype=X_dtype)
+    if(X_solver == 'segmented'):
+        segmented = SegmentedXStep(T, d, dt, appr, model, n_segments,
+                                   max_workers, maxiter=maxiter, mask=mask)
+
+    accelerator = make_accelerator(acceleration, anderson_m)
+    # X_plain is the last output of the optimization over the states, before
+    # the extrapolation.
+    X_plain = X
+    cur_lam = lam
+    if(lam_max is None):
+        lam_max = 100 * lam
+    stop_reason = 'max_iters'
+    costs = []  # the objective value of each iteration
+
+    # the memories of the solvers and of the acceleration
+    memories = {'accelerator': accelerator,
+                'X_lbfgs': X_lbfgs if X_solver == 'lbfgs_warm' else None,
+                'param_lbfgs': param_lbfgs if param_solver == 'lbfgs_warm'
+                else None}
+
+    def fit_state(next_iter):
+        '''
+        The state of the fit before the iteration next_iter, for the
+        checkpoints.
+        '''
+
+        state = {'iter': next_iter, 'X': X, 'params': params,
+                 'cost': new_cost, 'lam': cur_lam, 'costs': np.array(costs),
+                 'appr': appr, 'stop_reason': stop_reason}
+        if(X_plain is not X):
+            state['X_plain'] = X_plain
+        for key, memory in memories.items():
+            if(memory is not None):
+                state[key] = memory.get_state()
+        if(convergence is not None):
+            state['convergence'] = convergence.get_state()
+        return state
+
+    start = 0
+    if(resume is True):
+        exists = checkpoint is not None and os.path.exists(checkpoint)
+        resume = checkpoint if exists else None
+    if(resume is not None):
+        state = load_checkpoint(resume)
+        if(state['X'].shape != (T, d) or str(state['appr']) != appr):
+            raise ValueError('The checkpoint %s is not a fit of the same '
+                             'problem.' % resume)
+        start = int(state['iter'])
+        X, params = state['X'], state['params']
+        X_plain = state.get('X_plain', X)
+        new_cost, cur_lam = float(state['cost']), float(state['lam'])
+        costs = list(state['costs'])
+        if(str(state.get('stop_reason')) in ('tol', 'converged')):
+            stop_reason = str(state['stop_reason'])
+        for key, memory in memories.items():
+            if(memory is not None):
+                memory.set_state(state.get(key, {}))
+
+    checkpointer = None if checkpoint is None else Checkpointer(checkpoint)
+    if(convergence is not None):
+        convergence.start(model, appr, dt)
+        if(resume is not None and 'convergence' in state):
+            convergence.set_state(state['convergence'])
+    k = start - 1
+
+    # A fit that converged is not continued.
+    end = start if stop_reason in ('tol', 'converged') else max_iters
 
     # main loop of our algorithm
-    for k in range(max_iters):
+    for k in range(start, end):
+
+        # The telemetry is only collected if there is a callback.
+        if(callback is not None):
+            record = {'iter': k}
+            prev_params, prev_X = params, X
+            tic = time.perf_counter()
 
         # optimization over parameters given states
-        res = minimize(param_obj, params, method='L-BFGS-B', jac=param_grad, args=(X, dt,appr,ODE_str),
-               options={'disp': False,'maxcor': 100})
-        params = res['x']
+        plain = accelerator is None or X is X_plain
+        params, res = param_step(X, params)
+        # the number of evaluations of the objectives in the iteration
+        n_evals = 2 if res is None else int(res['nfev']) + 1
 
         # stop if the changes in the objective is smaller than tol
         prev_cost = new_cost
-        new_cost = param_obj(params, X, dt,appr,ODE_str)
-        if((prev_cost - new_cost) < tol and k > 1):
+        new_cost = param_cost(params, X, dt,appr,model)
+
+        # safeguard of the acceleration: if the objective increased, restart
+        # from the states before the extrapolation
+        restarted = False
+        if(accelerator is not None):
+            if(new_cost > prev_cost and X is not X_plain):
+                accelerator.reset()
+                restarted = True
+                X = X_plain
+                params, res = param_step(X, params)
+                new_cost = param_cost(params, X, dt,appr,model)
+                n_evals = n_evals + (2 if res is None else
+                                     int(res['nfev']) + 1)
+                if(lam_schedule == 'adaptive'):
+                    cur_lam = min(lam_max, 2 * cur_lam)
+            elif(lam_schedule == 'adaptive'):
+                cur_lam = max(lam, cur_lam / 2)
+        costs.append(float(new_cost))
+
+        if(callback is not None):
+            record.update(solver_stats('param', res, time.perf_counter() - tic))
+            record['param_cost'] = float(new_cost)
+            record['param_step'] = float(np.linalg.norm(params - prev_params))
+            record['lam'] = cur_lam
+            record['restarted'] = restarted
+
+        # With the acceleration, the objective of the extrapolated states is
+        # not monotone: the test only stops the fit after a plain step. If
+        # it passes after an extrapolation, the next iteration is plain.
+        small = (convergence is None and (prev_cost - new_cost) < tol and
+                 k > 1 and k >= min_iters and not restarted and
+                 cur_lam <= lam)
+        check_plain = small and not plain
+        if(small and plain):
+            stop_reason = 'tol'
+            if(callback is not None):
+                record['stop_reason'] = stop_reason
+                callback(record)
             break
 
         # print results every 500 iterations
         if(k%500 == 0):
             print('iter', k, 'params:', params, 'obj_val:', new_cost)
 
-        # Flatten the current estimation and use it as initialization.
-        X0 = X.flatten('F')
+        if(callback is not None):
+            tic = time.perf_counter()
+
         # optimization over the states given the parameters
-        res = minimize(X_obj, X0, method='L-BFGS-B', jac=X_grad,
-                       args=(params, dt,X0+0.000001,lam,d,appr,ODE_str),
-                           options={'disp': False,'maxcor': 100})
-        x = res['x']
-        X = x.reshape((d,T)).T #Put the data back into the original shape
+        X_in = X
+        if(X_solver == 'gauss_newton'):
+            res = gauss_newton_X_step(X, params, dt, X + 0.000001, cur_lam,
+                                      appr, model, mask=mask)
+            X = res['x']
+        elif(X_solver == 'segmented'):
+            X, res = segmented(X, params, X + 0.000001, cur_lam)
+        elif(X_solver == 'blockwise'):
+            X, res = blocks.X_step(X, params, dt, cur_lam, appr, model,
+                                   maxiter)
+        elif(ws is not None):
+            # time-major flattening: no copies or transposes
+            x = np.ascontiguousarray(X).ravel()
+            np.add(x, 0.000001, out=ws.x0)
+            if(X_solver == 'lbfgs_warm'):
+                res = X_lbfgs.minimize(ws.X_obj_and_grad, x,
+                                       args=(params, ws.x0, cur_lam))
+            else:
+                res = minimize(ws.X_obj_and_grad, x, method='L-BFGS-B',
+                               jac=True, args=(params, ws.x0, cur_lam),
+                               options={'disp': False, 'maxcor': 100,
+                                        'maxiter': maxiter})
+            X = res['x'].reshape((T, d))
+        else:
+            # Flatten the current estimation and use it as initialization.
+            X0 = X.flatten('F')
+            if(cache is not None):
+                # the first evaluation is at the states of the cache
+                cache.state_step()
+            if(X_solver == 'lbfgs_warm'):
+                res = X_lbfgs.minimize(X_fun_grad, X0,
+                                       args=(params, dt, X0 + 0.000001,
+                                             cur_lam, d, appr, model, mask_F)
+                                       + X_cache)
+            else:
+                res = minimize(X_fun, X0, method='L-BFGS-B', jac=X_grad,
+                               args=(params, dt,X0+0.000001,cur_lam,d,appr,model,
+                                     mask_F) + X_cache,
+                               options={'disp': False,'maxcor': 100,
+                                        'maxiter': maxiter})
+            x = res['x']
+            X = x.reshape((d,T)).T #Put the data back into the original shape
+        # the convergence test is on the output of the state step
+        stop = convergence is not None and convergence.update(
+            k, params, X, float(res['fun']), n_evals + int(res['nfev']),
+            settled=cur_lam <= lam)
+        if(stop):
+            stop_reason = convergence.stop_reason
+
+        # extrapolation of the states
+        if(accelerator is not None and check_plain):
+            X_plain = X
+            accelerator.reset()
+        elif(accelerator is not None and not stop):
+            X_plain = X
+            X = accelerator(X_in, X_plain)
+        if(cache is not None):
+            # the cached evaluations are at the previous states
+            cache.new_states()
+
+        if(callback is not None):
+            record.update(solver_stats('X', res, time.perf_counter() - tic))
+            if(X_solver == 'blockwise'):
+                # X is updated in place
+                record['X_step'] = float(res['step'])
+            else:
+                record['X_step'] = float(np.linalg.norm(X - prev_X))
+            if(convergence is not None):
+                last = convergence.history[-1]
+                record['joint_cost'] = last['joint_cost']
+                record['param_change'] = last['param_change']
+                record['holdout_error'] = last.get('holdout_error')
+            last = k == max_iters - 1 or stop
+            if(last):
+                record['stop_reason'] = stop_reason
+            # the callback can stop the fit by returning True, and its
+            # record is then the last one
+            if(callback(record) and not last):
+                stop_reason = 'callback'
+                record['stop_reason'] = stop_reason
+                break
+        if(stop):
+            break
+
+        if(checkpointer is not None and (k + 1) % checkpoint_every == 0):
+            checkpointer.submit(fit_state(k + 1))
+
+    if(X_solver == 'segmented'):
+        segmented.close()
+    if(checkpointer is not None):
+        checkpointer.submit(fit_state(k + 1))
+        checkpointer.close()
+
+    # early stopping: the iterate of the best held-out error
+    if(convergence is not None and convergence.restored()):
+        params = convergence.best_params
+        if(blocks is not None):
+            X[:] = convergence.best_X
+        else:
+            X = convergence.best_X
 
     # predict the states using eq.(5) [Euler] or eq.(11) [multistep] of the paper
-    pred_X = predict(X[0, :], (T-1)*dt, dt, params, ODE_str, appr)
+    if(pred_out is not None):
+        pred_out = open_states(pred_out, (T, d))
+    pred_X = predict(X[0, :], duration(dt, T), dt, params, model, appr,
+                     out=pred_out)
+    if(blocks is not None and hasattr(X, 'flush')):
+        X.flush()
 
+    if(return_info):
+        info = {'n_iters': k + 1,
+                'converged': stop_reason in ('tol', 'converged'),
+                'stop_reason': stop_reason, 'cost': new_cost,
+                'costs': np.array(costs)}
+        if(convergence is not None):
+            info['convergence'] = convergence.report()
+        return params, X, pred_X, info
     return params, X, pred_X
 
 
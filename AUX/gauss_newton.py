@@ -0,0 +1,283 @@
+import autograd.numpy as np
+import scipy.sparse as sp
+from scipy.linalg import solveh_banded, LinAlgError
+from scipy.optimize import OptimizeResult
+from scipy.sparse.linalg import LinearOperator, cg
+from discretization import (model_input, residuals, step_weights, combine,
+                            combine_adjoint)
+from autograd import grad
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..', 'ODEs'))
+from ode_model import stencil_jvp, stencil_vjp
+
+
+def state_jacobians(X, params, model):
+    '''
+    This computes the Jacobian of dX(t)/dt in eq.(1) of the paper with respect
+    to the state, at every time step (except the last one).
+    The analytic Jacobian of the model is used if it has one. Otherwise,
+    since each row of *_ode_vec() only depends on the same row of X, the
+    Jacobians of all time steps are obtained with d reverse-mode passes of
+    autograd.
+
+    Input:
+        X: T*d matrix of states. Use model_input() of discretization.py to
+            get the Jacobians of all the states for the implicit methods.
+        params: p-dimensional parameters.
+        model: The ODEModel object of the model.
+    Output:
+        J: (T-1)*d*d array. J[t] is the d*d Jacobian at the state X[t].
+    '''
+
+    if(model.has_jacobians):
+        return model.jac_x(X, params)
+
+    T, d = X.shape
+    J = np.zeros((T - 1, d, d))
+    for i in range(d):
+        row_grad = grad(lambda Z: np.sum(model.rhs_vec(Z, params)[:, i]))
+        J[:, i, :] = row_grad(X)[0:T - 1, :]
+    return J
+
+
+def X_residuals(X, params, dt, appr, model):
+    '''
+    This returns the residuals of the discretized ODE, i.e. the terms inside
+    the sum of squares in eq.(8) [Euler] or eq.(13b) [multistep] of the paper.
+
+    Input:
+        X: T*d matrix of states.
+        params: p-dimensional parameters.
+        dt: Time interval between the states, or a (T-1)-dimensional array
+            of the intervals.
+        appr: The type of discretization, e.g. "euler", "ad3" or "bdf2".
+        model: The ODEModel object of the model.
+    Output:
+        R: (T-1)*d matrix of residuals.
+    '''
+
+    terms = model.rhs_vec(model_input(X, appr), params)
+    return residuals(X, terms, dt, appr)
+
+
+def residual_jacobian(J, dt, appr, T):
+    '''
+    This assembles the sparse Jacobian of the residuals in X_residuals() with
+    respect to the states. The residual of time step t only depends on
+    X[t+1], X[t], ..., X[t-K+1], where K is the number of steps of the
+    discretization, so the Jacobian is block banded.
+
+    Input:
+        J: The state Jacobians from state_jacobians(), (T-1)*d*d for the
+            explicit methods and T*d*d for the implicit ones.
+        dt: Time interval between the states, or the array of intervals.
+        appr: The type of discretization, e.g. "euler", "ad3" or "bdf2".
+        T: Number of states.
+    Output:
+        A sparse ((T-1)*d)*(T*d) matrix. The states and the residuals are
+        flattened row by row (time step by time step).
+    '''
+
+    n, d = T - 1, J.shape[1]
+    # A[t, j] and H[t, j] are the weights of X[t+1-j] and f(X[t+1-j]) in the
+    # residual of step t, with the step sizes in H.
+    A, H = step_weights(appr, n, dt)
+
+    idx = np.arange(d)
+    rows, cols, data = [], [], []
+    for j in range(A.shape[1]):
+        tt = np.arange(max(j - 1, 0), n)
+        # The sum_j A[t,j]*X[t+1-j] part of the residuals.
+        if(np.any(A[:, j])):
+            rows.append((tt[:, None] * d + idx[None, :]).ravel())
+            cols.append(((tt[:, None] + 1 - j) * d + idx[None, :]).ravel())
+            data.append(np.repeat(A[tt, j], d))
+        # The -sum_j H[t,j]*f(X[t+1-j]) part of the residuals.
+        if(np.any(H[:, j])):
+            r = tt[:, None, None] * d + idx[None, :, None]
+            c = (tt[:, None, None] + 1 - j) * d + idx[None, None, :]
+            v = -H[tt, j][:, None, None] * J[tt + 1 - j]
+            rows.append(np.broadcast_to(r, v.shape).ravel())
+            cols.append(np.broadcast_to(c, v.shape).ravel())
+            data.append(v.ravel())
+
+    return sp.coo_matrix((np.concatenate(data),
+                          (np.concatenate(rows), np.concatenate(cols))),
+                         shape=(n * d, (n + 1) * d)).tocsr()
+
+
+def stencil_operators(Js, stencil, dt, appr, T):
+    '''
+    This returns the products with the Jacobian of the residuals in
+    X_residuals() and with its transpose, for a model with a stencil,
+    without assembling the Jacobian. Each product takes O(T*d*S) operations,
+    where S is the size of the stencil.
+
+    Input:
+        Js: The stencil Jacobians of model.jac_stencil() at the states
+            model_input(X, appr), (T-1)*d*S for the explicit methods and
+            T*d*S for the implicit ones.
+        stencil: The offsets of model.stencil.
+        dt: Time interval between the states, or the array of intervals.
+        appr: The type of discretization, e.g. "euler", "ad3" or "bdf2".
+        T: Number of states.
+    Output:
+        matvec: A function of a T*d matrix V that returns the (T-1)*d matrix
+            of the Jacobian times V.
+        rmatvec: A function of a (T-1)*d matrix G that returns the T*d matrix
+            of the transposed Jacobian times G.
+    '''
+
+    A, H = step_weights(appr, T - 1, dt)
+    m = Js.shape[0]
+
+    def matvec(V):
+        return combine(V, A) - combine(stencil_jvp(Js, stencil, V[0:m]), H)
+
+    def rmatvec(G):
+        out = combine_adjoint(G, A, T)
+        out[0:m] -= stencil_vjp(Js, stencil, combine_adjoint(G, H, m))
+        return out
+
+    return matvec, rmatvec
+
+
+def solve_banded_spd(H, g, damping=1e-10):
+    '''
+    This solves H*p = g for a sparse, symmetric positive definite and banded
+    matrix H with the banded Cholesky factorization. The cost is
+    O(N*u^2), where N is the size of H and u is its bandwidth.
+
+    Input:
+        H: Sparse N*N symmetric matrix.
+        g: N-dimensional vector.
+        damping: Added to the diagonal if H is not positive definite.
+    Output:
+        p: N-dimensional solution.
+    '''
+
+    H = H.tocoo()
+    lower = H.row >= H.col
+    row, col, val = H.row[lower], H.col[lower], H.data[lower]
+    u = int(np.max(row - col))
+    ab = np.zeros((u + 1, H.shape[0]))
+    ab[row - col, col] = val
+    while True:
+        try:
+            return solveh_banded(ab, g, lower=True)
+        except LinAlgError:
+            ab[0, :] = ab[0, :] + damping
+            damping = damping * 10
+
+
+def gauss_newton_X_step(X, params, dt, X_prev, lam, appr, model,
+                        max_iter=20, xtol=1e-10, ftol=1e-12, mask=None,
+                        linear_solver='auto', cg_tol=1e-6, cg_maxiter=None):
+    '''
+    This minimizes the objective function over the states in eq.(8) [Euler]
+    or eq.(13b) [multistep] of the paper with the Gauss-Newton method.
+    The Gauss-Newton system is block tridiagonal (Euler) or block banded
+    (multistep), so each iteration takes O(T*d^3) operations with a banded
+    Cholesky factorization, instead of many L-BFGS iterations over all the
+    T*d variables. For the models with a stencil (local coupling), the d*d
+    blocks are not formed: the system is solved with conjugate gradients
+    and the products with the sparse Jacobian, in O(T*d) operations per
+    conjugate gradient iteration.
+
+    Input:
+        X: T*d matrix, the initialization of the states.
+        params: p-dimensional parameter \theta^*(n).
+        dt: Time interval between the states, or a (T-1)-dimensional array
+            of the intervals.
+        X_prev: T*d matrix, the previous state X^*(n-1) in the proximal term.
+        lam: The hyperparameter lambda in our paper.
+        appr: The type of discretization, e.g. "euler", "ad3" or "bdf2".
+        model: The ODEModel object of the model.
+        max_iter: Maximum number of Gauss-Newton iterations.
+        xtol: Stop if the relative size of the step is smaller than xtol.
+        ftol: Stop if the relative decrease of the objective is smaller than
+            ftol.
+        mask: Optional T*d boolean matrix of the observed entries. The
+            proximal term only includes the observed entries.
+        linear_solver: The solver of the Gauss-Newton systems: 1) "banded"
+            for the banded Cholesky factorization, 2) "cg" for the matrix
+            free conjugate gradients, which requires a model with a stencil,
+            or 3) "auto" to use "cg" when the model has a stencil.
+        cg_tol: Relative tolerance of the conjugate gradients.
+        cg_maxiter: Maximum number of conjugate gradient iterations per
+            Gauss-Newton iteration (scipy's default if None).
+    Output:
+        res: scipy OptimizeResult. res['x'] is the T*d matrix of the
+            estimated states, res['fun'] is the objective value, res['nit']
+            and res['nfev'] are the number of iterations and objective
+            evaluations, and res['ncg'] the number of conjugate gradient
+            iterations.
+    '''
+
+    T, d = X.shape
+    if(linear_solver == 'auto'):
+        linear_solver = 'cg' if model.stencil is not None else 'banded'
+    # weights of the proximal term
+    w = np.ones((T, d)) if mask is None else np.asarray(mask, dtype=float)
+    W = sp.diags(w.ravel(), format='csr')
+
+    def objective(Z):
+        R = X_residuals(Z, params, dt, appr, model)
+        return np.sum(R ** 2) + lam * np.sum(w * (Z - X_prev) ** 2), R
+
+    fval, R = objective(X)
+    nfev = 1
+    ncg = 0
+    success = False
+    for it in range(1, max_iter + 1):
+        # Gauss-Newton system:
+        # (A^T A + lam W) p = -(A^T r + lam W (x - x_prev)), W = diag(w)
+        if(linear_solver == 'cg'):
+            Js = model.jac_stencil(model_input(X, appr), params)
+            matvec, rmatvec = stencil_operators(Js, model.stencil, dt, appr,
+                                                T)
+            g = (rmatvec(R) + lam * w * (X - X_prev)).ravel()
+
+            def normal_matvec(v):
+                V = v.reshape(T, d)
+                return (rmatvec(matvec(V)) + lam * w * V).ravel()
+
+            H = LinearOperator((T * d, T * d), matvec=normal_matvec,
+                               dtype=float)
+            n_cg = [0]  # counted by the callback of cg()
+            p = cg(H, -g, rtol=cg_tol, maxiter=cg_maxiter,
+                   callback=lambda xk: n_cg.append(n_cg.pop() + 1))[0]
+            p = p.reshape(T, d)
+            ncg = ncg + n_cg[0]
+        else:
+            J = state_jacobians(model_input(X, appr), params, model)
+            A = residual_jacobian(J, dt, appr, T)
+            g = A.T.dot(R.ravel()) + lam * (w * (X - X_prev)).ravel()
+            H = A.T.dot(A) + lam * W
+            p = solve_banded_spd(H, -g).reshape(T, d)
+
+        # backtracking line search on the objective value
+        slope = 2 * np.dot(g, p.ravel())
+        alpha = 1.
+        while True:
+            X_new = X + alpha * p
+            f_new, R_new = objective(X_new)
+            nfev = nfev + 1
+            if(f_new <= fval + 1e-4 * alpha * slope or alpha < 1e-8):
+                break
+            alpha = alpha / 2
+
+        if(f_new > fval):
+            success = True  # no further decrease is possible
+            break
+        decrease = fval - f_new
+        X, fval, R = X_new, f_new, R_new
+        if(alpha * np.linalg.norm(p) <= xtol * (1 + np.linalg.norm(X)) or
+                decrease <= ftol * (1 + fval)):
+            success = True
+            break
+
+    return OptimizeResult(x=X, fun=fval, nit=it, nfev=nfev, ncg=ncg,
+                          success=success)
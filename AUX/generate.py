@@ -0,0 +1,220 @@
+import numpy as np
+import hashlib
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..', 'ODEs'))
+from ode_model import get_model
+
+
+# Butcher tableau of the Dormand-Prince 5(4) method (dopri5).
+DOPRI_A = [[],
+           [1/5],
+           [3/40, 9/40],
+           [44/45, -56/15, 32/9],
+           [19372/6561, -25360/2187, 64448/6561, -212/729],
+           [9017/3168, -355/33, 46732/5247, 49/176, -5103/18656],
+           [35/384, 0, 500/1113, 125/192, -2187/6784, 11/84]]
+DOPRI_B = np.array([35/384, 0, 500/1113, 125/192, -2187/6784, 11/84, 0])
+DOPRI_E = DOPRI_B - np.array([5179/57600, 0, 7571/16695, 393/640,
+                              -92097/339200, 187/2100, 1/40])
+
+
+def rk4_step(f, x, h):
+    '''
+    One step of the classical Runge-Kutta method for a batch of states.
+    '''
+
+    k1 = f(x)
+    k2 = f(x + (h / 2) * k1)
+    k3 = f(x + (h / 2) * k2)
+    k4 = f(x + h * k3)
+    return x + (h / 6) * (k1 + 2 * k2 + 2 * k3 + k4)
+
+
+def dopri5_step(f, x, h, rtol, atol):
+    '''
+    One step of the Dormand-Prince 5(4) method for a batch of states.
+
+    Input:
+        f: The derivatives of a batch of states.
+        x: B*d states.
+        h: The step size, or a B*1 array of the step sizes of the states.
+        rtol, atol: Relative and absolute tolerances.
+    Output:
+        x_new: The states after the step.
+        err: B-dimensional scaled error estimates. The step of a state is
+            accepted if its err <= 1.
+    '''
+
+    k = [f(x)]
+    for i in range(1, 7):
+        xi = x
+        for j, a in enumerate(DOPRI_A[i]):
+            if(a != 0):
+                xi = xi + (h * a) * k[j]
+        k.append(f(xi))
+    x_new = x + h * sum(b * ki for b, ki in zip(DOPRI_B, k) if b != 0)
+    e = h * sum(c * ki for c, ki in zip(DOPRI_E, k))
+    scale = atol + rtol * np.maximum(np.abs(x), np.abs(x_new))
+    err = np.sqrt(np.mean((e / scale) ** 2, axis=-1))
+    return x_new, err
+
+
+def dopri5_advance(f, x, duration, h, rtol, atol):
+    '''
+    This integrates a batch of states over duration seconds with adaptive
+    Dormand-Prince steps. Each state has its own step size and time, so a
+    stiff member of the batch does not shrink the steps of the others: the
+    states that have reached the end wait (with steps of size 0) until the
+    others do.
+
+    Input:
+        f: The derivatives of a batch of states.
+        x: B*d states.
+        duration: The time interval.
+        h: B-dimensional step sizes of the states, updated in place.
+        rtol, atol: Relative and absolute tolerances.
+    Output:
+        x: The B*d states after duration seconds.
+    '''
+
+    t = np.zeros(x.shape[0])
+    active = duration - t > 1e-12 * duration
+    while np.any(active):
+        h_try = np.where(active, np.minimum(h, duration - t), 0.)
+        x_new, err = dopri5_step(f, x, h_try[:, None], rtol, atol)
+        accept = active & (err <= 1)
+        factor = np.where(err > 0,
+                          0.9 * np.maximum(err, 1e-300) ** (-1 / 5), 5.)
+        h_new = h_try * np.clip(factor, 0.2, 5.)
+        # a step shortened to reach the end does not shrink the step size
+        h[:] = np.where(~active, h,
+                        np.where(accept & (h_try < h), np.maximum(h, h_new),
+                                 h_new))
+        t = np.where(accept, t + h_try, t)
+        x = np.where(accept[:, None], x_new, x)
+        active = duration - t > 1e-12 * duration
+    return x
+
+
+def integrate_batch(ODE_str, x0s, params, end_t, dt, method='dopri5',
+                    substeps=10, rtol=1e-6, atol=1e-9):
+    '''
+    This integrates a batch of initial states and/or parameters together.
+    Each stage evaluates the derivatives of all the states in one call of the
+    (vectorized) *_ode function.
+
+    Input:
+        ODE_str: Name of the model as a string, or an ODEModel object.
+        x0s: B*d initial states at time 0.
+        params: B*p parameters, or p-dimensional parameters shared by all the
+            initial states.
+        end_t: The final time of the simulation. The start time is 0.
+        dt: The time interval between samples.
+        method: 1) "dopri5" for the adaptive Dormand-Prince method, as in
+            simulate(), with a step size per state (see dopri5_advance()),
+            or 2) "rk4" for the classical Runge-Kutta method with substeps
+            fixed steps between samples.
+        substeps: Number of rk4 steps between two samples. The first step
+            size of dopri5 is dt/substeps.
+        rtol, atol: Relative and absolute tolerances of dopri5.
+    Output:
+        X: B*T*d numpy array that contains the clean states.
+    '''
+
+    model = get_model(ODE_str)
+    x = np.array(x0s, dtype=float)
+    params = np.asarray(params, dtype=float)
+    f = lambda z: model.rhs(0, z, params)
+
+    B, d = x.shape
+    T = int((end_t / dt) + 1) # number of observations
+    X = np.empty((B, T, d))
+    X[:, 0, :] = x
+    h = np.full(B, dt / substeps)
+    for idx in range(1, T):
+        if(method == 'rk4'):
+            for s in range(substeps):
+                x = rk4_step(f, x, dt / substeps)
+        else:
+            # adaptive steps until the next sample time
+            x = dopri5_advance(f, x, dt, h, rtol, atol)
+        X[:, idx, :] = x
+    return X
+
+
+def corpus_path(cache_dir, ODE_str, x0s, params, end_t, dt, noise_vars,
+                n_noise, seed, burn_in, method):
+    '''
+    This returns the file of a corpus in cache_dir. The name is a hash of all
+    the arguments that define the corpus.
+    '''
+
+    h = hashlib.sha1()
+    for a in (x0s, params, noise_vars):
+        h.update(np.ascontiguousarray(a, dtype=float).tobytes())
+    h.update(repr((get_model(ODE_str).name, end_t, dt, n_noise, seed,
+                   burn_in, method)).encode())
+    return os.path.join(cache_dir, '%s_%s.npz' % (get_model(ODE_str).name,
+                                                 h.hexdigest()[:16]))
+
+
+def generate_corpus(ODE_str, x0s, params, end_t, dt, noise_vars=(.5,),
+                    n_noise=1, seed=0, burn_in=0, method='dopri5',
+                    cache_dir=None):
+    '''
+    This creates a corpus of clean states and noisy observations for many
+    initial states, parameters and noise levels. Each clean trajectory is
+    integrated once and reused for all its noise draws.
+
+    Input:
+        ODE_str: Name of the model as a string, or an ODEModel object.
+        x0s: B*d initial states.
+        params: B*p parameters, or p-dimensional shared parameters.
+        end_t: The final time of the simulation. The start time is 0.
+        dt: The time interval between samples.
+        noise_vars: A list of noise levels, used as in simulate().
+        n_noise: Number of noise draws per trajectory and noise level.
+        seed: Seed of the random noise.
+        burn_in: If positive, the system is first integrated for burn_in
+            seconds (which need not be a multiple of dt) and the last states
+            are used as the initial states, as for lorenz96 in demo.py.
+        method: The integration method, see integrate_batch().
+        cache_dir: If set, the corpus is saved in this folder as a .npz file,
+            and loaded from it if it already exists.
+    Output:
+        X: B*T*d numpy array that contains the clean states.
+        Y: B*N*n_noise*T*d numpy array that contains the noisy observations,
+            where N is the number of noise levels.
+        dt: Time interval between samples.
+    '''
+
+    x0s = np.atleast_2d(np.asarray(x0s, dtype=float))
+    noise_vars = np.atleast_1d(np.asarray(noise_vars, dtype=float))
+    if(cache_dir is not None):
+        path = corpus_path(cache_dir, ODE_str, x0s, params, end_t, dt,
+                           noise_vars, n_noise, seed, burn_in, method)
+        if(os.path.exists(path)):
+            data = np.load(path)
+            return data['X'], data['Y'], float(data['dt'])
+
+    if(burn_in > 0):
+        # one interval of burn_in seconds, with the step sizes of the samples
+        n = int(np.ceil(burn_in / dt - 1e-9))
+        x0s = integrate_batch(ODE_str, x0s, params, burn_in, burn_in, method,
+                              substeps=10 * n)[:, -1, :]
+    X = integrate_batch(ODE_str, x0s, params, end_t, dt, method)
+
+    # create noisy observations
+    rng = np.random.default_rng(seed)
+    B, T, d = X.shape
+    noise = rng.normal(0, 1, (B, len(noise_vars), n_noise, T, d))
+    Y = X[:, None, None, :, :] + noise_vars[None, :, None, None, None] * noise
+
+    if(cache_dir is not None):
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp = path + '.tmp.npz'
+        np.savez(tmp, X=X, Y=Y, dt=dt)
+        os.replace(tmp, path)
+    return X, Y, dt
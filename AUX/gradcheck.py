@@ -0,0 +1,72 @@
+import autograd.numpy as np
+from autograd import grad, jacobian
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..', 'ODEs'))
+from ode_model import get_model
+from objectives import X_obj, param_obj, X_obj_and_grad, param_obj_and_grad
+
+
+def relative_error(a, b):
+    '''
+    Maximum absolute difference between a and b, relative to the size of b.
+    '''
+
+    return np.max(np.abs(a - b)) / max(1., np.max(np.abs(b)))
+
+
+def check_gradients(ODE_str, X, params, dt=0.01, appr='ad3', lam=1.):
+    '''
+    This compares the analytic Jacobians of a model and the gradients of the
+    objectives computed with them against autograd.
+
+    Input:
+        ODE_str: Name of the model as a string, or an ODEModel object with
+            has_jacobians = True.
+        X: T*d matrix of states where the derivatives are compared.
+        params: p-dimensional parameters.
+        dt: Time interval between the states.
+        appr: The type of discretization (e.g. "euler", "ad3" or "bdf2").
+        lam: The hyperparameter lambda in our paper.
+    Output:
+        errors: A dictionary with the relative errors of 'jac_x',
+            'jac_params', 'vjp_x', 'X_obj' and 'param_obj'.
+    '''
+
+    model = get_model(ODE_str)
+    X = np.asarray(X, dtype=float)
+    params = np.asarray(params, dtype=float)
+    T, d = X.shape
+    errors = {}
+
+    # Jacobians with respect to the state: row i of the Jacobian of all the
+    # time steps is the gradient of the sum of the i-th derivative.
+    J = model.jac_x(X, params)
+    J_auto = np.zeros((T - 1, d, d))
+    for i in range(d):
+        row_grad = grad(lambda Z: np.sum(model.rhs_vec(Z, params)[:, i]))
+        J_auto[:, i, :] = row_grad(X)[0:T - 1, :]
+    errors['jac_x'] = relative_error(J, J_auto)
+
+    Jp_auto = jacobian(lambda p: model.rhs_vec(X, p))(params)
+    errors['jac_params'] = relative_error(model.jac_params(X, params), Jp_auto)
+
+    G = np.random.randn(T - 1, d)
+    errors['vjp_x'] = relative_error(model.vjp_x(X, params, G),
+                                     np.einsum('ti,tij->tj', G, J_auto))
+
+    # Gradients of the objectives
+    x = X.flatten('F')
+    x0 = x + np.random.randn(T * d)
+    val, g = X_obj_and_grad(x, params, dt, x0, lam, d, appr, model)
+    g_auto = grad(X_obj)(x, params, dt, x0, lam, d, appr, model)
+    errors['X_obj'] = max(relative_error(g, g_auto), relative_error(
+        val, X_obj(x, params, dt, x0, lam, d, appr, model)))
+
+    val, g = param_obj_and_grad(params, X, dt, appr, model)
+    g_auto = grad(param_obj)(params, X, dt, appr, model)
+    errors['param_obj'] = max(relative_error(g, g_auto), relative_error(
+        val, param_obj(params, X, dt, appr, model)))
+
+    return errors
@@ -0,0 +1,250 @@
+import numpy as np
+from scipy.linalg import solve_triangular
+from scipy.optimize import OptimizeResult
+
+
+def value_and_grad(fun, jac):
+    '''
+    This returns a function that computes the value and the gradient
+    together, from the fun and jac arguments of scipy.optimize.minimize():
+    jac is either True (fun already returns both) or the gradient function.
+    '''
+
+    if(jac is True):
+        return fun
+    return lambda x, *args: (fun(x, *args), jac(x, *args))
+
+
+def products(M, v):
+    '''
+    The product M*v accumulated in float64, without a float64 copy of M
+    when M is stored in a lower precision.
+    '''
+
+    if(M.dtype == np.float64):
+        return M.dot(v)
+    return np.einsum('ij,j->i', M, v, dtype=np.float64)
+
+
+class LBFGS(object):
+    '''
+    This is an L-BFGS solver that keeps its curvature pairs (s, y) between
+    calls of minimize(). In fit_direct(), the subproblems over X (and over
+    the parameters) of two consecutive iterations differ only slightly, so
+    the pairs of the previous solve are a good approximation of the Hessian
+    of the next one. scipy's L-BFGS-B starts every solve from the scaled
+    identity, and rebuilds the same history each time.
+
+    The pairs that do not satisfy the curvature condition s'y > 0 are
+    skipped, and the memory is cleared when the direction is not a descent
+    direction or the line search fails, so an outdated history only costs
+    one steepest descent step.
+
+    Usage:
+        solver = LBFGS(maxcor=100, maxiter=10)
+        for k in range(n):
+            res = solver.minimize(fun_and_grad, x, args=(...))
+            x = res['x']
+    '''
+
+    def __init__(self, maxcor=100, maxiter=15000, gtol=1e-5, ftol=2.2e-9,
+                 max_ls=20, dtype=float):
+        '''
+        Input:
+            maxcor: Number of (s, y) pairs kept in memory.
+            maxiter: Maximum number of iterations of each minimize() call.
+                A small value gives an inexact block update.
+            gtol: The solve stops when max(|gradient|) <= gtol.
+            ftol: The solve stops when the relative decrease of the objective
+                is smaller than ftol. The defaults of gtol and ftol are those
+                of scipy's L-BFGS-B.
+            max_ls: Maximum number of steps of the line search.
+            dtype: The floating point type of the pairs, e.g. np.float32 to
+                halve the memory of the history. The iterates, the products
+                SY and YY (accumulated in float64 from the stored pairs) and
+                the line search are in float64. The products of the
+                direction with the pairs are in dtype.
+        '''
+
+        self.maxcor = maxcor
+        self.maxiter = maxiter
+        self.gtol = gtol
+        self.ftol = ftol
+        self.max_ls = max_ls
+        self.dtype = np.dtype(dtype)
+        # The pairs are stored in the rows of S and Y, which are used as a
+        # ring buffer: order lists the rows from the oldest to the newest
+        # pair. SY[i, j] = s_i'y_j and YY[i, j] = y_i'y_j are updated with
+        # each new pair.
+        self.S = None
+        self.Y = None
+        self.SY = np.zeros((maxcor, maxcor))
+        self.YY = np.zeros((maxcor, maxcor))
+        self.order = []
+        self.n_resets = 0
+
+    def reset(self):
+        '''
+        This clears the curvature memory.
+        '''
+
+        # The rows of the old pairs are overwritten by the next pairs.
+        self.order = []
+        self.n_resets = self.n_resets + 1
+
+    def get_state(self):
+        '''
+        This returns the curvature memory as a dictionary of arrays, e.g. to
+        save it in a checkpoint. Only the pairs in memory are included.
+        '''
+
+        if(self.S is None):
+            return {}
+        n = len(self.order)
+        rows = max(self.order) + 1 if n else 0
+        return {'S': self.S[:rows].copy(), 'Y': self.Y[:rows].copy(),
+                'SY': self.SY[:rows, :rows].copy(),
+                'YY': self.YY[:rows, :rows].copy(),
+                'order': np.array(self.order, dtype=int),
+                'n_resets': np.array(self.n_resets)}
+
+    def set_state(self, state):
+        '''
+        This restores the curvature memory returned by get_state().
+        '''
+
+        if('S' not in state):
+            return
+        rows, n = state['S'].shape
+        self.S = np.zeros((self.maxcor, n), dtype=self.dtype)
+        self.Y = np.zeros((self.maxcor, n), dtype=self.dtype)
+        self.S[:rows], self.Y[:rows] = state['S'], state['Y']
+        self.SY[:rows, :rows] = state['SY']
+        self.YY[:rows, :rows] = state['YY']
+        self.order = [int(i) for i in state['order']]
+        self.n_resets = int(state['n_resets'])
+
+    def update(self, s, y):
+        '''
+        This adds the pair (s, y) to the memory, and overwrites the oldest
+        one when the memory is full.
+        '''
+
+        if(self.S is None):
+            self.S = np.zeros((self.maxcor, s.size), dtype=self.dtype)
+            self.Y = np.zeros((self.maxcor, s.size), dtype=self.dtype)
+        if(len(self.order) == self.maxcor):
+            i = self.order.pop(0)
+        else:
+            i = len(self.order)
+        self.S[i], self.Y[i] = s, y
+        self.order.append(i)
+        # the pair in the precision of the memory
+        s, y = self.S[i], self.Y[i]
+        # The products with the rows that are not in order are not used.
+        Sy, Ys, Yy = products(self.S, y), products(self.Y, s), \
+            products(self.Y, y)
+        self.SY[:, i], self.SY[i, :] = Sy, Ys
+        self.YY[:, i], self.YY[i, :] = Yy, Yy
+
+    def direction(self, g):
+        '''
+        The L-BFGS direction -H*g, computed with the compact representation
+        of H (Byrd, Nocedal, Schnabel [1994]), i.e. with a few matrix-vector
+        products instead of the loops of the two-loop recursion:
+            H = gamma*I + [S' gamma*Y'] M [S; gamma*Y], with
+            M = [R^-T (D + gamma*Y*Y') R^-1, -R^-T; -R^-1, 0],
+        where R is the upper triangle of S*Y' and D its diagonal, with the
+        pairs in chronological order.
+        '''
+
+        if(not self.order):
+            return -min(1., 1. / max(np.linalg.norm(g), 1e-12)) * g
+        o = self.order
+        k = len(o)
+        # initial Hessian scaled with the most recent pair
+        gamma = self.SY[o[-1], o[-1]] / self.YY[o[-1], o[-1]]
+        gm = g.astype(self.dtype, copy=False)
+        a, b = self.S[:k].dot(gm)[o], self.Y[:k].dot(gm)[o]
+        SY = self.SY[np.ix_(o, o)]
+        R = np.triu(SY)
+        Ria = solve_triangular(R, a)
+        p1 = solve_triangular(R, np.diag(SY) * Ria +
+                              gamma * (self.YY[np.ix_(o, o)].dot(Ria) - b),
+                              trans='T')
+        # back from the chronological order to the rows of S and Y
+        p1_rows, p2_rows = np.empty(k), np.empty(k)
+        p1_rows[o], p2_rows[o] = p1, -gamma * Ria
+        Hg = gamma * g + \
+            self.S[:k].T.dot(p1_rows.astype(self.dtype, copy=False)) + \
+            self.Y[:k].T.dot(p2_rows.astype(self.dtype, copy=False))
+        return -Hg
+
+    def minimize(self, fun, x0, args=()):
+        '''
+        This minimizes fun starting from x0, with the curvature pairs of the
+        previous calls.
+
+        Input:
+            fun: A function fun(x, *args) that returns the value and the
+                gradient of the objective (see value_and_grad()).
+            x0: The initialization.
+            args: Extra arguments of fun.
+        Output:
+            res: scipy OptimizeResult. res['x'] is the solution, res['fun']
+                and res['jac'] its value and gradient, res['nit'] and
+                res['nfev'] the number of iterations and of evaluations.
+        '''
+
+        x = np.array(x0, dtype=float)
+        if(self.S is not None and self.S.shape[1] != x.size):
+            self.S = None
+            self.reset()
+        f, g = fun(x, *args)
+        g = np.asarray(g, dtype=float)
+        nfev = 1
+        success, message = False, 'maximum number of iterations'
+        nit = 0
+        while nit < self.maxiter:
+            if(np.max(np.abs(g)) <= self.gtol):
+                success, message = True, 'gradient smaller than gtol'
+                break
+            p = self.direction(g)
+            gp = np.dot(g, p)
+            if(not gp < 0):
+                # the memory is outdated, restart from steepest descent
+                self.reset()
+                p = self.direction(g)
+                gp = np.dot(g, p)
+
+            # backtracking line search (Armijo condition) with quadratic
+            # interpolation
+            t = 1.
+            for ls in range(self.max_ls):
+                x_new = x + t * p
+                f_new, g_new = fun(x_new, *args)
+                nfev = nfev + 1
+                if(f_new <= f + 1e-4 * t * gp):
+                    break
+                denom = 2 * (f_new - f - gp * t)
+                t_q = -gp * t * t / denom if np.isfinite(denom) and denom > 0 \
+                    else .1 * t
+                t = min(max(t_q, .1 * t), .5 * t)
+            else:
+                self.reset()
+                message = 'line search failed'
+                break
+            nit = nit + 1
+
+            g_new = np.asarray(g_new, dtype=float)
+            s, y = x_new - x, g_new - g
+            sy = np.dot(s, y)
+            if(sy > 1e-10 * np.dot(y, y)):
+                self.update(s, y)
+            f_prev = f
+            x, f, g = x_new, f_new, g_new
+            if(f_prev - f <= self.ftol * max(abs(f_prev), abs(f), 1.)):
+                success, message = True, 'relative reduction smaller than ftol'
+                break
+        return OptimizeResult(x=x, fun=f, jac=g, nit=nit, nfev=nfev,
+                              success=success, message=message)
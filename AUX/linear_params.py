@@ -0,0 +1,67 @@
+import autograd.numpy as np
+from discretization import model_input, step_weights, combine
+
+
+def linear_system(X, dt, appr, model, features=None, weights=None):
+    '''
+    This returns the linear least squares problem of the parameters, for
+    the models that are linear in the parameters: the residuals of eq.(7)
+    [Euler] or eq.(13a) [multistep] of the paper are b - M*params.
+
+    Input:
+        The same as linear_param_step().
+        features: Optional Phi and c of model.features(), if they are
+            already computed.
+        weights: Optional weights (A, H) of the residuals, e.g. of a window
+            of the time grid (see online.py), step_weights() by default.
+    Output:
+        M: ((T-1)*d)*p matrix.
+        b: (T-1)*d vector.
+    '''
+
+    if(features is None):
+        features = model.features(model_input(X, appr))
+    Phi, c = features
+    p = Phi.shape[2]
+    if(weights is None):
+        weights = step_weights(appr, X.shape[0] - 1, dt)
+    A, H = weights
+    M = combine(Phi, H).reshape(-1, p)
+    b = (combine(X, A) - combine(c, H)).ravel()
+    return M, b
+
+
+def solve_linear_system(M, b):
+    '''
+    This solves the least squares problem min ||b - M*params||^2 with the
+    normal equations.
+    '''
+
+    G = np.dot(M.T, M)
+    h = np.dot(M.T, b)
+    try:
+        return np.linalg.solve(G, h)
+    except np.linalg.LinAlgError:
+        # The features do not determine the parameters uniquely.
+        return np.linalg.lstsq(M, b, rcond=None)[0]
+
+
+def linear_param_step(X, dt, appr, model):
+    '''
+    This minimizes the objective function over the parameters in eq.(7)
+    [Euler] or eq.(13a) [multistep] of the paper, for the models that are
+    linear in the parameters. The objective is then a linear least squares
+    problem in the parameters, which is solved with the normal equations.
+
+    Input:
+        X: T*d matrix of the current states X^*(n-1) in eq(7) or eq(13a).
+        dt: Time interval between the states, or a (T-1)-dimensional array
+            of the intervals.
+        appr: The type of discretization, e.g. "euler", "ad3" or "bdf2".
+        model: The ODEModel object of the model. model.linear_in_params
+            has to be True.
+    Output:
+        params: p-dimensional estimated parameters.
+    '''
+
+    return solve_linear_system(*linear_system(X, dt, appr, model))
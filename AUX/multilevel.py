@@ -0,0 +1,196 @@
+import numpy as np
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..', 'ODEs'))
+from ode_model import get_model
+from fit_direct import fit_direct
+from discretization import n_steps
+from outofcore import open_series
+
+
+# The options of fit_direct() that only apply to the finest level.
+FINE_ONLY = ('out', 'pred_out', 'checkpoint', 'resume')
+
+
+def grid_times(dt, T):
+    '''
+    The times of the T states of a time grid starting at 0, with a uniform
+    dt or an array of intervals.
+    '''
+
+    return np.concatenate(([0.], np.cumsum(np.broadcast_to(dt, (T - 1,)))))
+
+
+def coarsen(Y, dt, factor, coarsening='average'):
+    '''
+    This returns a coarser copy of the series Y, with every factor-th state.
+
+    Input:
+        Y: T*d observations, with NaN for the missing entries. Any array
+            that supports indexing with an array of rows is accepted (e.g.
+            np.memmap), and only T/factor rows are read at a time.
+        dt: Time interval between the observations, or the array of the
+            intervals.
+        factor: The coarsening factor.
+        coarsening: 1) "subsample" to keep the states 0, factor, 2*factor,
+            ..., or 2) "average" to replace each of them by the mean of the
+            observed entries within factor//2 states around it, which also
+            averages out the noise.
+    Output:
+        Yc: The coarse observations, NaN where no entry was observed.
+        dtc: The time interval between them, factor*dt for a uniform grid,
+            or the array of the intervals.
+        idx: The indices of the coarse states in Y.
+    '''
+
+    T = Y.shape[0]
+    idx = np.arange(0, T, factor)
+    if(np.ndim(dt) == 0):
+        dtc = factor * dt
+    else:
+        dtc = np.diff(grid_times(dt, T)[idx])
+
+    if(coarsening == 'subsample'):
+        return np.array(Y[idx], dtype=float), dtc, idx
+    if(coarsening != 'average'):
+        raise ValueError('Unknown coarsening: %r' % (coarsening,))
+    total = np.zeros((len(idx),) + tuple(Y.shape[1:]))
+    count = np.zeros(total.shape)
+    for o in range(-(factor // 2), factor // 2 + 1):
+        rows = idx + o
+        inside = (rows >= 0) & (rows < T)
+        Yo = np.array(Y[rows[inside]], dtype=float)
+        observed = ~np.isnan(Yo)
+        total[inside] += np.where(observed, Yo, 0.)
+        count[inside] += observed
+    Yc = np.full(total.shape, np.nan)
+    np.divide(total, count, out=Yc, where=count > 0)
+    return Yc, dtc, idx
+
+
+def refine(Xc, times_c, times):
+    '''
+    This interpolates the states Xc at the times times_c linearly to the
+    times of a finer grid. The states after the last coarse time are set to
+    the last coarse state.
+    '''
+
+    X = np.empty((len(times), Xc.shape[1]))
+    for i in range(Xc.shape[1]):
+        X[:, i] = np.interp(times, times_c, Xc[:, i])
+    return X
+
+
+def fit_multilevel(Y, dt, init_params, ODE_str, appr='euler', n_levels=3,
+                   factor=2, coarsening='average', coarse_iters=200,
+                   max_iters=10000, return_info=False, mask=None,
+                   min_states=10, transfer='params', **kwargs):
+    '''
+    This runs fit_direct() from coarse to fine time grids. The coarsest
+    level fits a copy of Y with factor**(n_levels-1) times fewer states.
+    The parameters of each level are the initialization of the next, finer
+    level's parameters. The parameters move from init_params to the
+    neighbourhood of the answer on the small problems, and the finest level
+    (Y itself) starts from there.
+
+    The coarse grids have a larger discretization error, so their estimates
+    are biased, and their fits are kept short: the states of BCD-prox drift
+    away from the observations over the iterations, which does not help the
+    finer levels. The objective has no term that brings the states back to
+    the observations (they only initialize the states), so the states of a
+    coarse level are only passed to the next level with transfer="states".
+    This saves iterations, but the estimates of the finest level keep the
+    drift and the bias of the coarse levels: on the FitzHugh-Nagumo,
+    Rossler and Lotka-Volterra examples of demo.py, the prediction error is
+    3 to 20 times that of fit_direct(). With transfer="params", the coarse
+    levels only move the initial parameters. This only helps the iterative
+    parameter steps, when init_params is far from the answer and the
+    parameter step is inexact (inner_maxiter): on FitzHugh-Nagumo from
+    init_params [20, 20, 50] with inner_maxiter=3, the finest level stops
+    on tol in fewer iterations than fit_direct() needs, with a much smaller
+    error. With the solutions of the parameter step, the estimates are
+    those of fit_direct() within the tolerance of the solvers. The closed
+    form parameter step of the models that are linear in the parameters
+    does not depend on the initial parameters at all, so then the coarse
+    levels are skipped and this is fit_direct().
+
+    Input:
+        Y, dt, init_params, ODE_str, appr: As in fit_direct(). Y can also be
+            the name of a .npy file, which is memory-mapped.
+        n_levels: Number of levels, including the finest one.
+        factor: The coarsening factor between two levels.
+        coarsening: "average" or "subsample", see coarsen().
+        coarse_iters: Maximum number of iterations of each coarse level.
+        max_iters: Maximum number of iterations of the finest level.
+        return_info: If True, the information of fit_direct() about the
+            finest level is also returned, with 'levels': a list with, for
+            each level from the coarsest, the 'factor', the number of states
+            'T', the 'params' and the 'n_iters' and 'cost' of its fit.
+        mask: T*d boolean matrix of the observed entries of Y, or None to use
+            the entries of Y that are not NaN.
+        min_states: The levels with fewer states (or fewer than 2*(K+1) for
+            a K-step discretization) are skipped.
+        transfer: 1) "params" to initialize the states of each level with
+            its observations, as in fit_direct(), or 2) "states" to
+            initialize them with the interpolated states of the previous
+            level (faster, but less accurate, see above). The coarse levels
+            are then always run. The tol test
+            of the finest level is only applied after coarse_iters
+            iterations (min_iters of fit_direct()), since the first
+            iterations after the switch decrease the objective slowly.
+        kwargs: The other options of fit_direct(), e.g. lam, tol or
+            X_solver. The options of the files (out, pred_out, checkpoint and
+            resume) only apply to the finest level.
+    Output:
+        params, X, pred_X (and info): As in fit_direct() for the finest
+            level.
+    '''
+
+    Y = open_series(Y)
+    T = Y.shape[0]
+    if(mask is not None):
+        Y = np.where(mask, Y, np.nan)
+    coarse_kwargs = {key: value for key, value in kwargs.items()
+                     if key not in FINE_ONLY}
+    min_states = max(min_states, 2 * (n_steps(appr) + 1))
+    times = grid_times(dt, T)
+
+    if(transfer not in ('params', 'states')):
+        raise ValueError('Unknown transfer: %r' % (transfer,))
+    if(transfer == 'states'):
+        kwargs.setdefault('min_iters', coarse_iters)
+    params = np.asarray(init_params, dtype=float)
+    X_prev, times_prev = None, None
+    levels = []
+    # the closed form parameter step does not use the initial parameters
+    param_solver = kwargs.get('param_solver', 'auto')
+    if(transfer == 'params' and (param_solver == 'linear' or (
+            param_solver == 'auto' and get_model(ODE_str).linear_in_params))):
+        n_levels = 1
+    for level in range(n_levels - 1, 0, -1):
+        f = factor ** level
+        if(-(-T // f) < min_states):
+            continue
+        Yc, dtc, idx = coarsen(Y, dt, f, coarsening)
+        init_X = None if X_prev is None or transfer == 'params' else \
+            refine(X_prev, times_prev, times[idx])
+        params, X_prev, pred_X, info = fit_direct(
+            Yc, dtc, params, ODE_str, appr, max_iters=coarse_iters,
+            return_info=True, init_X=init_X, **coarse_kwargs)
+        times_prev = times[idx]
+        levels.append({'factor': f, 'T': len(idx), 'params': params,
+                       'n_iters': info['n_iters'], 'cost': info['cost']})
+
+    # the finest level
+    init_X = None if X_prev is None or transfer == 'params' else \
+        refine(X_prev, times_prev, times)
+    params, X, pred_X, info = fit_direct(
+        Y, dt, params, ODE_str, appr, max_iters=max_iters, return_info=True,
+        init_X=init_X, **kwargs)
+    levels.append({'factor': 1, 'T': T, 'params': params,
+                   'n_iters': info['n_iters'], 'cost': info['cost']})
+    if(return_info):
+        info['levels'] = levels
+        return params, X, pred_X, info
+    return params, X, pred_X
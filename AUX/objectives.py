@@ -1,13 +1,8 @@
 import autograd.numpy as np
-import sys
-sys.path.append('./ODEs/')
-from fitzhugh_nagumo import *
-from lotka_volterra import *
-from lorenz96 import *
-from rossler import *
+from discretization import model_input, residuals, residuals_adjoint
 
 
-def X_obj(x, params, dt, x0, lam, d, appr, ODE_str):
+def X_obj(x, params, dt, x0, lam, d, appr, model, mask=None):
     '''
     This is the objective function over the states X,
     in eq.(8) [Euler] or eq. (13b) [multistep] of the paper.
@@ -15,15 +10,20 @@ def X_obj(x, params, dt, x0, lam, d, appr, ODE_str):
     Input:
         x: The Flattened current state X in eq(8) or eq(13b) of the paper.
         params: p-dimensional parameter \theta^*(n) in eq(8) or eq(13b) of the paper.
-        dt: Time interval between the states.
+        dt: Time interval between the states, or a (T-1)-dimensional array
+            of the intervals between consecutive states.
         x0: The Flattened previous state X^*(n-1) in eq(8) or eq(13b) of the paper).
         lam: The hyperparameter lambda in our paper.
         d: dimension of the states.
-        appr: This determines the type of discretization and takes one of the
-            three strings: 1)"euler" for 1-step Euler, 2) "ad2" for the 2-step
-             Adam-Bashforth, and 3) "ad3" for the 3-step Adam-Bashforth.
-        ODE_str: Name of the model as a string. Set ODE_str to
-                'fitzhugh_nagumo' or 'lotka_volterra' or 'rossler' or 'lorenz96'
+        appr: This determines the type of discretization: 1)"euler" for
+            1-step Euler, 2) "ad2" for the 2-step Adam-Bashforth, 3) "ad3" for
+            the 3-step Adam-Bashforth, or any other method of
+            discretization.py, e.g. "ab4", "am2" or "bdf3".
+        model: The ODEModel object of the model, see get_model() in
+                ODEs/ode_model.py.
+        mask: Optional weights of the proximal term, flattened like x: 1 for
+            the observed entries and 0 for the missing ones, which are only
+            determined by the ODE.
     Output:
         objval: Return the objective value
     '''
@@ -32,33 +32,22 @@ def X_obj(x, params, dt, x0, lam, d, appr, ODE_str):
     T = int(Td / d)
     X = x.reshape((d,T)).T # Put X in the original T by d matrix
 
-    # String to function. Given the current X and parameter,
+    # Given the current X and parameter,
     # it gives us the dX(t)/dt in eq.(1) of the paper.
-    ode_vec = eval(ODE_str + '_ode_vec')
-    terms = ode_vec(X,params)
+    terms = model.rhs_vec(model_input(X, appr), params)
 
-    if(appr == 'euler'):
-        # objective in eq(8) of the paper.
-        objval = np.sum((X[1:T, :] - X[0:T - 1, :] - (terms*dt)) ** 2)
-    else:
-        # objective in eq(13b) of the paper, where the order is 3.
-        temp = (X[1, :] - X[0, :] - (terms[0,:]*dt))
-        objval = np.sum(temp ** 2)
-
-        temp = (X[2, :] - X[1, :] - ((3/2)*(terms[1,:]*dt)))\
-                + ((1/2)*terms[0,:]*dt)
-        objval = objval + np.sum(temp ** 2)
-
-        temp = (X[3:T, :] - X[2:T-1, :] - ((23 / 12) * (terms[2:T-1, :] * dt)))\
-               + ((4 / 3) * terms[1:T-2, :] * dt) - ((5 / 12) * terms[0:T-3, :] * dt)
-        objval = objval + np.sum(temp ** 2)
+    # objective in eq(8) [Euler] or eq(13b) [multistep] of the paper.
+    objval = np.sum(residuals(X, terms, dt, appr) ** 2)
 
     # compute and return the objective value
-    objval = objval + lam*np.sum((x - x0)**2)
+    if(mask is None):
+        objval = objval + lam*np.sum((x - x0)**2)
+    else:
+        objval = objval + lam*np.sum(mask*(x - x0)**2)
     return objval
 
 
-def param_obj(params, X, dt,appr,ODE_str):
+def param_obj(params, X, dt,appr,model):
     '''
      This is the objective function over the states X,
      in eq.(7) [Euler] or eq. (13a) [multistep] of the paper.
@@ -66,39 +55,80 @@ def param_obj(params, X, dt,appr,ODE_str):
      Input:
          params: p-dimensional parameter \theta in eq(7) or eq(13a) of the paper.
          X: T*d matrix of the current states X^*(n-1) in eq(7) or eq(13a) of the paper.
-         dt: Time interval between the states.
-         appr: This determines the type of discretization and takes one of the
-            three strings: 1)"euler" for 1-step Euler, 2) "ad2" for the 2-step
-             Adam-Bashforth, and 3) "ad3" for the 3-step Adam-Bashforth.
-         ODE_str: Name of the model as a string. Set ODE_str to
-                'fitzhugh_nagumo' or 'lotka_volterra' or 'rossler' or 'lorenz96'
+         dt: Time interval between the states, or a (T-1)-dimensional array
+            of the intervals between consecutive states.
+         appr: This determines the type of discretization: 1)"euler" for
+            1-step Euler, 2) "ad2" for the 2-step Adam-Bashforth, 3) "ad3" for
+            the 3-step Adam-Bashforth, or any other method of
+            discretization.py, e.g. "ab4", "am2" or "bdf3".
+         model: The ODEModel object of the model, see get_model() in
+                ODEs/ode_model.py.
 
      Output:
          objval: Return the objective value of eq(7) or eq(13a)
      '''
 
-    T = X.shape[0] # number of observations
-
-    # String to function. Given the current X and parameter,
+    # Given the current X and parameter,
     # it gives us the dX(t)/dt in eq.(1) of the paper.
-    ode_vec = eval(ODE_str + '_ode_vec')
-    terms = ode_vec(X, params)
+    terms = model.rhs_vec(model_input(X, appr), params)
+
+    # objective in eq(7) [Euler] or eq(13a) [multistep] of the paper.
+    return np.sum(residuals(X, terms, dt, appr) ** 2)
+
+
+def X_obj_and_grad(x, params, dt, x0, lam, d, appr, model, mask=None,
+                   cache=None):
+    '''
+    This returns the value and the gradient of X_obj() in one pass, with the
+    analytic Jacobians of the model instead of autograd. It can be used in
+    scipy.optimize.minimize() with jac=True.
+
+    Input:
+        The same as X_obj(). model.has_jacobians has to be True.
+        cache: Optional EvalCache (see evalcache.py) of the derivatives at
+            the states of the parameter step, which are reused when x has
+            the same values.
+    Output:
+        objval: The objective value.
+        objgrad: The gradient with respect to x (flattened like x).
+    '''
 
+    Td = x.shape[0] # Td = multiplication of T and d.
+    T = int(Td / d)
+    X = x.reshape((d,T)).T # Put X in the original T by d matrix
 
-    if(appr == 'euler'):
-        # objective in eq(7) of the paper.
-        objval = np.sum((X[1:T, :] - X[0:T - 1, :] - (terms*dt)) ** 2)
+    if(cache is None):
+        Z = model_input(X, appr)
+        terms = model.rhs_vec(Z, params)
     else:
-        # objective in eq(13a) of the paper.
-        temp = (X[1, :] - X[0, :] - (terms[0,:]*dt))
-        objval = np.sum(temp ** 2)
+        Z, terms = cache.terms(X, params)
+    R = residuals(X, terms, dt, appr)
+    diff = x - x0 if mask is None else mask * (x - x0)
+    objval = np.sum(R ** 2) + lam * np.sum(diff * (x - x0))
+
+    # backpropagate 2*R through the residuals
+    Xgrad, G = residuals_adjoint(2 * R, dt, appr, T, terms.shape[0])
+    Xgrad[0:G.shape[0], :] += model.vjp_x(Z, params, G)
+    objgrad = Xgrad.T.ravel() + 2 * lam * diff
+    return objval, objgrad
 
-        temp = (X[2, :] - X[1, :] - ((3/2)*(terms[1,:]*dt)))\
-                + ((1/2)*terms[0,:]*dt)
-        objval = objval + np.sum(temp ** 2)
 
-        temp = (X[3:T, :] - X[2:T-1, :] - ((23 / 12) * (terms[2:T-1, :] * dt)))\
-               + ((4 / 3) * terms[1:T-2, :] * dt) - ((5 / 12) * terms[0:T-3, :] * dt)
-        objval = objval + np.sum(temp ** 2)
+def param_obj_and_grad(params, X, dt, appr, model):
+    '''
+    This returns the value and the gradient of param_obj() in one pass, with
+    the analytic Jacobians of the model instead of autograd. It can be used
+    in scipy.optimize.minimize() with jac=True.
+
+    Input:
+        The same as param_obj(). model.has_jacobians has to be True.
+    Output:
+        objval: The objective value.
+        objgrad: The p-dimensional gradient with respect to params.
+    '''
 
-    return objval
\ No newline at end of file
+    T = X.shape[0] # number of observations
+    Z = model_input(X, appr)
+    terms = model.rhs_vec(Z, params)
+    R = residuals(X, terms, dt, appr)
+    G = residuals_adjoint(2 * R, dt, appr, T, terms.shape[0])[1]
+    return np.sum(R ** 2), model.vjp_params(Z, params, G)
@@ -0,0 +1,296 @@
+import autograd.numpy as np
+from scipy.optimize import minimize
+from autograd import grad, jacobian
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..', 'ODEs'))
+from ode_model import get_model
+from discretization import (model_input, n_steps, window_weights, combine,
+                            combine_adjoint)
+from linear_params import linear_system, solve_linear_system
+from segments import chunk_obj, chunk_obj_and_grad
+
+
+def window_param_obj(params, X, Aw, Hw, appr, model):
+    '''
+    This is param_obj() of objectives.py over the residuals of a window,
+    with the weights Aw, Hw of OnlineFit.weights().
+    '''
+
+    terms = model.rhs_vec(model_input(X, appr), params)
+    return np.sum((combine(X, Aw) - combine(terms, Hw)) ** 2)
+
+
+def window_param_obj_and_grad(params, X, Aw, Hw, appr, model):
+    '''
+    This returns the value and the gradient of window_param_obj() with the
+    analytic Jacobians of the model, as param_obj_and_grad().
+    '''
+
+    Z = model_input(X, appr)
+    terms = model.rhs_vec(Z, params)
+    R = combine(X, Aw) - combine(terms, Hw)
+    G = -combine_adjoint(2 * R, Hw, terms.shape[0])
+    return np.sum(R ** 2), model.vjp_params(Z, params, G)
+
+
+class OnlineFit(object):
+    '''
+    This runs BCD-prox online, on a sliding window of the most recent
+    observations. When a new observation arrives, the window is shifted, the
+    states and the parameters are warm-started from the previous window, and
+    a fixed number of BCD iterations is run on the window only. The state
+    that leaves the window is marginalized into a quadratic prior on the
+    first K states of the window, where K is the number of steps of the
+    discretization (see marginalize()). The window only has the residuals
+    of the time steps whose states are all in it; the others are in the
+    prior. The cost of each update does not depend on the length of the
+    history.
+
+    Usage:
+        fit = OnlineFit(dt, init_params, 'lorenz96', appr='ad3', window=200)
+        for y in stream:
+            params, x = fit.update(y)
+
+    Attributes:
+        params: The current estimate of the parameters.
+        X: W*d matrix of the estimated states of the window.
+        n_samples: Number of observations received so far.
+        prior: None, or (center, H, b): the prior on the first K states x of
+            the window, flattened in time-major order, is
+            (x-center)'H(x-center) + 2b'(x-center).
+    '''
+
+    def __init__(self, dt, init_params, ODE_str, appr='euler', lam=1,
+                 window=100, n_iters=5, inner_maxiter=50, prior_weight=1.):
+        '''
+        Input:
+            dt: Time interval between the observations (states).
+            init_params: p-dimensional initialization for the parameters.
+            ODE_str: Name of the model as a string, or an ODEModel object.
+            appr: The type of discretization (e.g. "euler", "ad3" or "bdf2").
+            lam: The hyper-parameter lambda in our method.
+            window: Number of states W in the window, at least K+1.
+            n_iters: Number of BCD iterations per update.
+            inner_maxiter: Maximum number of L-BFGS iterations of each block.
+            prior_weight: Weight of the prior on the first states of the
+                window, which replaces the states that left the window. With
+                1, it is the marginal of the terms that are dropped; with 0,
+                the window forgets them.
+        '''
+
+        self.dt = dt
+        self.params = np.array(init_params, dtype=float)
+        self.model = get_model(ODE_str)
+        self.appr = appr
+        self.lam = lam
+        self.window = window
+        self.n_iters = n_iters
+        self.inner_maxiter = inner_maxiter
+        self.prior_weight = prior_weight
+        self.prior = None
+        self.X = None
+        self.n_samples = 0
+        # The discretization needs at least this many states.
+        self.min_window = n_steps(appr) + 1
+        if(window < self.min_window):
+            raise ValueError('The window of %r needs at least %d states.'
+                             % (appr, self.min_window))
+        if(not self.model.has_jacobians):
+            self.param_grad = grad(window_param_obj)
+            self.X_grad = grad(chunk_obj)
+
+    def update(self, y):
+        '''
+        This adds one or more observations and updates the estimates.
+
+        Input:
+            y: d-dimensional observation, or an n*d matrix of observations.
+        Output:
+            params: The current estimate of the parameters.
+            x: The estimate of the most recent state.
+        '''
+
+        Y = np.array(y, dtype=float).reshape(-1, np.shape(y)[-1])
+        for row in Y:
+            self.add_observation(row)
+            if(self.X.shape[0] >= self.min_window):
+                for k in range(self.n_iters):
+                    self.param_step()
+                    self.state_step()
+        return self.params, self.X[-1, :]
+
+    def add_observation(self, y):
+        '''
+        This shifts the window by one observation. The new state is
+        initialized with the observation, as in fit_direct(), and the first
+        state is marginalized into the prior when the window is full.
+        '''
+
+        self.n_samples = self.n_samples + 1
+        if(self.X is None):
+            self.X = y.reshape(1, -1)
+            return
+        self.X = np.concatenate((self.X, y.reshape(1, -1)), 0)
+        if(self.X.shape[0] > self.window):
+            self.prior = self.marginalize()
+            self.X = self.X[1:, :]
+
+    def start(self):
+        '''
+        The index of the first state of the window in the whole history.
+        '''
+
+        return self.n_samples - self.X.shape[0]
+
+    def weights(self):
+        '''
+        The weights (A, H) of the residuals of the window, i.e. the rows of
+        step_weights() of the whole history. The first K-1 rows are zero
+        once the window has moved, since these residuals also depend on
+        states that left the window, and they are in the prior.
+        '''
+
+        s = self.start()
+        A, H = window_weights(self.appr, self.dt, s, s + self.X.shape[0])
+        if(s > 0):
+            K = n_steps(self.appr)
+            A[0:K - 1], H[0:K - 1] = 0, 0
+        return A, H
+
+    def linearize(self):
+        '''
+        The residuals that depend on the first state of the window and are
+        not in the prior, and their Jacobians with respect to the first K+1
+        states. They are the start-up steps 0, ..., K-1 of the history when
+        the window has not moved, and the step whose oldest state is the
+        first state of the window otherwise.
+
+        Output:
+            r: n*d vector of the residuals.
+            J: (n*d)*((K+1)*d) Jacobian.
+        '''
+
+        K = n_steps(self.appr)
+        s = self.start()
+        X = self.X[0:K + 1]
+        d = X.shape[1]
+        # rhs_vec() and jac_x() evaluate all the rows but the last one
+        Z = np.concatenate((X, X[-1:]), 0)
+        F = self.model.rhs_vec(Z, self.params)
+        if(self.model.has_jacobians):
+            Jf = self.model.jac_x(Z, self.params)
+        else:
+            f = lambda x: self.model.rhs_vec(np.stack((x, x)), self.params)[0]
+            Jf = np.stack([jacobian(f)(x) for x in X])
+        # the steps s, ..., s+K-1 predict the states 1, ..., K of X
+        A, H = window_weights(self.appr, self.dt, s, s + K + 1)
+        rows = range(K) if s == 0 else [K - 1]
+        r = np.zeros((len(rows), d))
+        J = np.zeros((len(rows), d, K + 1, d))
+        for m, t in enumerate(rows):
+            for j in range(K + 1):
+                i = t + 1 - j
+                if(i < 0 or (A[t, j] == 0 and H[t, j] == 0)):
+                    continue
+                r[m] = r[m] + A[t, j] * X[i] - H[t, j] * F[i]
+                J[m, :, i] = A[t, j] * np.eye(d) - H[t, j] * Jf[i]
+        return r.ravel(), J.reshape((len(rows) * d, (K + 1) * d))
+
+    def marginalize(self):
+        '''
+        This returns the prior on the states 1, ..., K of the window when
+        its first state x0 leaves. The terms of the objective over the
+        states that depend on x0 are the prior on the states 0, ..., K-1,
+        the proximal term lam*|x0-x0^*|^2 (centered at the last estimate,
+        which stands for the observation of x0) and the residuals of
+        linearize(), which only depend on the states 0, ..., K. With the
+        residuals linearized at the estimates (the Gauss-Newton
+        approximation), they are a quadratic in these states with the
+        Hessian (halved) Q = J'J + lam*I_0 + P and the gradient q = J'r + g,
+        where P, g are the Hessian and the gradient (halved) of the prior.
+        Minimizing over x0 (the Schur complement of its block) leaves the
+        quadratic in the states 1, ..., K:
+            H = Q11 - Q10 Q00^-1 Q01,  b = q1 - Q10 Q00^-1 q0.
+        It is exact for the models that are linear in the states.
+
+        Output:
+            (center, H, b), see the prior attribute.
+        '''
+
+        K = n_steps(self.appr)
+        d = self.X.shape[1]
+        r, J = self.linearize()
+        Q = np.dot(J.T, J)
+        q = np.dot(J.T, r)
+        Q[0:d, 0:d] = Q[0:d, 0:d] + self.lam * np.eye(d)
+        if(self.prior is not None):
+            center, P, g = self.prior
+            n = K * d
+            diff = self.X[0:K].ravel() - center
+            Q[0:n, 0:n] = Q[0:n, 0:n] + self.prior_weight * P
+            q[0:n] = q[0:n] + self.prior_weight * (np.dot(P, diff) + g)
+        Q01 = Q[0:d, d:]
+        S = np.linalg.solve(Q[0:d, 0:d],
+                            np.concatenate((Q01, q[0:d].reshape(-1, 1)), 1))
+        H = Q[d:, d:] - np.dot(Q01.T, S[:, 0:-1])
+        b = q[d:] - np.dot(Q01.T, S[:, -1])
+        return self.X[1:K + 1].ravel().copy(), (H + H.T) / 2, b
+
+    def param_step(self):
+        '''
+        Optimization over the parameters given the states of the window.
+        '''
+
+        Aw, Hw = self.weights()
+        if(self.model.linear_in_params):
+            self.params = solve_linear_system(*linear_system(
+                self.X, self.dt, self.appr, self.model, weights=(Aw, Hw)))
+            return
+        if(self.model.has_jacobians):
+            fun, jac = window_param_obj_and_grad, True
+        else:
+            fun, jac = window_param_obj, self.param_grad
+        res = minimize(fun, self.params, method='L-BFGS-B', jac=jac,
+                       args=(self.X, Aw, Hw, self.appr, self.model),
+                       options={'maxcor': 100, 'maxiter': self.inner_maxiter})
+        self.params = res['x']
+
+    def state_obj(self, x, x0, weights=None):
+        '''
+        The objective over the states of the window, flattened in time-major
+        order: the residuals of the window and the proximal term, as
+        chunk_obj() in segments.py, plus the prior on the first K states. It
+        returns the value and the gradient.
+        '''
+
+        T, d = self.X.shape
+        Aw, Hw = self.weights() if weights is None else weights
+        args = (self.X, 0, T, self.params, Aw, Hw, x0, self.lam, None,
+                self.appr, self.model)
+        if(self.model.has_jacobians):
+            val, g = chunk_obj_and_grad(x, *args)
+        else:
+            val, g = chunk_obj(x, *args), self.X_grad(x, *args)
+        if(self.prior is not None):
+            center, H, b = self.prior
+            n = center.shape[0]
+            diff = x[0:n] - center
+            Hdiff = np.dot(H, diff)
+            val = val + self.prior_weight * (np.dot(diff, Hdiff) +
+                                             2 * np.dot(b, diff))
+            g = np.array(g)
+            g[0:n] = g[0:n] + 2 * self.prior_weight * (Hdiff + b)
+        return val, g
+
+    def state_step(self):
+        '''
+        Optimization over the states of the window given the parameters.
+        '''
+
+        X0 = self.X.ravel()
+        res = minimize(self.state_obj, X0, method='L-BFGS-B', jac=True,
+                       args=(X0 + 0.000001, self.weights()),
+                       options={'maxcor': 100, 'maxiter': self.inner_maxiter})
+        self.X = res['x'].reshape(self.X.shape)
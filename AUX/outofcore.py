@@ -0,0 +1,192 @@
+import autograd.numpy as np
+import numpy
+from scipy.optimize import OptimizeResult
+from discretization import (model_input, window_weights, n_steps, combine,
+                            combine_adjoint)
+from segments import chunk_bounds, chunk_window, solve_window
+
+
+def open_series(Y):
+    '''
+    This opens a T*d series without reading it: the name of a .npy file is
+    memory-mapped, and the arrays (numpy arrays, np.memmap, h5py datasets,
+    ...) are returned as they are. They are only read in blocks of time
+    steps, with Y[s:e].
+    '''
+
+    if(isinstance(Y, str)):
+        return numpy.load(Y, mmap_mode='r')
+    return Y
+
+
+def open_states(out, shape):
+    '''
+    This returns a writable array of floats for the states: a new .npy file
+    memory-mapped with np.lib.format.open_memmap() if out is a file name, or
+    out itself if it is an array (e.g. a np.memmap opened for writing).
+    '''
+
+    if(isinstance(out, str)):
+        return numpy.lib.format.open_memmap(out, mode='w+', dtype=float,
+                                            shape=tuple(shape))
+    if(tuple(out.shape) != tuple(shape)):
+        raise ValueError('The output array has the shape %s instead of %s.'
+                         % (tuple(out.shape), tuple(shape)))
+    return out
+
+
+def time_blocks(n, block_size):
+    '''
+    The blocks (start, end) of block_size consecutive rows of n rows.
+    '''
+
+    return [(s, min(s + block_size, n)) for s in range(0, n, block_size)]
+
+
+class TimeBlocks(object):
+    '''
+    This evaluates the objectives of fit_direct() in blocks of time steps,
+    for the states that are stored in a memory-mapped file and do not fit in
+    memory. The residuals of the steps r0, ..., r1-1 only depend on the
+    states r0+1-K, ..., r1, where K is the number of steps of the
+    discretization, so each block reads its residuals' states and the
+    weights of these rows (see window_weights() in discretization.py), and
+    the memory does not depend on T. The objective over the parameters and
+    its gradient are the sums over the blocks, and the states are updated
+    one chunk at a time with the subproblems of SegmentedXStep.
+
+    The methods have the same arguments as the functions they replace:
+    param_obj(), param_obj_and_grad(), linear_param_step().
+
+    Usage:
+        blocks = TimeBlocks(10000)
+        X = blocks.copy(open_series('Y.npy'), open_states('X.npy', shape))
+        cost = blocks.param_obj(params, X, dt, appr, model)
+        X, res = blocks.X_step(X, params, dt, lam, appr, model)
+    '''
+
+    def __init__(self, block_size=10000):
+        '''
+        Input:
+            block_size: Number of time steps of each block.
+        '''
+
+        self.block_size = block_size
+
+    def copy(self, Y, X):
+        '''
+        This copies the observations Y into the states X, one block at a
+        time, and returns X.
+        '''
+
+        if(tuple(Y.shape) != tuple(X.shape)):
+            raise ValueError('Cannot copy an array of shape %s into %s.'
+                             % (tuple(Y.shape), tuple(X.shape)))
+        for s, e in time_blocks(Y.shape[0], self.block_size):
+            Yb = numpy.asarray(Y[s:e], dtype=float)
+            if(numpy.any(numpy.isnan(Yb))):
+                raise ValueError('The missing observations (NaN) are not '
+                                 'supported out of core.')
+            X[s:e] = Yb
+        return X
+
+    def windows(self, X, dt, appr):
+        '''
+        This yields the states and the weights of each block of residuals:
+        Xw, the states r0+1-K, ..., r1, and A, H, the weights of their
+        residuals, zero in the rows before r0.
+        '''
+
+        K = n_steps(appr)
+        for r0, r1 in time_blocks(X.shape[0] - 1, self.block_size):
+            lo, hi = max(r0 + 1 - K, 0), r1 + 1
+            A, H = window_weights(appr, dt, lo, hi)
+            A[0:r0 - lo], H[0:r0 - lo] = 0, 0
+            yield numpy.array(X[lo:hi], dtype=float), A, H
+
+    def param_obj(self, params, X, dt, appr, model):
+        '''
+        param_obj() of objectives.py, summed over the blocks.
+        '''
+
+        objval = 0.
+        for Xw, A, H in self.windows(X, dt, appr):
+            terms = model.rhs_vec(model_input(Xw, appr), params)
+            objval = objval + np.sum((combine(Xw, A) - combine(terms, H)) ** 2)
+        return objval
+
+    def param_obj_and_grad(self, params, X, dt, appr, model):
+        '''
+        param_obj_and_grad() of objectives.py, summed over the blocks.
+        '''
+
+        objval, objgrad = 0., 0.
+        for Xw, A, H in self.windows(X, dt, appr):
+            Z = model_input(Xw, appr)
+            terms = model.rhs_vec(Z, params)
+            R = combine(Xw, A) - combine(terms, H)
+            G = -combine_adjoint(2 * R, H, terms.shape[0])
+            objval = objval + np.sum(R ** 2)
+            objgrad = objgrad + model.vjp_params(Z, params, G)
+        return objval, objgrad
+
+    def linear_param_step(self, X, dt, appr, model):
+        '''
+        linear_param_step() of linear_params.py, with the normal equations
+        accumulated over the blocks.
+        '''
+
+        G, h = 0., 0.
+        for Xw, A, H in self.windows(X, dt, appr):
+            Phi, c = model.features(model_input(Xw, appr))
+            M = combine(Phi, H).reshape(-1, Phi.shape[2])
+            b = (combine(Xw, A) - combine(c, H)).ravel()
+            G = G + numpy.dot(M.T, M)
+            h = h + numpy.dot(M.T, b)
+        try:
+            return numpy.linalg.solve(G, h)
+        except numpy.linalg.LinAlgError:
+            # The features do not determine the parameters uniquely, and
+            # the least squares matrix is not stored: minimum norm solution
+            # of the normal equations.
+            return numpy.linalg.lstsq(G, h, rcond=None)[0]
+
+    def X_step(self, X, params, dt, lam, appr, model, maxiter=15000):
+        '''
+        This updates the states in place, one chunk of block_size states
+        after the other (block coordinate descent), with the proximal term
+        centered at the states before the update, as in fit_direct().
+
+        Input:
+            X: T*d writable array of states, e.g. a memory-mapped file.
+            params: p-dimensional parameters.
+            dt, appr, model: The time grid, the discretization and the
+                ODEModel object.
+            lam: The hyperparameter lambda.
+            maxiter: Maximum number of L-BFGS iterations of each chunk.
+        Output:
+            X: The same array, with the new states.
+            res: scipy OptimizeResult with the objective value 'fun', the
+                total number of iterations 'nit' and evaluations 'nfev' of
+                the chunks, and the norm of the change of the states 'step'.
+        '''
+
+        T = X.shape[0]
+        K = n_steps(appr)
+        n_chunks = -(-T // self.block_size)
+        nit, nfev, prox, step = 0, 0, 0., 0.
+        for s, e in chunk_bounds(T, n_chunks, K):
+            lo, hi, r0 = chunk_window(s, e, T, K)
+            A, H = window_weights(appr, dt, lo, hi)
+            A[0:r0 - lo], H[0:r0 - lo] = 0, 0
+            x_prev = numpy.array(X[s:e], dtype=float).ravel()
+            res = solve_window(X, s, e, (lo, hi, r0, A, H),
+                               x_prev + 0.000001, None, params, lam, appr,
+                               model, maxiter)
+            diff = res['x'] - x_prev
+            prox = prox + numpy.sum((diff - 0.000001) ** 2)
+            step = step + numpy.sum(diff ** 2)
+            nit, nfev = nit + int(res['nit']), nfev + int(res['nfev'])
+        fun = self.param_obj(params, X, dt, appr, model) + lam * prox
+        return X, OptimizeResult(fun=fun, nit=nit, nfev=nfev,
+                                 step=numpy.sqrt(step))
@@ -0,0 +1,369 @@
+import autograd.numpy as np
+import numpy
+import os
+import weakref
+from autograd import grad
+from concurrent.futures import ProcessPoolExecutor
+from scipy.optimize import minimize, OptimizeResult
+from discretization import (model_input, step_weights, n_steps, combine,
+                            combine_adjoint, residuals)
+from shared import SHARED, share_array, attach_arrays, pool_context
+
+
+def chunk_bounds(T, n_chunks, K):
+    '''
+    This splits the T time steps into n_chunks contiguous chunks of nearly
+    equal length. Each chunk has at least K states, so that two chunks of
+    the same color in SegmentedXStep never share a residual. The number of
+    chunks is reduced if T is too small.
+
+    Output:
+        bounds: A list of (start, end) of the chunks.
+    '''
+
+    n_chunks = max(1, min(n_chunks, T // max(K, 1)))
+    edges = numpy.linspace(0, T, n_chunks + 1).round().astype(int)
+    return [(int(s), int(e)) for s, e in zip(edges[:-1], edges[1:])]
+
+
+def chunk_window(s, e, T, K):
+    '''
+    This returns the window of states needed by the residuals that depend
+    on the states s, ..., e-1 of a chunk: the chunk with a halo of K states
+    on each side.
+
+    Output:
+        lo, hi: The states lo, ..., hi-1 of the window.
+        r0: The first residual that depends on the chunk. The residuals
+            r0, ..., hi-2 are the ones of the chunk.
+    '''
+
+    r0 = max(s - 1, 0)
+    lo = max(r0 + 1 - K, 0)
+    hi = min(e + K, T)
+    return lo, hi, r0
+
+
+def chunk_weights(A, H, lo, hi, r0):
+    '''
+    The rows of the weights of the residuals lo, ..., hi-2 of a window, see
+    step_weights() in discretization.py. The rows before r0 are zero, since
+    these residuals do not depend on the chunk.
+    '''
+
+    Aw, Hw = A[lo:hi - 1].copy(), H[lo:hi - 1].copy()
+    Aw[0:r0 - lo], Hw[0:r0 - lo] = 0, 0
+    return Aw, Hw
+
+
+def chunk_obj(x, Xw, i0, i1, params, Aw, Hw, x0, lam, w, appr, model):
+    '''
+    This is the objective function over the states of one chunk, i.e. the
+    terms of X_obj() that depend on them: the residuals of the window and
+    the proximal term of the chunk.
+
+    Input:
+        x: The states of the chunk, flattened in time-major order.
+        Xw: The states of the window. The rows i0, ..., i1-1 are the chunk
+            and are replaced by x.
+        params: p-dimensional parameters.
+        Aw, Hw: The weights of the window from chunk_weights().
+        x0: The previous states of the chunk, flattened like x.
+        lam: The hyperparameter lambda.
+        w: The weights of the proximal term (the observation mask), flattened
+            like x, or None.
+        appr, model: The discretization and the ODEModel object.
+    Output:
+        objval: The objective value.
+    '''
+
+    d = Xw.shape[1]
+    X = np.concatenate((Xw[0:i0], np.reshape(x, (i1 - i0, d)), Xw[i1:]), 0)
+    terms = model.rhs_vec(model_input(X, appr), params)
+    R = combine(X, Aw) - combine(terms, Hw)
+    diff = x - x0 if w is None else w * (x - x0)
+    return np.sum(R ** 2) + lam * np.sum(diff * (x - x0))
+
+
+def chunk_obj_and_grad(x, Xw, i0, i1, params, Aw, Hw, x0, lam, w, appr,
+                       model):
+    '''
+    This returns the value and the gradient of chunk_obj() with the analytic
+    Jacobians of the model, as X_obj_and_grad() in objectives.py.
+    '''
+
+    d = Xw.shape[1]
+    X = Xw.copy()
+    X[i0:i1] = x.reshape((i1 - i0, d))
+    Z = model_input(X, appr)
+    terms = model.rhs_vec(Z, params)
+    R = combine(X, Aw) - combine(terms, Hw)
+    diff = x - x0 if w is None else w * (x - x0)
+    objval = np.sum(R ** 2) + lam * np.sum(diff * (x - x0))
+
+    # backpropagate 2*R through the residuals
+    Xgrad = combine_adjoint(2 * R, Aw, X.shape[0])
+    G = -combine_adjoint(2 * R, Hw, terms.shape[0])
+    Xgrad[0:G.shape[0]] += model.vjp_x(Z, params, G)
+    return objval, Xgrad[i0:i1].ravel() + 2 * lam * diff
+
+
+def solve_window(X, s, e, window, x0, w, params, lam, appr, model, maxiter):
+    '''
+    This minimizes chunk_obj() over the states s, ..., e-1 with L-BFGS,
+    given the other states, and writes the solution into X. Only the window
+    of the chunk is read, so X can be in shared memory or in a
+    memory-mapped file.
+
+    Input:
+        X: T*d matrix of states.
+        s, e: The chunk.
+        window: (lo, hi, r0, Aw, Hw) of chunk_window() and chunk_weights().
+        x0: The previous states of the chunk, flattened in time-major order.
+        w: The weights of the proximal term, flattened like x0, or None.
+        params: p-dimensional parameters.
+        lam: The hyperparameter lambda.
+        appr, model: The discretization and the ODEModel object.
+        maxiter: Maximum number of L-BFGS iterations.
+    Output:
+        res: scipy OptimizeResult of the solver.
+    '''
+
+    lo, hi, r0, Aw, Hw = window
+    x = numpy.array(X[s:e], dtype=float).ravel()
+    args = (numpy.array(X[lo:hi], dtype=float), s - lo, e - lo, params, Aw,
+            Hw, x0, lam, w, appr, model)
+    if(model.has_jacobians):
+        res = minimize(chunk_obj_and_grad, x, method='L-BFGS-B', jac=True,
+                       args=args, options={'disp': False, 'maxcor': 100,
+                                           'maxiter': maxiter})
+    else:
+        res = minimize(chunk_obj, x, method='L-BFGS-B', jac=grad(chunk_obj),
+                       args=args, options={'disp': False, 'maxcor': 100,
+                                           'maxiter': maxiter})
+    X[s:e] = res['x'].reshape((e - s, X.shape[1]))
+    return res
+
+
+def solve_chunk(arrays, c, params, lam):
+    '''
+    This solves the subproblem of chunk c with solve_window().
+
+    Input:
+        arrays: A dictionary with the states 'X', the previous states 'X0',
+            the weights of the proximal term 'W' (or None) and the
+            'segments' configuration of SegmentedXStep.
+        c: Index of the chunk.
+        params: p-dimensional parameters.
+        lam: The hyperparameter lambda.
+    Output:
+        nit, nfev: The number of iterations and evaluations of the solver.
+    '''
+
+    X, X0, W = arrays['X'], arrays['X0'], arrays['W']
+    config = arrays['segments']
+    s, e = config['bounds'][c]
+    w = None if W is None else W[s:e].ravel()
+    res = solve_window(X, s, e, config['windows'][c], X0[s:e].ravel(), w,
+                       params, lam, config['appr'], config['model'],
+                       config['maxiter'])
+    return int(res['nit']), int(res['nfev'])
+
+
+def solve_chunk_worker(c, params, lam):
+    '''
+    solve_chunk() in a worker process, with the arrays attached by
+    attach_segments().
+    '''
+
+    return solve_chunk(SHARED, c, params, lam)
+
+
+def attach_segments(specs, config):
+    '''
+    This is the initializer of the worker processes of SegmentedXStep.
+    '''
+
+    attach_arrays(specs)
+    SHARED['segments'] = config
+
+
+def release(executor, shms):
+    '''
+    This stops the worker processes and frees the shared memory.
+    '''
+
+    if(executor is not None):
+        executor.shutdown()
+    for shm in shms:
+        shm.close()
+        shm.unlink()
+
+
+class SegmentedXStep(object):
+    '''
+    This solves the optimization over the states in eq.(8) [Euler] or
+    eq.(13b) [multistep] of the paper by splitting the time axis into chunks,
+    which are solved in parallel worker processes.
+
+    The residual of a time step depends on K+1 consecutive states, where K
+    is the number of steps of the discretization, so the subproblem of a
+    chunk only involves the chunk and a halo of K states on each side, which
+    are fixed. The chunks are colored red and black alternately, and have at
+    least K states, so the red chunks do not share any residual: they are
+    solved in parallel, then the black chunks given the new red ones. This
+    is block coordinate descent over the chunks, so the objective never
+    increases, and the boundaries between the chunks are consistent without
+    any extra variable. The states are in shared memory, and each worker
+    writes the states of its chunk in place.
+
+    The parameters are then estimated in fit_direct() from the residuals of
+    all the chunks together (param_obj() over all the states).
+
+    Each call sends the parameters to the workers and starts one L-BFGS
+    per chunk, and block coordinate descent needs more iterations than one
+    L-BFGS over all the states, so the chunks only pay off when each of
+    them is large and there are several cores. The number of chunks is
+    reduced so that each chunk has at least min_chunk_size entries
+    (states times d): small problems are solved as a single chunk in this
+    process, i.e. with the plain L-BFGS step.
+
+    Usage:
+        step = SegmentedXStep(T, d, dt, appr, model, n_chunks=8)
+        X, res = step(X, params, X_prev, lam)
+        step.close()
+    '''
+
+    def __init__(self, T, d, dt, appr, model, n_chunks=None,
+                 max_workers=None, n_sweeps=1, maxiter=15000, mask=None,
+                 min_chunk_size=10000):
+        '''
+        Input:
+            T, d: The shape of the states.
+            dt: Time interval between the states, or a (T-1)-dimensional
+                array of the intervals.
+            appr: The type of discretization, e.g. "euler", "ad3" or "bdf2".
+            model: The ODEModel object of the model.
+            n_chunks: Number of chunks (twice the number of workers by
+                default, so both colors use all of them).
+            max_workers: Number of worker processes (all cores by default).
+                With max_workers=1, the chunks are solved in this process.
+            n_sweeps: Number of red/black sweeps of each call.
+            maxiter: Maximum number of L-BFGS iterations of each chunk.
+            mask: Optional T*d boolean matrix of the observed entries. The
+                proximal term only includes the observed entries.
+            min_chunk_size: Minimum number of entries (states times d) of
+                each chunk.
+        '''
+
+        if(max_workers is None):
+            max_workers = os.cpu_count()
+        if(n_chunks is None):
+            n_chunks = 2 * max_workers
+        K = n_steps(appr)
+        self.T, self.d = T, d
+        self.dt, self.appr, self.model = dt, appr, model
+        self.mask = mask
+        self.n_sweeps = n_sweeps
+        n_chunks = min(n_chunks, T * d // max(min_chunk_size, 1))
+        self.bounds = chunk_bounds(T, n_chunks, K)
+        A, H = step_weights(appr, T - 1, dt)
+        windows = []
+        for s, e in self.bounds:
+            lo, hi, r0 = chunk_window(s, e, T, K)
+            windows.append((lo, hi, r0) + chunk_weights(A, H, lo, hi, r0))
+        config = {'bounds': self.bounds, 'windows': windows, 'appr': appr,
+                  'model': model, 'maxiter': maxiter}
+
+        W = None if mask is None else numpy.asarray(mask, dtype=float)
+        self.config = config
+        self.executor = None
+        self.specs = {}
+        shms = []
+        if(max_workers > 1 and len(self.bounds) > 1):
+            self.specs['W'] = None
+            for key, B in (('X', numpy.zeros((T, d))),
+                           ('X0', numpy.zeros((T, d))), ('W', W)):
+                if(B is not None):
+                    shm, self.specs[key] = share_array(B)
+                    shms.append(shm)
+            self.shms = dict(zip([k for k in ('X', 'X0', 'W')
+                                  if self.specs[k] is not None], shms))
+            self.executor = ProcessPoolExecutor(
+                max_workers=max_workers, mp_context=pool_context(),
+                initializer=attach_segments,
+                initargs=(self.specs, config))
+        else:
+            self.local = {'X': numpy.zeros((T, d)),
+                          'X0': numpy.zeros((T, d)), 'W': W,
+                          'segments': config}
+        # The workers and the shared memory are released by close(), or
+        # when the object is garbage collected.
+        self.finalizer = weakref.finalize(self, release, self.executor, shms)
+
+    def buffers(self):
+        '''
+        The arrays of solve_chunk(). The views of the shared memory are only
+        created during a call, since the shared memory cannot be closed
+        while they exist.
+        '''
+
+        if(self.executor is None):
+            return self.local
+        arrays = {'W': None, 'segments': self.config}
+        for key, shm in self.shms.items():
+            name, shape, dtype = self.specs[key]
+            arrays[key] = numpy.ndarray(shape, dtype=dtype, buffer=shm.buf)
+        return arrays
+
+    def __call__(self, X, params, X_prev, lam):
+        '''
+        Input:
+            X: T*d matrix, the initialization of the states.
+            params: p-dimensional parameter \\theta^*(n).
+            X_prev: T*d matrix, the previous state X^*(n-1) in the proximal
+                term.
+            lam: The hyperparameter lambda in our paper.
+        Output:
+            X: The new T*d matrix of states.
+            res: scipy OptimizeResult with the objective value 'fun' and the
+                total number of iterations 'nit' and evaluations 'nfev' of
+                the chunks.
+        '''
+
+        arrays = self.buffers()
+        arrays['X'][...] = X
+        arrays['X0'][...] = X_prev
+        params = numpy.asarray(params, dtype=float)
+        colors = (range(0, len(self.bounds), 2),
+                  range(1, len(self.bounds), 2))
+        nit, nfev = 0, 0
+        for sweep in range(self.n_sweeps):
+            for chunks in colors:
+                if(self.executor is None):
+                    stats = [solve_chunk(arrays, c, params, lam)
+                             for c in chunks]
+                else:
+                    stats = list(self.executor.map(solve_chunk_worker,
+                                                   chunks,
+                                                   [params] * len(chunks),
+                                                   [lam] * len(chunks)))
+                nit = nit + sum(s[0] for s in stats)
+                nfev = nfev + sum(s[1] for s in stats)
+        X = arrays['X'].copy()
+        del arrays
+
+        terms = self.model.rhs_vec(model_input(X, self.appr), params)
+        R = residuals(X, terms, self.dt, self.appr)
+        diff = (X - X_prev) ** 2
+        if(self.mask is not None):
+            diff = diff * self.mask
+        fun = numpy.sum(R ** 2) + lam * numpy.sum(diff)
+        return X, OptimizeResult(fun=fun, nit=nit, nfev=nfev)
+
+    def close(self):
+        '''
+        This stops the worker processes and frees the shared memory.
+        '''
+
+        self.finalizer()
@@ -0,0 +1,60 @@
+import numpy as np
+import multiprocessing
+from multiprocessing import shared_memory
+
+
+# The shared arrays, attached once in each worker process.
+SHARED = {}
+
+
+def share_array(A):
+    '''
+    This copies an array into a new shared memory block.
+
+    Input:
+        A: numpy array.
+    Output:
+        shm: The SharedMemory object. The caller has to unlink it.
+        spec: (name, shape, dtype) used by attach_arrays() to find it.
+    '''
+
+    A = np.ascontiguousarray(A, dtype=float)
+    shm = shared_memory.SharedMemory(create=True, size=max(A.nbytes, 1))
+    np.ndarray(A.shape, dtype=A.dtype, buffer=shm.buf)[...] = A
+    return shm, (shm.name, A.shape, A.dtype.str)
+
+
+def pool_context():
+    '''
+    This returns the multiprocessing context of the worker processes. They
+    are not forked from this process, which may run threads (e.g. the
+    parallel numba loops of predict_batch()), since a fork of a process with
+    threads can hang: they are forked from a clean server process when the
+    platform supports it, and spawned otherwise. As for the spawned
+    processes, the scripts that start workers need the
+    if __name__ == '__main__': guard.
+    '''
+
+    if('forkserver' in multiprocessing.get_all_start_methods()):
+        return multiprocessing.get_context('forkserver')
+    return multiprocessing.get_context('spawn')
+
+
+def attach_arrays(specs):
+    '''
+    This is the initializer of the worker processes. It attaches the shared
+    arrays, so they are not pickled again for each task.
+
+    Input:
+        specs: A dictionary of the (name, shape, dtype) returned by
+            share_array(), or None.
+    '''
+
+    for key, spec in specs.items():
+        if(spec is None):
+            SHARED[key] = None
+            continue
+        name, shape, dtype = spec
+        shm = shared_memory.SharedMemory(name=name)
+        SHARED[key + '_shm'] = shm  # keep the buffer alive
+        SHARED[key] = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
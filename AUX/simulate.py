@@ -1,28 +1,38 @@
 import numpy as np
 from scipy.integrate import ode
+import os
 import sys
-sys.path.append('./ODEs/')
-from fitzhugh_nagumo import *
-from lotka_volterra import *
-from lorenz96 import *
-from lorenz import *
-from rossler import *
-from cubosc import *
-
-
-def simulate(ODE_str, x0, true_param, end_t, dt, noise_var):
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..', 'ODEs'))
+from ode_model import get_model
+from discretization import n_states, n_steps, parse, window_weights
+from outofcore import open_states, time_blocks
+try:
+    import numba
+except ImportError:
+    numba = None
+
+
+def simulate(ODE_str, x0, true_param, end_t, dt, noise_var, out=None):
     '''
     This function creates clean states and noisy observations for the ODEs.
 
     Input:
       ODE_str: Name of the model as a string. Set ODE_str to
             'fitzhugh_nagumo' or 'lotka_volterra' or 'rossler' or 'lorenz96'
+            or any other registered model, or pass an ODEModel object.
       x0: A d-dimensional list that contains initial state at time 0.
       true_param: A p-dimensional list that contains the true parameters of ODE.
       end_t: The final time of the simulation. The start time is 0.
-      dt: The time interval between samples.
+      dt: The time interval between samples, or a (T-1)-dimensional array
+            of the intervals between consecutive samples (then end_t is
+            their sum).
       noise_var: The variance of the Gaussian noise.
             The noise will be used in creating noisy observations.
+      out: Optional pair (X_out, Y_out) of the names of .npy files, or of
+            writable T*d arrays, where the states and the observations are
+            written, for the series that do not fit in memory (see
+            outofcore.py). The noise is then added one block at a time.
 
     Output:
       X: T*d numpy array that contains the clean states.
@@ -30,28 +40,37 @@ def simulate(ODE_str, x0, true_param, end_t, dt, noise_var):
       dt: Time interval between samples.
     '''
 
-    ode_fun = eval(ODE_str + '_ode') # change the string into a function.
+    ode_fun = get_model(ODE_str).rhs # change the string into a function.
 
     d = x0.shape[0] # dimension of the states
     t0 = 0
     r = ode(ode_fun).set_integrator('dopri5').set_f_params(true_param)
     r.set_initial_value(x0, t0)
-    T = int((end_t / dt) + 1) # number of observations
-    X = np.empty((T, d)) # clean states
+    T = n_states(end_t, dt) # number of observations
+    steps = np.broadcast_to(dt, (T - 1,))
+    if(out is None):
+        X = np.empty((T, d)) # clean states
+    else:
+        X = open_states(out[0], (T, d))
     X[0, :] = x0
     idx = 1
     while idx < T:
-        r.integrate(r.t + dt)
+        r.integrate(r.t + steps[idx - 1])
         X[idx, :] = r.y
         idx = idx + 1
 
     # create noisy observations
-    Y = X + (np.random.normal(0, noise_var, (T, d)))
+    if(out is None):
+        Y = X + (np.random.normal(0, noise_var, (T, d)))
+    else:
+        Y = open_states(out[1], (T, d))
+        for s, e in time_blocks(T, 10000):
+            Y[s:e] = X[s:e] + np.random.normal(0, noise_var, (e - s, d))
 
     return X, Y, dt
 
 
-def predict(init_state, end_t, dt, params,ODE_str,appr):
+def predict(init_state, end_t, dt, params,ODE_str,appr, out=None):
     '''
     We use this function to predict the states,
     using eq.(5) [Euler] or eq. (11) [multistep] of the paper.
@@ -59,52 +78,152 @@ def predict(init_state, end_t, dt, params,ODE_str,appr):
     Input:
         init_state: d-dimensional initial state.
         end_t: The final time of the simulation. The start time is 0.
-        dt: Time interval between the states.
+        dt: Time interval between the states, or a (T-1)-dimensional array
+            of the intervals between consecutive states (then end_t is their
+            sum).
         params: p-dimensional parameter \theta.
         ODE_str: Name of the model as a string. Set ODE_str to '
             fitzhugh_nagumo' or 'lotka_volterra' or 'rossler' or 'lorenz96'
-        appr: This determines the type of discretization and takes one of the
-            three strings: 1)"euler" for 1-step Euler,2) "ad2" for the
-            2-step Adam-Bashforth, and 3) "ad3" for the 3-step Adam-Bashforth.
+            or any other registered model, or pass an ODEModel object.
+        appr: This determines the type of discretization: 1)"euler" for
+            1-step Euler,2) "ad2" for the 2-step Adam-Bashforth, 3) "ad3" for
+            the 3-step Adam-Bashforth, or any other method of
+            discretization.py, e.g. "ab4", "am2" or "bdf3".
+        out: Optional writable T*d array where the states are written, e.g.
+            a memory-mapped file from open_states() in outofcore.py.
+
+    Output:
+        pX: The predicted states, a T*d numpy array (out if it is set)
+    '''
+
+    pX = predict_batch(np.asarray(init_state)[None, :], end_t, dt, params,
+                       ODE_str, appr,
+                       out=None if out is None else np.asarray(out)[None])
+    if(out is not None):
+        return out
+    return pX[0]
+
+
+# The compiled prediction loops, keyed on the kernel of the model.
+NUMBA_PREDICTORS = {}
+
+
+def numba_predictor(kernel):
+    '''
+    This compiles the prediction loop of predict_batch() with numba, for a
+    model whose rhs_kernel is kernel.
+    '''
+
+    if(kernel in NUMBA_PREDICTORS):
+        return NUMBA_PREDICTORS[kernel]
+    rhs = numba.njit(kernel)
+
+    @numba.njit(parallel=True)
+    def run(pX, params, W, F, lo):
+        # the states lo+1, ..., lo+len(W), where W[m] are the weights of
+        # the state lo+m+1
+        B, T, d = pX.shape
+        K = W.shape[1]
+        for b in numba.prange(B):
+            for i in range(lo + 1, lo + W.shape[0] + 1):
+                rhs(pX[b, i - 1], params[b], F[b, (i - 1) % K])
+                for j in range(d):
+                    step = 0.
+                    for k in range(min(i, K)):
+                        step += W[i - 1 - lo, k] * F[b, (i - 1 - k) % K, j]
+                    pX[b, i, j] = pX[b, i - 1, j] + step
+
+    NUMBA_PREDICTORS[kernel] = run
+    return run
+
+
+def predict_batch(init_states, end_t, dt, params, ODE_str, appr,
+                  engine='auto', tol=1e-10, max_fp_iters=50, out=None):
+    '''
+    This is predict() for a batch of B initial states and/or parameters.
+    Each step evaluates the derivatives of all the B states together, and
+    the loop over time can be compiled with numba.
+
+    Input:
+        init_states: B*d initial states.
+        end_t: The final time of the simulation. The start time is 0.
+        dt: Time interval between the states, or a (T-1)-dimensional array
+            of the intervals (then end_t is their sum).
+        params: B*p parameters, or p-dimensional parameters shared by all the
+            initial states.
+        ODE_str: Name of the model as a string, or an ODEModel object.
+        appr: The type of discretization, e.g. "euler", "ad3" or "bdf2". The
+            implicit methods (Adams-Moulton and BDF) solve for each new state
+            with fixed point iterations, started from an Euler step.
+        engine: 1) "numpy", 2) "numba" to compile the loop, which requires
+            numba, a model with a rhs_kernel and an Adams-Bashforth method,
+            or 3) "auto" to use "numba" when it is possible.
+        tol: Tolerance of the fixed point iterations of the implicit methods.
+        max_fp_iters: Maximum number of fixed point iterations per step.
+        out: Optional writable B*T*d array of floats where the states are
+            written.
 
     Output:
-        pX: The predicted states, a T*d numpy array
+        pX: The predicted states, a B*T*d numpy array
     '''
 
-    T = int((end_t / dt) + 1)  # number of observations from time 0 to end_t
-    ode_fun = eval(ODE_str + '_ode')  # change the string into a function.
-    pX = np.zeros((T,init_state.shape[0]))  # Predicted states
-    pX[0,:] = init_state  # initial state
+    model = get_model(ODE_str)
+    init_states = np.asarray(init_states, dtype=float)
+    params = np.asarray(params, dtype=float)
+    B_size, d = init_states.shape
+    T = n_states(end_t, dt)  # number of observations from time 0 to end_t
+    K = n_steps(appr)
+    pX = np.zeros((B_size, T, d)) if out is None else out  # Predicted states
+    pX[:, 0, :] = init_states  # initial state
+
+    if(engine == 'auto'):
+        use_numba = (numba is not None and model.rhs_kernel is not None and
+                     parse(appr)[0] == 'ab')
+        engine = 'numba' if use_numba else 'numpy'
+
+    if(engine == 'numba'):
+        run = numba_predictor(model.rhs_kernel)
+        params = params * np.ones((B_size, 1))
+        # F[b, j] is the derivative at the last state i with i % K == j
+        F = np.zeros((B_size, K, d))
+        for lo in range(0, T - 1, 10000):
+            # the Adams-Bashforth weights of f(X[i-1]), f(X[i-2]), ... for
+            # 10000 steps at a time, as below
+            hi = min(lo + 10001, T)
+            W = np.ascontiguousarray(window_weights(appr, dt, lo, hi)[1][:, 1:])
+            run(pX, params, W, F, lo)
+        return pX
 
     # Repeatedly apply equation (5) for the Euler or
     # eq.(11) for the general multi-step methods
+    steps = np.broadcast_to(dt, (T - 1,))
+    F = []  # derivatives at the last K states, the most recent one last
     for i in range(1, T):
-        if(appr == 'euler'):
-            temp1 = ode_fun(0, pX[i - 1, :], params)
-            pX[i, :] = pX[i - 1, :] + temp1 * dt
-        elif(appr == 'ad2'):
-            if (i == 1):
-                temp1 = ode_fun(0, pX[i - 1, :], params)
-                pX[i, :] = pX[i - 1, :] + temp1 * dt
-            else:
-                temp2 = ode_fun(0, pX[i - 1, :], params)
-                pX[i, :] = pX[i - 1, :] + ((3 / 2) * (temp2 * dt))\
-                           - ((1 / 2) * dt * (temp1))
-                temp1 = temp2
-        else:
-            if (i == 1):
-                temp1 = ode_fun(0, pX[i - 1, :], params)
-                pX[i, :] = pX[i - 1, :] + temp1 * dt
-            elif (i == 2):
-                temp2 = ode_fun(0, pX[i - 1, :], params)
-                pX[i, :] = pX[i - 1, :] + ((3 / 2) * (temp2 * dt)) - \
-                           ((1 / 2) * dt * (temp1))
-            else:
-                temp3 = ode_fun(0, pX[i - 1, :], params)
-                pX[i, :] = pX[i - 1, :] + ((23 / 12) * (temp3 * dt)) - \
-                           ((4 / 3) * dt * (temp2)) + ((5 / 12) * dt * (temp1))
-                temp1, temp2 = temp2, temp3
+        F.append(model.rhs(0, pX[:, i - 1, :], params))
+        if(len(F) > K):
+            F.pop(0)
+        # A[m, j] and H[m, j] are the weights of X[i-j] and f(X[i-j]) for
+        # predicting X[i], with the step sizes in H, where m = (i-1) % 10000.
+        # They are computed for 10000 steps at a time (see step_weights()).
+        if((i - 1) % 10000 == 0):
+            A, H = window_weights(appr, dt, i - 1, min(i + 10000, T))
+        a, h = A[(i - 1) % 10000], H[(i - 1) % 10000]
+        # the part that does not depend on the new state (a[0] = 1)
+        known = 0.
+        for j in range(1, min(i, K) + 1):
+            known = known - a[j] * pX[:, i - j, :]
+            if(h[j] != 0):
+                known = known + h[j] * F[-j]
+        if(h[0] == 0):
+            pX[:, i, :] = known
+            continue
+        # implicit methods: fixed point iterations from an Euler step
+        x = pX[:, i - 1, :] + steps[i - 1] * F[-1]
+        for it in range(max_fp_iters):
+            x_new = known + h[0] * model.rhs(0, x, params)
+            done = np.max(np.abs(x_new - x)) <= tol * (1 + np.max(np.abs(x)))
+            x = x_new
+            if(done):
+                break
+        pX[:, i, :] = x
     return pX
-
-
-
@@ -0,0 +1,306 @@
+import numpy as np
+import contextlib
+import io
+import itertools
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from fit_direct import fit_direct
+from simulate import predict
+from discretization import duration
+from shared import SHARED, share_array, attach_arrays, pool_context
+
+
+def make_grid(init_params, lams=(1,), apprs=('euler',)):
+    '''
+    This returns all the combinations of initial parameters, lambdas and
+    discretizations as a list of configurations for sweep().
+
+    Input:
+        init_params: A list of p-dimensional initializations.
+        lams: A list of values of the hyperparameter lambda.
+        apprs: A list of discretizations (e.g. "euler", "ad3" or "bdf2").
+    Output:
+        configs: A list of dictionaries with the keys 'init_params', 'lam'
+            and 'appr'.
+    '''
+
+    return [{'init_params': np.asarray(p, dtype=float), 'lam': lam,
+             'appr': appr}
+            for p, lam, appr in itertools.product(init_params, lams, apprs)]
+
+
+def validation_error(params, X, pred_X, Y, Y_val, dt, ODE_str, appr,
+                     val_dt=None):
+    '''
+    This returns the prediction error of a fit, which is used to compare the
+    runs of a sweep.
+
+    Input:
+        params, X, pred_X: The outputs of fit_direct().
+        Y: T*d matrix of the observations used in the fit.
+        Y_val: Held-out observations that follow Y in time, or None.
+        dt, ODE_str, appr: The same as in fit_direct().
+        val_dt: Time interval between the held-out observations (and
+            between the last state of Y and the first of them), or the
+            T_val-dimensional array of the intervals. By default dt, which
+            has to be uniform.
+    Output:
+        The squared prediction error over Y_val (predicted from the last
+        estimated state), or over Y if Y_val is None.
+    '''
+
+    if(Y_val is None):
+        return np.sum((pred_X - Y) ** 2)
+    T_val = Y_val.shape[0]
+    val_dt = check_val_dt(dt, val_dt)
+    pX = predict(X[-1, :], duration(val_dt, T_val + 1), val_dt, params,
+                 ODE_str, appr)
+    return np.sum((pX[1:T_val + 1, :] - Y_val) ** 2)
+
+
+def check_val_dt(dt, val_dt):
+    '''
+    The time intervals of the held-out observations: val_dt, or dt if it is
+    uniform.
+    '''
+
+    if(val_dt is not None):
+        return val_dt
+    if(np.ndim(dt) != 0):
+        raise ValueError('val_dt is required for a non-uniform time grid.')
+    return dt
+
+
+def run_config(config, dt, ODE_str, fit_kwargs, probe=None,
+               prune_factor=None, val_dt=None, checkpoint=None):
+    '''
+    This runs one fit of a sweep inside a worker process. The printing of
+    fit_direct() is discarded.
+
+    A run continued from a probe resumes from the checkpoint of the probe,
+    and is compared with the other runs at the same numbers of iterations:
+    every probe['iters'] iterations, it writes its validation error in its
+    row of SHARED['errors'] (one column per number of iterations, the first
+    one for the probes) and stops if the error is larger than prune_factor
+    times the smallest error of the other runs in the same column. Between
+    these checks, the callback of fit_direct() also stops it at each
+    iteration as soon as another run dominates it in the column of its last
+    check.
+
+    Input:
+        config: A dictionary with the arguments of fit_direct() that change
+            between the runs (e.g. 'init_params', 'lam', 'appr').
+        dt, ODE_str: The same as in fit_direct().
+        fit_kwargs: The other arguments of fit_direct().
+        probe: None, or a dictionary with the 'index' of the run (its row
+            of SHARED['errors']), the number of iterations 'iters', the
+            'params' and the 'val_error' of its probe run.
+        prune_factor: See iter_sweep().
+        val_dt: See validation_error().
+        checkpoint: Name of the .npz checkpoint of the fit, or None. The
+            probe runs write it, and the runs continued from them resume
+            from it.
+    Output:
+        result: A dictionary with 'config', 'params', 'X', 'pred_X',
+            'val_error', 'n_iters' and 'time', and 'probe_params' if probe
+            is set. A run that was stopped has 'stage' = 'pruned'.
+    '''
+
+    Y, Y_val = SHARED['Y'], SHARED['Y_val']
+    kwargs = dict(fit_kwargs)
+    kwargs.update(config)
+    init_params = kwargs.pop('init_params')
+    appr = kwargs.get('appr', 'euler')
+    max_iters = kwargs.pop('max_iters', 10000)
+    kwargs.update(return_info=True, checkpoint=checkpoint,
+                  checkpoint_every=max_iters)
+
+    targets = [max_iters]
+    result = {'config': config}
+    if(probe is not None):
+        every, i = probe['iters'], probe['index']
+        errors = SHARED['errors']
+        # the numbers of iterations of the checks, after the probe
+        targets = list(range(2 * every, max_iters, every)) + [max_iters]
+        column = [0]
+
+        def dominated():
+            others = np.delete(errors[:, column[0]], i)
+            return (others.size > 0 and
+                    errors[i, column[0]] > prune_factor * np.min(others))
+
+        user_callback = kwargs.get('callback')
+
+        def callback(record):
+            stop = user_callback is not None and user_callback(record)
+            return dominated() or stop
+        kwargs.update(callback=callback, resume=checkpoint,
+                      checkpoint_every=every)
+        result['probe_params'] = probe['params']
+
+    start = time.time()
+    pruned = False
+    with contextlib.redirect_stdout(io.StringIO()):
+        for target in targets:
+            params, X, pred_X, info = fit_direct(
+                Y, dt, init_params, ODE_str, max_iters=target, **kwargs)
+            err = validation_error(params, X, pred_X, Y, Y_val, dt, ODE_str,
+                                   appr, val_dt)
+            if(probe is None or target == max_iters or
+                    info['stop_reason'] != 'max_iters'):
+                pruned = info['stop_reason'] == 'callback' and dominated()
+                break
+            column[0] = target // every - 1
+            errors[i, column[0]] = err
+            if(dominated()):
+                pruned = True
+                break
+    result.update(params=params, X=X, pred_X=pred_X, val_error=err,
+                  n_iters=info['n_iters'], time=time.time() - start)
+    if(pruned):
+        result['stage'] = 'pruned'
+    return result
+
+
+def iter_sweep(Y, dt, configs, ODE_str, Y_val=None, max_workers=None,
+               probe_iters=None, prune_factor=10., val_dt=None, **fit_kwargs):
+    '''
+    This runs fit_direct() for many configurations (initial parameters,
+    lambdas, discretizations, ...) in parallel worker processes, and yields
+    the results as they complete. The observations are put in shared memory
+    once, instead of being pickled for every fit.
+
+    If probe_iters is set, every configuration is first run for probe_iters
+    iterations. The runs whose validation error is larger than prune_factor
+    times the best one are dominated and dropped, and the others are
+    continued exactly from the checkpoints of their probes (in a temporary
+    directory). The runs are only compared at the same numbers of
+    iterations: every probe_iters iterations, each run compares its
+    validation error with those of the other runs at the same number of
+    iterations, and stops if it is dominated (see run_config()). A run that
+    is slow to start is not compared with runs that went further.
+
+    Input:
+        Y: T*d numpy array that contains the noisy observations.
+        dt: Time interval between the observations (states).
+        configs: A list of dictionaries with the arguments of fit_direct()
+            that change between the runs, see make_grid(). 'init_params' is
+            required.
+        ODE_str: Name of the model as a string.
+        Y_val: Held-out observations that follow Y, used for the validation
+            error. If None, the error of pred_X over Y is used.
+        max_workers: Number of worker processes (all cores by default).
+        probe_iters: Number of iterations of the probe runs and between the
+            comparisons, or None to run all the configurations to the end.
+        prune_factor: Runs with a validation error larger than prune_factor
+            times the best one at the same number of iterations are dropped.
+        val_dt: The time intervals of Y_val, required if dt is an array (see
+            validation_error()).
+        fit_kwargs: The other arguments of fit_direct(), e.g. max_iters.
+            checkpoint and resume are not accepted with probe_iters.
+    Output:
+        Yields the result dictionaries of run_config(). The results of the
+        probe runs have 'stage' = 'probe', the final ones 'stage' = 'final'
+        and the dropped ones 'stage' = 'pruned'. The 'config' of a result is
+        the configuration as it was given; the runs continued from a probe
+        have the probe parameters in 'probe_params'.
+    '''
+
+    if(max_workers is None):
+        max_workers = os.cpu_count()
+    if(Y_val is not None):
+        val_dt = check_val_dt(dt, val_dt)
+    if(probe_iters is not None and ('checkpoint' in fit_kwargs or
+                                    'resume' in fit_kwargs)):
+        raise ValueError('The probes use the checkpoints: checkpoint and '
+                         'resume are not accepted with probe_iters.')
+    max_iters = fit_kwargs.get('max_iters', 10000)
+    n_checks = 1 if probe_iters is None else \
+        max(1, len(range(probe_iters, max_iters, probe_iters)))
+    shms = []
+    specs = {'Y_val': None}
+    # the validation errors of the runs at the checks, written by the
+    # workers
+    for key, A in (('Y', Y), ('Y_val', Y_val),
+                   ('errors', np.full((len(configs), n_checks), np.inf))):
+        if(A is not None):
+            shm, specs[key] = share_array(A)
+            shms.append(shm)
+    errors = np.ndarray((len(configs), n_checks), dtype=float,
+                        buffer=shms[-1].buf)
+    folder = None if probe_iters is None else tempfile.mkdtemp()
+
+    try:
+        with ProcessPoolExecutor(max_workers=max_workers,
+                                 mp_context=pool_context(),
+                                 initializer=attach_arrays,
+                                 initargs=(specs,)) as executor:
+            if(probe_iters is not None):
+                paths = [os.path.join(folder, 'run%d.npz' % i)
+                         for i in range(len(configs))]
+                probe_kwargs = dict(fit_kwargs, max_iters=probe_iters)
+                futures = {executor.submit(run_config, c, dt, ODE_str,
+                                           probe_kwargs, val_dt=val_dt,
+                                           checkpoint=paths[i]): i
+                           for i, c in enumerate(configs)}
+                results = [None] * len(configs)
+                for future in as_completed(futures):
+                    result = future.result()
+                    result['stage'] = 'probe'
+                    results[futures[future]] = result
+                    errors[futures[future], 0] = result['val_error']
+                    yield result
+                # continue the runs that are not dominated
+                best = min(r['val_error'] for r in results)
+                survivors = []
+                for i, r in enumerate(results):
+                    if(r['val_error'] > prune_factor * best):
+                        r = dict(r, stage='pruned')
+                        yield r
+                    else:
+                        probe = {'index': i, 'iters': probe_iters,
+                                 'params': r['params'],
+                                 'val_error': r['val_error']}
+                        survivors.append((r['config'], probe, paths[i]))
+            else:
+                survivors = [(c, None, None) for c in configs]
+
+            futures = [executor.submit(run_config, c, dt, ODE_str,
+                                       fit_kwargs, probe, prune_factor,
+                                       val_dt, path)
+                       for c, probe, path in survivors]
+            for future in as_completed(futures):
+                result = future.result()
+                result.setdefault('stage', 'final')
+                yield result
+    finally:
+        # the view has to be released before the block is closed
+        del errors
+        for shm in shms:
+            shm.close()
+            shm.unlink()
+        if(folder is not None):
+            shutil.rmtree(folder, ignore_errors=True)
+
+
+def sweep(Y, dt, configs, ODE_str, Y_val=None, max_workers=None,
+          probe_iters=None, prune_factor=10., val_dt=None, **fit_kwargs):
+    '''
+    This runs iter_sweep() to the end and returns the best run.
+
+    Input:
+        The same as iter_sweep().
+    Output:
+        best: The final result with the smallest validation error.
+        results: The list of all the results, in the order they completed.
+    '''
+
+    results = list(iter_sweep(Y, dt, configs, ODE_str, Y_val, max_workers,
+                              probe_iters, prune_factor, val_dt,
+                              **fit_kwargs))
+    final = [r for r in results if r['stage'] == 'final']
+    best = min(final, key=lambda r: r['val_error'])
+    return best, results
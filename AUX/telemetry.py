@@ -0,0 +1,137 @@
+import numpy as np
+import csv
+import json
+import logging
+
+
+# The fields of the records sent by fit_direct() to its callback, in the
+# order of the CSV columns.
+FIELDS = ['iter', 'param_time', 'param_nit', 'param_nfev', 'param_cost',
+          'param_step', 'lam', 'restarted', 'X_time', 'X_nit', 'X_nfev',
+          'X_cost', 'X_step', 'joint_cost', 'param_change', 'holdout_error',
+          'stop_reason']
+
+
+class FitTrace(object):
+    '''
+    This records the telemetry of fit_direct(). It is passed as the
+    callback of fit_direct(), and keeps the records in memory, writes them
+    to a CSV file and/or sends them to a logger as JSON messages.
+
+    Usage:
+        trace = FitTrace(csv_path='fit.csv')
+        params, X, pred_X = fit_direct(Y, dt, init_params, 'lorenz96',
+                                       callback=trace)
+        trace.close()
+        print(trace.summary())
+
+    Attributes:
+        records: The list of the records, if keep is True.
+        stop_reason: Why the fit stopped ("tol", "max_iters", "callback" or
+            the stop reason of the ConvergenceMonitor of the fit), or None
+            while it runs.
+    '''
+
+    def __init__(self, keep=True, csv_path=None, logger=None,
+                 level=logging.INFO, every=1, max_time=None):
+        '''
+        Input:
+            keep: If True, the records are kept in memory.
+            csv_path: If set, the records are written to this CSV file.
+            logger: A logging.Logger (or the name of one). If set, each
+                record is logged as a JSON message.
+            level: The logging level of the messages.
+            every: Only every every-th record is written to the CSV file and
+                the logger (and the last one). All of them are kept in memory.
+            max_time: If set, the fit is stopped once the total time of the
+                two blocks exceeds max_time seconds.
+        '''
+
+        self.keep = keep
+        self.records = []
+        self.every = every
+        self.max_time = max_time
+        self.total_time = 0.
+        self.stop_reason = None
+        self.file = None
+        self.writer = None
+        if(csv_path is not None):
+            self.file = open(csv_path, 'w', newline='')
+            self.writer = csv.DictWriter(self.file, FIELDS,
+                                         extrasaction='ignore')
+            self.writer.writeheader()
+        if(isinstance(logger, str)):
+            logger = logging.getLogger(logger)
+        self.logger = logger
+        self.level = level
+
+    def __call__(self, record):
+        '''
+        This is called by fit_direct() at the end of each iteration.
+        It returns True to stop the fit.
+        '''
+
+        self.total_time = (self.total_time + record.get('param_time', 0.) +
+                           (record.get('X_time') or 0.))
+        stop = (self.max_time is not None and
+                self.total_time > self.max_time and 'stop_reason' not in record)
+        if(stop):
+            # fit_direct() stops after this record
+            record['stop_reason'] = 'callback'
+        last = 'stop_reason' in record
+        if(last):
+            self.stop_reason = record['stop_reason']
+        if(self.keep):
+            self.records.append(record)
+        if(last or record['iter'] % self.every == 0):
+            if(self.writer is not None):
+                self.writer.writerow(record)
+            if(self.logger is not None):
+                self.logger.log(self.level, json.dumps(record))
+        return stop
+
+    def column(self, field):
+        '''
+        The values of one field over the iterations as a numpy array, with
+        nan where it is missing.
+        '''
+
+        values = [r.get(field) for r in self.records]
+        return np.array([np.nan if v is None else v for v in values],
+                        dtype=float)
+
+    def summary(self):
+        '''
+        This returns the totals over the recorded iterations: the number of
+        iterations, the time and the function evaluations of each block,
+        the last objective value and the stop reason.
+        '''
+
+        out = {'n_iters': len(self.records), 'stop_reason': self.stop_reason}
+        for block in ('param', 'X'):
+            out[block + '_time'] = float(np.nansum(self.column(block +
+                                                               '_time')))
+            out[block + '_nfev'] = int(np.nansum(self.column(block + '_nfev')))
+            out[block + '_nit'] = int(np.nansum(self.column(block + '_nit')))
+        if(self.records):
+            out['param_cost'] = self.records[-1]['param_cost']
+        return out
+
+    def to_csv(self, path):
+        '''
+        This writes all the records kept in memory to a CSV file.
+        '''
+
+        with open(path, 'w', newline='') as f:
+            writer = csv.DictWriter(f, FIELDS, extrasaction='ignore')
+            writer.writeheader()
+            writer.writerows(self.records)
+
+    def close(self):
+        '''
+        This closes the CSV file.
+        '''
+
+        if(self.file is not None):
+            self.file.close()
+            self.file = None
@@ -0,0 +1,160 @@
+import numpy as np
+from discretization import model_input, step_weights
+
+
+class StateWorkspace(object):
+    '''
+    This evaluates the objective over the states (X_obj_and_grad()) with
+    preallocated buffers, for long series where the allocations and copies
+    of X_obj() dominate the run time and the memory.
+
+    The states are flattened in time-major (C) order, x = X.ravel(), so
+    x.reshape((T, d)) is a view and there is no transpose per evaluation.
+    The residuals are assembled in place in one buffer, one column of the
+    coefficient table of the discretization at a time:
+    R += A[t, j] * X[t+1-j] - dt * B[t, j] * terms[t+1-j], with the start-up
+    rows (lower order methods) included in the same weight matrices. The
+    same buffers are reused by all the evaluations, so the memory does not
+    depend on the number of evaluations, and only the derivatives of the
+    model (rhs_vec() and vjp_x()) are allocated.
+
+    With dtype=np.float32 (mixed precision), the states are converted to
+    float32 once per evaluation, and the model and its derivatives
+    (rhs_vec() and vjp_x()) are evaluated in float32, which halves their
+    memory traffic. The residuals stay in float64: they are differences of
+    consecutive states, much smaller than the states, so their float32
+    rounding errors would be large relative to them, and so would the noise
+    of the objective value in the line searches. The proximal term is in
+    float64 for the same reason.
+
+    Usage:
+        ws = StateWorkspace(T, d, dt, appr, model)
+        np.add(x, 0.000001, out=ws.x0)
+        res = minimize(ws.X_obj_and_grad, x, jac=True,
+                       args=(params, ws.x0, lam), method='L-BFGS-B')
+        X = res['x'].reshape((T, d))
+    '''
+
+    def __init__(self, T, d, dt, appr, model, mask=None, dtype=float):
+        '''
+        Input:
+            T, d: The shape of the states.
+            dt: Time interval between the states, or a (T-1)-dimensional
+                array of the intervals.
+            appr: The type of discretization, e.g. "euler", "ad3" or "bdf2".
+            model: The ODEModel object of the model. model.has_jacobians
+                has to be True.
+            mask: Optional T*d boolean matrix of the observed entries. The
+                proximal term only includes the observed entries.
+            dtype: The floating point type of the evaluations of the model,
+                float or np.float32.
+        '''
+
+        self.T, self.d = T, d
+        self.model = model
+        self.appr = appr
+        # A[t, j] and dtB[t, j] are the weights of X[t+1-j] and
+        # terms[t+1-j], with dt included.
+        self.dtype = np.dtype(dtype)
+        self.A, self.dtB = step_weights(appr, T - 1, dt)
+        A, B = self.A, self.dtB
+        # the columns of the weights that are not zero
+        self.A_cols = [j for j in range(A.shape[1]) if np.any(A[:, j])]
+        self.B_cols = [j for j in range(B.shape[1]) if np.any(B[:, j])]
+        self.R = np.empty((T - 1, d))
+        self.tmp = np.empty((T - 1, d))
+        self.grad = np.empty((T, d))
+        # the inputs of the model, in its precision
+        self.G = np.empty((T, d), dtype=self.dtype)
+        self.X = None if self.dtype == np.float64 else \
+            np.empty((T, d), dtype=self.dtype)
+        self.diff = np.empty(T * d)
+        # the previous states X^*(n-1), filled by the caller
+        self.x0 = np.empty(T * d)
+        self.w = None if mask is None else \
+            np.asarray(mask, dtype=float).ravel()
+
+    def residuals(self, X, terms):
+        '''
+        The residuals of residuals() in discretization.py, written in
+        self.R.
+        '''
+
+        R, tmp = self.R, self.tmp
+        n = R.shape[0]
+        R[...] = 0
+        for C, cols, Z, sign in ((self.A, self.A_cols, X, 1),
+                                 (self.dtB, self.B_cols, terms, -1)):
+            for j in cols:
+                lo = max(j - 1, 0)
+                np.multiply(C[lo:, j:j + 1], Z[lo + 1 - j:n + 1 - j],
+                            out=tmp[lo:])
+                if(sign > 0):
+                    R[lo:] += tmp[lo:]
+                else:
+                    R[lo:] -= tmp[lo:]
+        return R
+
+    def adjoint(self, C, cols, out):
+        '''
+        This writes combine_adjoint(self.R, C) of discretization.py into out,
+        whose first axis is the number of rows of the combined array. cols
+        are the columns of C that are not zero.
+        '''
+
+        R, tmp = self.R, self.tmp
+        n, m = R.shape[0], out.shape[0]
+        out[...] = 0
+        for j in cols:
+            lo, hi = max(j - 1, 0), min(n, m - 1 + j)
+            np.multiply(C[lo:hi, j:j + 1], R[lo:hi], out=tmp[lo:hi])
+            out[lo + 1 - j:hi + 1 - j] += tmp[lo:hi]
+        return out
+
+    def X_obj_and_grad(self, x, params, x0, lam):
+        '''
+        The value and the gradient of X_obj() for the time-major flattened
+        states x. It can be used in scipy.optimize.minimize() with jac=True.
+
+        Input:
+            x: The states flattened in time-major order, X.ravel().
+            params: The parameters.
+            x0: The previous states, flattened in the same order.
+            lam: The hyperparameter lambda.
+        Output:
+            objval: The objective value.
+            objgrad: The gradient with respect to x. It is a new array, since
+                the solvers keep the gradients of the previous evaluations.
+        '''
+
+        T, d = self.T, self.d
+        R = self.R
+        X = x.reshape((T, d))
+        X_model = X
+        if(self.X is not None):
+            self.X[...] = X
+            X_model = self.X
+            params = np.asarray(params, dtype=self.dtype)
+
+        Z = model_input(X_model, self.appr)
+        terms = self.model.rhs_vec(Z, params)
+        self.residuals(X, terms)
+        objval = np.dot(R.ravel(), R.ravel())
+
+        # derivatives of sum(R**2) with respect to the terms (G) and to X
+        # through the A weights (grad)
+        G = self.adjoint(self.dtB, self.B_cols, self.G[:terms.shape[0]])
+        G *= -2
+        grad = self.adjoint(self.A, self.A_cols, self.grad)
+        grad *= 2
+        grad[:G.shape[0]] += self.model.vjp_x(Z, params, G)
+
+        # proximal term
+        diff = self.diff
+        np.subtract(x, x0, out=diff)
+        if(self.w is not None):
+            diff *= self.w
+        objval = objval + lam * np.dot(diff, diff)
+        diff *= 2 * lam
+        objgrad = grad.ravel() + diff
+        return objval, objgrad
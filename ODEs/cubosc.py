@@ -1,4 +1,5 @@
 import autograd.numpy as np
+from ode_model import ODEModel, register_model
 
 def cubosc_ode(t, x, params):
     '''
@@ -9,17 +10,19 @@ def cubosc_ode(t, x, params):
     Input:
         t: time. This should always be the first parameter.
             This is required by the scipy.integrate.ode().
-        x: 3-dimensional state at time t.
-        params: 3-dimensional parameters.
+        x: 2-dimensional state at time t.
+        params: 2-dimensional parameters.
+        A batch of B states (B*d) and parameters (B*p, or p-dimensional
+            if shared) can also be passed, without any loop.
 
     Output:
-        3-dimensional derivative dx/dt=[x0_dot, x1_dot, x2_dot].
+        2-dimensional derivative dx/dt=[x0_dot, x1_dot].
     '''
 
-    a, b = params[0], params[1]
-    xdot = np.zeros_like(x)
-    xdot[0] = -a*x[0]**3 + b*x[1]**3
-    xdot[1] = -b*x[0]**3 - a*x[1]**3
+    params = np.asarray(params)
+    a, b = params[..., 0], params[..., 1]
+    x0_3, x1_3 = x[..., 0]**3, x[..., 1]**3
+    xdot = np.stack((-a*x0_3 + b*x1_3, -b*x0_3 - a*x1_3), -1)
     return xdot
 
 def cubosc_ode_vec(X, params):
@@ -33,18 +36,96 @@ def cubosc_ode_vec(X, params):
     fitzhugh_ode(t, x, params), which is inefficient.
 
     Input:
-        X: T*3 matrix of state.
+        X: T*2 matrix of state.
             The i-th row shows the state at a specific time t_i.
-        params: 3-dimensional parameters.
+        params: 2-dimensional parameters.
+        A batch of problems can also be passed: X can be a B*T*d array
+            and params a B*1*p array (or p-dimensional if shared).
 
     Output:
-        T*3 matrix of derivatives.
+        T*2 matrix of derivatives.
             The i-th row is the derivative of the i-th row of X.
     '''
-    sigma, rho, beta = params[0], params[1], params[2]
-    T = X.shape[0]
-    t1 = -a*X[0:T-1,0]**3 + b*X[0:T-1,1]**3
-    t2 = -b*X[0:T-1,0]**3 - a*X[0:T-1,1]**3
-    terms = np.concatenate((t1.reshape(-1, 1), t2.reshape(-1, 1)), 1)
+    a, b = params[..., 0], params[..., 1]
+    T = X.shape[-2]
+    t1 = -a*X[...,0:T-1,0]**3 + b*X[...,0:T-1,1]**3
+    t2 = -b*X[...,0:T-1,0]**3 - a*X[...,0:T-1,1]**3
+    terms = np.stack((t1, t2), -1)
 
     return terms
+
+
+def cubosc_features(X):
+    '''
+    The cubic oscillator is linear in the parameters:
+    dX/dt = Phi(X)*params + c(X). This function returns Phi and c for each row
+    of X, in the same format as cubosc_ode_vec(X, params).
+
+    Input:
+        X: T*2 matrix of state.
+            The i-th row shows the state at a specific time t_i.
+
+    Output:
+        Phi: (T-1)*2*2 array. Phi[i] is the 2*2 feature matrix of the i-th row.
+        c: (T-1)*2 matrix of the terms that do not depend on the parameters.
+    '''
+    T = X.shape[0]
+    x0_3, x1_3 = X[0:T-1,0]**3, X[0:T-1,1]**3
+    Phi = np.zeros((T - 1, 2, 2))
+    Phi[:, 0, 0] = -x0_3
+    Phi[:, 0, 1] = x1_3
+    Phi[:, 1, 0] = -x1_3
+    Phi[:, 1, 1] = -x0_3
+    c = np.zeros((T - 1, 2))
+    return Phi, c
+
+
+def cubosc_jac_x(X, params):
+    '''
+    This returns the Jacobians of cubosc_ode_vec(X, params) with respect to
+    the state.
+
+    Input:
+        X: T*2 matrix of state.
+            The i-th row shows the state at a specific time t_i.
+        params: 2-dimensional parameters.
+
+    Output:
+        (T-1)*2*2 array. The i-th entry is the Jacobian at the i-th row of X.
+    '''
+    a, b = params[0], params[1]
+    T = X.shape[0]
+    x0_2, x1_2 = 3*X[0:T-1,0]**2, 3*X[0:T-1,1]**2
+    J = np.zeros((T - 1, 2, 2))
+    J[:, 0, 0] = -a*x0_2
+    J[:, 0, 1] = b*x1_2
+    J[:, 1, 0] = -b*x0_2
+    J[:, 1, 1] = -a*x1_2
+    return J
+
+
+class Cubosc(ODEModel):
+    '''
+    The cubic oscillator from Rudy, Kutz, Brunton [2018].
+    '''
+
+    name = 'cubosc'
+    n_params = 2
+    dim = 2
+    has_jacobians = True
+    linear_in_params = True
+
+    def rhs(self, t, x, params):
+        return cubosc_ode(t, x, params)
+
+    def rhs_vec(self, X, params):
+        return cubosc_ode_vec(X, params)
+
+    def features(self, X):
+        return cubosc_features(X)
+
+    def jac_x(self, X, params):
+        return cubosc_jac_x(X, params)
+
+
+register_model(Cubosc())
@@ -1,4 +1,5 @@
 import autograd.numpy as np
+from ode_model import ODEModel, register_model
 
 
 def fitzhugh_nagumo_ode(t, x, params):
@@ -12,14 +13,17 @@ def fitzhugh_nagumo_ode(t, x, params):
             This is required by the scipy.integrate.ode().
         x: 2-dimensional state at time t.
         params: 3-dimensional parameters.
+        A batch of B states (B*d) and parameters (B*p, or p-dimensional
+            if shared) can also be passed, without any loop.
 
     Output:
         2-dimensional derivative dx/dt=[x0_dot, x1_dot].
     '''
-    a, b, c = params[0], params[1], params[2]
-    xdot = np.zeros_like(x)
-    xdot[0] = c * (x[0] - ((x[0] ** 3) / 3) + x[1])
-    xdot[1] = -(1 / c) * (x[0] - a + b * x[1])
+    params = np.asarray(params)
+    a, b, c = params[..., 0], params[..., 1], params[..., 2]
+    x0, x1 = x[..., 0], x[..., 1]
+    xdot = np.stack((c * (x0 - ((x0 ** 3) / 3) + x1),
+                     -(1 / c) * (x0 - a + b * x1)), -1)
     return xdot
 
 
@@ -38,18 +42,94 @@ def fitzhugh_nagumo_ode_vec(X, params):
         X: T*2 matrix of state.
             The i-th row shows the state at a specific time t_i.
         params: 3-dimensional parameters.
+        A batch of problems can also be passed: X can be a B*T*d array
+            and params a B*1*p array (or p-dimensional if shared).
 
     Output:
         T*2 matrix of derivatives.
             The i-th row is the derivative of the i-th row of X.
     '''
 
+    a, b, c = params[..., 0], params[..., 1], params[..., 2]
+    T = X.shape[-2]
+    t1 = (c * (X[..., 0:T - 1, 0] - ((X[..., 0:T - 1, 0] ** 3) / 3) +
+               X[..., 0:T - 1, 1]))
+    t2 = (-(1 / c) * (X[..., 0:T - 1, 0] - a + b * X[..., 0:T - 1, 1]))
+    terms = np.stack((t1, t2), -1)
+
+    return terms
+
+
+def fitzhugh_nagumo_jac_x(X, params):
+    '''
+    This returns the Jacobians of fitzhugh_nagumo_ode_vec(X, params) with respect to
+    the state.
+
+    Input:
+        X: T*2 matrix of state.
+            The i-th row shows the state at a specific time t_i.
+        params: 3-dimensional parameters.
+
+    Output:
+        (T-1)*2*2 array. The i-th entry is the Jacobian at the i-th row of X.
+    '''
+    b, c = params[1], params[2]
+    T = X.shape[0]
+    x0 = X[0:T - 1, 0]
+    J = np.zeros((T - 1, 2, 2))
+    J[:, 0, 0] = c * (1 - x0 ** 2)
+    J[:, 0, 1] = c
+    J[:, 1, 0] = -1 / c
+    J[:, 1, 1] = -b / c
+    return J
+
+
+def fitzhugh_nagumo_jac_params(X, params):
+    '''
+    This returns the Jacobians of fitzhugh_nagumo_ode_vec(X, params) with respect to
+    the parameters.
+
+    Input:
+        X: T*2 matrix of state.
+            The i-th row shows the state at a specific time t_i.
+        params: 3-dimensional parameters.
+
+    Output:
+        (T-1)*2*3 array. The i-th entry is the Jacobian at the i-th row of X.
+    '''
     a, b, c = params[0], params[1], params[2]
     T = X.shape[0]
-    t1 = (c * (X[0:T - 1, 0] - ((X[0:T - 1, 0] ** 3) / 3) + X[0:T - 1, 1]))
-    t2 = (-(1 / c) * (X[0:T - 1, 0] - a + b * X[0:T - 1, 1]))
-    terms = np.concatenate((t1.reshape(-1, 1), t2.reshape(-1, 1)), 1)
+    x0, x1 = X[0:T - 1, 0], X[0:T - 1, 1]
+    J = np.zeros((T - 1, 2, 3))
+    J[:, 0, 2] = x0 - ((x0 ** 3) / 3) + x1
+    J[:, 1, 0] = 1 / c
+    J[:, 1, 1] = -x1 / c
+    J[:, 1, 2] = (x0 - a + b * x1) / (c ** 2)
+    return J
 
-    return terms
+
+class FitzhughNagumo(ODEModel):
+    '''
+    The Fitzhugh-Nagumo model in eq.(17) of the paper.
+    '''
+
+    name = 'fitzhugh_nagumo'
+    n_params = 3
+    dim = 2
+    has_jacobians = True
+    linear_in_params = False
+
+    def rhs(self, t, x, params):
+        return fitzhugh_nagumo_ode(t, x, params)
+
+    def rhs_vec(self, X, params):
+        return fitzhugh_nagumo_ode_vec(X, params)
+
+    def jac_x(self, X, params):
+        return fitzhugh_nagumo_jac_x(X, params)
+
+    def jac_params(self, X, params):
+        return fitzhugh_nagumo_jac_params(X, params)
 
 
+register_model(FitzhughNagumo())
@@ -1,4 +1,5 @@
 import autograd.numpy as np
+from ode_model import ODEModel, register_model
 
 def lorenz_ode(t, x, params):
     '''
@@ -11,16 +12,17 @@ def lorenz_ode(t, x, params):
             This is required by the scipy.integrate.ode().
         x: 3-dimensional state at time t.
         params: 3-dimensional parameters.
+        A batch of B states (B*d) and parameters (B*p, or p-dimensional
+            if shared) can also be passed, without any loop.
 
     Output:
         3-dimensional derivative dx/dt=[x0_dot, x1_dot, x2_dot].
     '''
 
-    sigma, rho, beta = params[0], params[1], params[2]
-    xdot = np.zeros_like(x)
-    xdot[0] = sigma*(x[1] - x[0])
-    xdot[1] = x[0]*(rho - x[2]) - x[1]
-    xdot[2] = x[0]*x[1] - beta*x[2]
+    params = np.asarray(params)
+    sigma, rho, beta = params[..., 0], params[..., 1], params[..., 2]
+    x0, x1, x2 = x[..., 0], x[..., 1], x[..., 2]
+    xdot = np.stack((sigma*(x1 - x0), x0*(rho - x2) - x1, x0*x1 - beta*x2), -1)
     return xdot
 
 def lorenz_ode_vec(X, params):
@@ -37,16 +39,98 @@ def lorenz_ode_vec(X, params):
         X: T*3 matrix of state.
             The i-th row shows the state at a specific time t_i.
         params: 3-dimensional parameters.
+        A batch of problems can also be passed: X can be a B*T*d array
+            and params a B*1*p array (or p-dimensional if shared).
 
     Output:
         T*3 matrix of derivatives.
             The i-th row is the derivative of the i-th row of X.
     '''
+    sigma, rho, beta = params[..., 0], params[..., 1], params[..., 2]
+    T = X.shape[-2]
+    t1 = sigma*(X[...,0:T-1,1] - X[...,0:T-1,0])
+    t2 = X[...,0:T-1,0]*(rho - X[...,0:T-1,2]) - X[...,0:T-1,1]
+    t3 = X[...,0:T-1,0]*X[...,0:T-1,1] - beta*X[...,0:T-1,2]
+    terms = np.stack((t1, t2, t3), -1)
+    return terms
+
+
+def lorenz_features(X):
+    '''
+    The Lorenz ODE is linear in the parameters: dX/dt = Phi(X)*params + c(X).
+    This function returns Phi and c for each row of X, in the same format as
+    lorenz_ode_vec(X, params).
+
+    Input:
+        X: T*3 matrix of state.
+            The i-th row shows the state at a specific time t_i.
+
+    Output:
+        Phi: (T-1)*3*3 array. Phi[i] is the 3*3 feature matrix of the i-th row.
+        c: (T-1)*3 matrix of the terms that do not depend on the parameters.
+    '''
+    T = X.shape[0]
+    x0, x1, x2 = X[0:T-1,0], X[0:T-1,1], X[0:T-1,2]
+    Phi = np.zeros((T - 1, 3, 3))
+    Phi[:, 0, 0] = x1 - x0
+    Phi[:, 1, 1] = x0
+    Phi[:, 2, 2] = -x2
+    c = np.zeros((T - 1, 3))
+    c[:, 1] = -x0*x2 - x1
+    c[:, 2] = x0*x1
+    return Phi, c
+
+
+def lorenz_jac_x(X, params):
+    '''
+    This returns the Jacobians of lorenz_ode_vec(X, params) with respect to
+    the state.
+
+    Input:
+        X: T*3 matrix of state.
+            The i-th row shows the state at a specific time t_i.
+        params: 3-dimensional parameters.
+
+    Output:
+        (T-1)*3*3 array. The i-th entry is the Jacobian at the i-th row of X.
+    '''
     sigma, rho, beta = params[0], params[1], params[2]
     T = X.shape[0]
-    t1 = sigma*(X[0:T-1,1] - X[0:T-1,0])
-    t2 = X[0:T-1,0]*(rho - X[0:T-1,2]) - X[0:T-1,1]
-    t3 = X[0:T-1,0]*X[0:T-1,1] - beta*X[0:T-1,2]
-    terms = np.concatenate((t1.reshape(-1, 1), t2.reshape(-1, 1),
-                            t3.reshape(-1, 1)), 1)
-    return terms
+    x0, x1, x2 = X[0:T-1,0], X[0:T-1,1], X[0:T-1,2]
+    J = np.zeros((T - 1, 3, 3))
+    J[:, 0, 0] = -sigma
+    J[:, 0, 1] = sigma
+    J[:, 1, 0] = rho - x2
+    J[:, 1, 1] = -1
+    J[:, 1, 2] = -x0
+    J[:, 2, 0] = x1
+    J[:, 2, 1] = x0
+    J[:, 2, 2] = -beta
+    return J
+
+
+class Lorenz(ODEModel):
+    '''
+    The Lorenz model.
+    '''
+
+    name = 'lorenz'
+    n_params = 3
+    dim = 3
+    has_jacobians = True
+    linear_in_params = True
+
+    def rhs(self, t, x, params):
+        return lorenz_ode(t, x, params)
+
+    def rhs_vec(self, X, params):
+        return lorenz_ode_vec(X, params)
+
+    def features(self, X):
+        return lorenz_features(X)
+
+    def jac_x(self, X, params):
+        return lorenz_jac_x(X, params)
+
+
+register_model(Lorenz())
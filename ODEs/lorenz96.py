@@ -1,4 +1,10 @@
 import autograd.numpy as np
+from ode_model import (ODEModel, register_model, stencil_neighbours,
+                       stencil_dense)
+
+
+# dx_i/dt depends on x_{i-2}, x_{i-1}, x_i and x_{i+1}.
+STENCIL = (-2, -1, 0, 1)
 
 
 def lorenz96_ode(t, x, params):
@@ -12,20 +18,17 @@ def lorenz96_ode(t, x, params):
             This is required by the scipy.integrate.ode().
         x: d-dimensional state at time t.
         params: 1-dimensional parameter.
+        A batch of B states (B*d) and parameters (B*p, or p-dimensional
+            if shared) can also be passed, without any loop.
 
     Output:
         d-dimensional derivative dx/dt=[x0_dot, x1_dot,...].
     '''
 
-    F = params[0]
-    T = x.shape[0]
-    xdot = np.zeros_like(x)
-    xdot[0] = ((x[1] - x[T - 2]) * x[T - 1]) - x[0]
-    xdot[1] = ((x[2] - x[T - 1]) * x[0]) - x[1]
-    xdot[T - 1] = ((x[0] - x[T - 3]) * x[T - 2]) - x[T - 1]
-    for i in range(2, T - 1):
-        xdot[i] = ((x[i + 1] - x[i - 2]) * x[i - 1]) - x[i]
-    xdot = xdot + F
+    F = np.asarray(params)[..., 0:1]
+    # x_{i-2}, x_{i-1}, x_i and x_{i+1} with periodic boundary conditions
+    xm2, xm1, x, xp1 = stencil_neighbours(np.asarray(x), STENCIL)
+    xdot = ((xp1 - xm2) * xm1) - x + F
     return xdot
 
 def lorenz96_ode_vec(X, params):
@@ -42,23 +45,149 @@ def lorenz96_ode_vec(X, params):
         X: T*d matrix of state.
             The i-th row shows the state at a specific time t_i.
         params: 1-dimensional parameters.
+        A batch of problems can also be passed: X can be a B*T*d array
+            and params a B*1*p array (or p-dimensional if shared).
 
     Output:
         T*d matrix of derivatives.
             The i-th row is the derivative of the i-th row of X.
     '''
 
+    F = params[..., 0:1]
+    T = X.shape[-2]
+    Xp = X[..., 0:T - 1, :]
+    # x_{i-2}, x_{i-1}, x_i and x_{i+1} with periodic boundary conditions
+    xm2, xm1, x, xp1 = stencil_neighbours(Xp, STENCIL)
+    terms = (xp1 - xm2) * xm1 - x + F
+
+    return terms
+
+
+def lorenz96_features(X):
+    '''
+    The ODE in eq.(19) of the paper is linear in the parameter F:
+    dX/dt = Phi(X)*params + c(X). This function returns Phi and c for each row
+    of X, in the same format as lorenz96_ode_vec(X, params).
+
+    Input:
+        X: T*d matrix of state.
+            The i-th row shows the state at a specific time t_i.
+
+    Output:
+        Phi: (T-1)*d*1 array. Phi[i] is the d*1 feature matrix of the i-th row.
+        c: (T-1)*d matrix of the terms that do not depend on the parameters.
+    '''
+    T, d = X.shape
+    Phi = np.ones((T - 1, d, 1))
+    c = lorenz96_ode_vec(X, np.zeros(1))
+    return Phi, c
+
+
+def lorenz96_jac_x(X, params):
+    '''
+    This returns the Jacobians of lorenz96_ode_vec(X, params) with respect to
+    the state.
+
+    Input:
+        X: T*d matrix of state.
+            The i-th row shows the state at a specific time t_i.
+        params: 1-dimensional parameters.
+
+    Output:
+        (T-1)*d*d array. The i-th entry is the Jacobian at the i-th row of X.
+    '''
+    return stencil_dense(lorenz96_jac_stencil(X, params), STENCIL)
+
+
+def lorenz96_jac_stencil(X, params):
+    '''
+    This returns the derivatives of lorenz96_ode_vec(X, params) with respect
+    to the neighbours x_{i-2}, x_{i-1}, x_i and x_{i+1} (see STENCIL).
+
+    Input:
+        X: T*d matrix of state.
+        params: 1-dimensional parameters.
+
+    Output:
+        (T-1)*d*4 array.
+    '''
+
+    T = X.shape[0]
+    Xp = X[0:T - 1, :]
+    xm2, xm1, x, xp1 = stencil_neighbours(Xp, STENCIL)
+    return np.stack((-xm1, xp1 - xm2, -np.ones_like(Xp), xm1), -1)
+
+
+def lorenz96_vjp_x(X, params, G):
+    '''
+    This returns G^T * J for each row, where J is the Jacobian of
+    lorenz96_ode_vec(X, params) with respect to the state, without building
+    the d*d Jacobians. It takes O(T*d) operations.
+
+    Input:
+        X: T*d matrix of state.
+        params: 1-dimensional parameters.
+        G: (T-1)*d matrix.
+
+    Output:
+        (T-1)*d matrix.
+    '''
+
+    T = X.shape[0]
+    Xp = X[0:T - 1, :]
+    # out_j = g_{j-1}*x_{j-2} - g_{j+2}*x_{j+1} + g_{j+1}*(x_{j+2} - x_{j-1}) - g_j
+    roll = np.roll
+    return (roll(G, 1, 1) * roll(Xp, 2, 1) - roll(G, -2, 1) * roll(Xp, -1, 1)
+            + roll(G, -1, 1) * (roll(Xp, -2, 1) - roll(Xp, 1, 1)) - G)
+
+
+def lorenz96_kernel(x, params, out):
+    '''
+    This is lorenz96_ode() for a single state, written with a plain loop so
+    that it can be compiled with numba (see predict_batch() in simulate.py).
+
+    Input:
+        x: d-dimensional state.
+        params: 1-dimensional parameter.
+        out: d-dimensional array where the derivative dx/dt is written.
+    '''
+
     F = params[0]
-    T,d=X.shape
-    temp1 = ((X[0:T - 1, 3:d] - X[0:T - 1, 0:d - 3]) * X[0:T - 1, 1:d - 2] -
-             X[0:T - 1, 2:d - 1] + F)
-    temp2 = ((X[0:T - 1, 1] - X[0:T - 1, d - 2]) * X[0:T - 1, d - 1] -
-             X[0:T - 1, 0] + F)
-    temp3 = ((X[0:T - 1, 2] - X[0:T - 1, d - 1]) * X[0:T - 1, 0] -
-             X[0:T - 1, 1] + F)
-    temp4 = ((X[0:T - 1, 0] - X[0:T - 1, d - 3]) * X[0:T - 1, d - 2] -
-             X[0:T - 1, d - 1] + F)
-    terms = np.concatenate((temp2.reshape(-1, 1), temp3.reshape(-1, 1),
-                            temp1, temp4.reshape(-1, 1)), 1)
-
-    return terms
\ No newline at end of file
+    d = x.shape[0]
+    for i in range(d):
+        out[i] = ((x[(i + 1) % d] - x[i - 2]) * x[i - 1]) - x[i] + F
+
+
+class Lorenz96(ODEModel):
+    '''
+    The Lorenz96 model in eq.(19) of the paper, for any dimension d.
+    '''
+
+    name = 'lorenz96'
+    n_params = 1
+    dim = None
+    has_jacobians = True
+    linear_in_params = True
+    rhs_kernel = staticmethod(lorenz96_kernel)
+    stencil = STENCIL
+
+    def rhs(self, t, x, params):
+        return lorenz96_ode(t, x, params)
+
+    def rhs_vec(self, X, params):
+        return lorenz96_ode_vec(X, params)
+
+    def features(self, X):
+        return lorenz96_features(X)
+
+    def jac_x(self, X, params):
+        return lorenz96_jac_x(X, params)
+
+    def jac_stencil(self, X, params):
+        return lorenz96_jac_stencil(X, params)
+
+    def vjp_x(self, X, params, G):
+        return lorenz96_vjp_x(X, params, G)
+
+
+register_model(Lorenz96())
@@ -1,4 +1,5 @@
 import autograd.numpy as np
+from ode_model import ODEModel, register_model
 
 def lotka_volterra_ode(t,x, params):
     '''
@@ -11,14 +12,16 @@ def lotka_volterra_ode(t,x, params):
             This is required by the scipy.integrate.ode().
         x: 2-dimensional state at time t.
         params: 4-dimensional parameters.
+        A batch of B states (B*d) and parameters (B*p, or p-dimensional
+            if shared) can also be passed, without any loop.
 
     Output:
         2-dimensional derivative dx/dt=[x0_dot, x1_dot].
     '''
-    a, b, c, d = params[0], params[1], params[2], params[3]
-    xdot = np.zeros_like(x)
-    xdot[0] = a*x[0] - b*x[0]*x[1]
-    xdot[1] = -c*x[1] + d*x[0]*x[1]
+    params = np.asarray(params)
+    a, b, c, d = params[..., 0], params[..., 1], params[..., 2], params[..., 3]
+    x0, x1 = x[..., 0], x[..., 1]
+    xdot = np.stack((a*x0 - b*x0*x1, -c*x1 + d*x0*x1), -1)
     return xdot
 
 def lotka_volterra_ode_vec(X, params):
@@ -36,16 +39,93 @@ def lotka_volterra_ode_vec(X, params):
         X: T*2 matrix of state.
             The i-th row shows the state at a specific time t_i.
         params: 4-dimensional parameters.
+        A batch of problems can also be passed: X can be a B*T*d array
+            and params a B*1*p array (or p-dimensional if shared).
 
     Output:
         T*2 matrix of derivatives.
             The i-th row is the derivative of the i-th row of X.
     '''
+    a, b, c, d = params[..., 0], params[..., 1], params[..., 2], params[..., 3]
+    T = X.shape[-2]
+    t1 = (a * X[..., 0:T - 1, 0] - b * X[..., 0:T - 1, 0] * X[..., 0:T - 1, 1])
+    t2 = (-c * X[..., 0:T - 1, 1] + d * X[..., 0:T - 1, 0] * X[..., 0:T - 1, 1])
+
+    terms = np.stack((t1, t2), -1)
+    return terms
+
+
+def lotka_volterra_features(X):
+    '''
+    The ODE in eq.(16) of the paper is linear in the parameters:
+    dX/dt = Phi(X)*params + c(X). This function returns Phi and c for each row
+    of X, in the same format as lotka_volterra_ode_vec(X, params).
+
+    Input:
+        X: T*2 matrix of state.
+            The i-th row shows the state at a specific time t_i.
+
+    Output:
+        Phi: (T-1)*2*4 array. Phi[i] is the 2*4 feature matrix of the i-th row.
+        c: (T-1)*2 matrix of the terms that do not depend on the parameters.
+    '''
+    T = X.shape[0]
+    x0, x1 = X[0:T - 1, 0], X[0:T - 1, 1]
+    Phi = np.zeros((T - 1, 2, 4))
+    Phi[:, 0, 0] = x0
+    Phi[:, 0, 1] = -x0 * x1
+    Phi[:, 1, 2] = -x1
+    Phi[:, 1, 3] = x0 * x1
+    c = np.zeros((T - 1, 2))
+    return Phi, c
+
+
+def lotka_volterra_jac_x(X, params):
+    '''
+    This returns the Jacobians of lotka_volterra_ode_vec(X, params) with respect to
+    the state.
+
+    Input:
+        X: T*2 matrix of state.
+            The i-th row shows the state at a specific time t_i.
+        params: 4-dimensional parameters.
+
+    Output:
+        (T-1)*2*2 array. The i-th entry is the Jacobian at the i-th row of X.
+    '''
     a, b, c, d = params[0], params[1], params[2], params[3]
     T = X.shape[0]
-    t1 = (a * X[0:T - 1, 0] - b * X[0:T - 1, 0] * X[0:T - 1, 1])
-    t2 = (-c * X[0:T - 1, 1] + d * X[0:T - 1, 0] * X[0:T - 1, 1])
+    x0, x1 = X[0:T - 1, 0], X[0:T - 1, 1]
+    J = np.zeros((T - 1, 2, 2))
+    J[:, 0, 0] = a - b * x1
+    J[:, 0, 1] = -b * x0
+    J[:, 1, 0] = d * x1
+    J[:, 1, 1] = -c + d * x0
+    return J
+
+
+class LotkaVolterra(ODEModel):
+    '''
+    The Lotka-Volterra model in eq.(16) of the paper.
+    '''
+
+    name = 'lotka_volterra'
+    n_params = 4
+    dim = 2
+    has_jacobians = True
+    linear_in_params = True
+
+    def rhs(self, t, x, params):
+        return lotka_volterra_ode(t, x, params)
+
+    def rhs_vec(self, X, params):
+        return lotka_volterra_ode_vec(X, params)
+
+    def features(self, X):
+        return lotka_volterra_features(X)
+
+    def jac_x(self, X, params):
+        return lotka_volterra_jac_x(X, params)
 
-    terms = np.concatenate((t1.reshape(-1, 1), t2.reshape(-1, 1)), 1)
-    return terms
 
+register_model(LotkaVolterra())
@@ -0,0 +1,216 @@
+import importlib
+import autograd.numpy as np
+
+
+class ODEModel(object):
+    '''
+    This is the base class of the ODE models. Each file in the ODEs/ folder
+    defines a subclass of ODEModel and registers an instance of it with
+    register_model(). The objectives, fit_direct(), simulate() and predict()
+    only use the attributes and methods below, so a new model can also be
+    passed to them directly as an instance, without registering it.
+
+    Attributes:
+        name: Name of the model, e.g. 'lorenz96'.
+        n_params: Number of parameters p.
+        dim: Dimension d of the states, or None if any d is accepted.
+        linear_in_params: True if dX/dt = Phi(X)*params + c(X). Then
+            features() has to be implemented.
+        has_jacobians: True if jac_x() and jac_params() are implemented.
+            Then the gradients of the objectives are computed analytically
+            instead of with autograd.
+        rhs_kernel: Optional function kernel(x, params, out) that writes
+            dx/dt of a single state into out, written with plain loops so it
+            can be compiled with numba. predict_batch() uses it when numba is
+            installed.
+        stencil: Optional tuple of the offsets of the neighbours, for the
+            models with a local coupling on a periodic lattice: dx_i/dt only
+            depends on x_{(i+o) mod d} for o in stencil. Then jac_stencil()
+            has to be implemented, and the Gauss-Newton solver uses the
+            sparse Jacobians instead of the d*d ones, so its cost is linear
+            in d.
+    '''
+
+    name = None
+    n_params = None
+    dim = None
+    linear_in_params = False
+    has_jacobians = False
+    rhs_kernel = None
+    stencil = None
+
+    def rhs(self, t, x, params):
+        '''
+        Derivative dx/dt of a single d-dimensional state x at time t.
+        This is the function sent to the scipy.integrate.ode().
+        '''
+        raise NotImplementedError
+
+    def rhs_vec(self, X, params):
+        '''
+        Derivatives of the first T-1 rows of the T*d matrix of states X,
+        as a (T-1)*d matrix. This function is used inside the autograd.
+        '''
+        raise NotImplementedError
+
+    def features(self, X):
+        '''
+        Phi and c of dX/dt = Phi(X)*params + c(X) for the first T-1 rows of
+        X, as a (T-1)*d*p array and a (T-1)*d matrix.
+        '''
+        raise NotImplementedError
+
+    def jac_x(self, X, params):
+        '''
+        Jacobians of rhs_vec() with respect to the state, for the first T-1
+        rows of X, as a (T-1)*d*d array.
+        '''
+        raise NotImplementedError
+
+    def jac_stencil(self, X, params):
+        '''
+        Jacobians of rhs_vec() with respect to the neighbours of the
+        stencil, for the first T-1 rows of X, as a (T-1)*d*S array, where S
+        is the number of offsets: Js[t, i, k] is the derivative of dx_i/dt
+        with respect to x_{(i+stencil[k]) mod d} at X[t].
+        '''
+        raise NotImplementedError
+
+    def jac_params(self, X, params):
+        '''
+        Jacobians of rhs_vec() with respect to the parameters, for the first
+        T-1 rows of X, as a (T-1)*d*p array. For the models that are linear
+        in the parameters, this is Phi(X).
+        '''
+        if(self.linear_in_params):
+            return self.features(X)[0]
+        raise NotImplementedError
+
+    def vjp_x(self, X, params, G):
+        '''
+        Vector-Jacobian product with respect to the state: the derivative of
+        sum(G * rhs_vec(X, params)) with respect to the first T-1 rows of X,
+        where G is a (T-1)*d matrix. Models with a local structure can
+        override it to avoid building the d*d Jacobians.
+        '''
+        J = self.jac_x(X, params)
+        return np.einsum('ti,tij->tj', G, J)
+
+    def vjp_params(self, X, params, G):
+        '''
+        Vector-Jacobian product with respect to the parameters: the
+        derivative of sum(G * rhs_vec(X, params)) with respect to params.
+        '''
+        J = self.jac_params(X, params)
+        return np.einsum('ti,tip->p', G, J)
+
+    def __repr__(self):
+        return '%s(%r)' % (type(self).__name__, self.name)
+
+
+def stencil_shift(X, o):
+    '''
+    This returns the neighbours x_{(i+o) mod d} of all the entries along the
+    last axis of X, e.g. stencil_shift(X, -1)[..., i] = X[..., i-1].
+    '''
+
+    return np.roll(X, -o, -1)
+
+
+def stencil_neighbours(X, stencil):
+    '''
+    This returns the neighbours x_{(i+o) mod d} along the last axis of X for
+    all the offsets o of the stencil, e.g. [X[..., i-1], X[..., i+1]] for
+    the stencil (-1, 1). X is copied once with a periodic halo (ghost
+    cells), and the neighbours are views of the copy.
+    '''
+
+    d = X.shape[-1]
+    lo, hi = min(min(stencil), 0), max(max(stencil), 0)
+    Xpad = X[..., np.arange(lo, d + hi) % d]
+    return [Xpad[..., o - lo:o - lo + d] for o in stencil]
+
+
+def stencil_jvp(Js, stencil, V):
+    '''
+    Jacobian-vector products with the stencil Jacobians of jac_stencil():
+    (J[t] v[t])_i = sum_k Js[t, i, k] v[t, i+stencil[k]]. It takes O(T*d*S)
+    operations.
+    '''
+
+    out = 0.
+    for k, V_o in enumerate(stencil_neighbours(V, stencil)):
+        out = out + Js[..., k] * V_o
+    return out
+
+
+def stencil_vjp(Js, stencil, G):
+    '''
+    Vector-Jacobian products with the stencil Jacobians of jac_stencil():
+    (g[t]^T J[t])_j = sum_k g[t, j-stencil[k]] Js[t, j-stencil[k], k].
+    '''
+
+    out = 0.
+    for k, o in enumerate(stencil):
+        out = out + stencil_shift(G * Js[..., k], -o)
+    return out
+
+
+def stencil_dense(Js, stencil):
+    '''
+    This turns the stencil Jacobians of jac_stencil() into the (T-1)*d*d
+    Jacobians of jac_x(). The neighbours are added one offset at a time,
+    because they coincide when d is small.
+    '''
+
+    n, d = Js.shape[0:2]
+    i = np.arange(d)
+    J = np.zeros((n, d, d))
+    for k, o in enumerate(stencil):
+        J[:, i, (i + o) % d] = J[:, i, (i + o) % d] + Js[..., k]
+    return J
+
+
+# The registered models, keyed on their names.
+MODELS = {}
+
+
+def register_model(model):
+    '''
+    This adds a model to the registry, so it can be selected by its name.
+
+    Input:
+        model: An instance of an ODEModel subclass.
+    Output:
+        model: The same instance.
+    '''
+
+    MODELS[model.name] = model
+    return model
+
+
+def get_model(ODE):
+    '''
+    This returns the model object for a name or a model object. It is called
+    once per fit, and the returned object is passed to the objectives.
+    The models of the ODEs/ folder are imported on their first use: the
+    model 'new' is defined in the file ODEs/new.py.
+
+    Input:
+        ODE: Name of the model as a string, or an ODEModel instance.
+    Output:
+        model: The ODEModel instance.
+    '''
+
+    if(isinstance(ODE, ODEModel)):
+        return ODE
+    if(ODE not in MODELS):
+        try:
+            importlib.import_module(ODE)
+        except ModuleNotFoundError as e:
+            if(e.name != ODE):
+                raise
+    if(ODE not in MODELS):
+        raise ValueError('Unknown ODE model: %r. The registered models are: '
+                         '%s' % (ODE, ', '.join(sorted(MODELS))))
+    return MODELS[ODE]
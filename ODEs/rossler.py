@@ -1,4 +1,5 @@
 import autograd.numpy as np
+from ode_model import ODEModel, register_model
 
 def rossler_ode(t, x, params):
     '''
@@ -11,16 +12,17 @@ def rossler_ode(t, x, params):
             This is required by the scipy.integrate.ode().
         x: 3-dimensional state at time t.
         params: 3-dimensional parameters.
+        A batch of B states (B*d) and parameters (B*p, or p-dimensional
+            if shared) can also be passed, without any loop.
 
     Output:
         3-dimensional derivative dx/dt=[x0_dot, x1_dot, x2_dot].
     '''
 
-    a, b, c = params[0], params[1], params[2]
-    xdot = np.zeros_like(x)
-    xdot[0] = -x[1] - x[2]
-    xdot[1] = x[0] + a*x[1]
-    xdot[2] = b + (x[2] * (x[0] - c) )
+    params = np.asarray(params)
+    a, b, c = params[..., 0], params[..., 1], params[..., 2]
+    x0, x1, x2 = x[..., 0], x[..., 1], x[..., 2]
+    xdot = np.stack((-x1 - x2, x0 + a*x1, b + (x2 * (x0 - c) )), -1)
     return xdot
 
 def rossler_ode_vec(X, params):
@@ -37,16 +39,96 @@ def rossler_ode_vec(X, params):
         X: T*3 matrix of state.
             The i-th row shows the state at a specific time t_i.
         params: 3-dimensional parameters.
+        A batch of problems can also be passed: X can be a B*T*d array
+            and params a B*1*p array (or p-dimensional if shared).
 
     Output:
         T*3 matrix of derivatives.
             The i-th row is the derivative of the i-th row of X.
     '''
-    a, b, c = params[0], params[1], params[2]
+    a, b, c = params[..., 0], params[..., 1], params[..., 2]
+    T = X.shape[-2]
+    t1 = -X[...,0:T-1,1] - X[...,0:T-1,2]
+    t2 = X[...,0:T-1,0] + a*X[...,0:T-1,1]
+    t3 = b + (X[...,0:T-1,2] * (X[...,0:T-1,0] - c) )
+    terms = np.stack((t1, t2, t3), -1)
+    return terms
+
+
+def rossler_features(X):
+    '''
+    The ODE in eq.(18) of the paper is linear in the parameters:
+    dX/dt = Phi(X)*params + c(X). This function returns Phi and c for each row
+    of X, in the same format as rossler_ode_vec(X, params).
+
+    Input:
+        X: T*3 matrix of state.
+            The i-th row shows the state at a specific time t_i.
+
+    Output:
+        Phi: (T-1)*3*3 array. Phi[i] is the 3*3 feature matrix of the i-th row.
+        c: (T-1)*3 matrix of the terms that do not depend on the parameters.
+    '''
     T = X.shape[0]
-    t1 = -X[0:T-1,1] - X[0:T-1,2]
-    t2 = X[0:T-1,0] + a*X[0:T-1,1]
-    t3 = b + (X[0:T-1,2] * (X[0:T-1,0] - c) )
-    terms = np.concatenate((t1.reshape(-1, 1), t2.reshape(-1, 1),
-                            t3.reshape(-1, 1)), 1)
-    return terms
\ No newline at end of file
+    x0, x1, x2 = X[0:T-1,0], X[0:T-1,1], X[0:T-1,2]
+    Phi = np.zeros((T - 1, 3, 3))
+    Phi[:, 1, 0] = x1
+    Phi[:, 2, 1] = 1
+    Phi[:, 2, 2] = -x2
+    c = np.zeros((T - 1, 3))
+    c[:, 0] = -x1 - x2
+    c[:, 1] = x0
+    c[:, 2] = x2 * x0
+    return Phi, c
+
+
+def rossler_jac_x(X, params):
+    '''
+    This returns the Jacobians of rossler_ode_vec(X, params) with respect to
+    the state.
+
+    Input:
+        X: T*3 matrix of state.
+            The i-th row shows the state at a specific time t_i.
+        params: 3-dimensional parameters.
+
+    Output:
+        (T-1)*3*3 array. The i-th entry is the Jacobian at the i-th row of X.
+    '''
+    a, c = params[0], params[2]
+    T = X.shape[0]
+    J = np.zeros((T - 1, 3, 3))
+    J[:, 0, 1] = -1
+    J[:, 0, 2] = -1
+    J[:, 1, 0] = 1
+    J[:, 1, 1] = a
+    J[:, 2, 0] = X[0:T-1,2]
+    J[:, 2, 2] = X[0:T-1,0] - c
+    return J
+
+
+class Rossler(ODEModel):
+    '''
+    The Rossler model in eq.(18) of the paper.
+    '''
+
+    name = 'rossler'
+    n_params = 3
+    dim = 3
+    has_jacobians = True
+    linear_in_params = True
+
+    def rhs(self, t, x, params):
+        return rossler_ode(t, x, params)
+
+    def rhs_vec(self, X, params):
+        return rossler_ode_vec(X, params)
+
+    def features(self, X):
+        return rossler_features(X)
+
+    def jac_x(self, X, params):
+        return rossler_jac_x(X, params)
+
+
+register_model(Rossler())
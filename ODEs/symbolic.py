@@ -0,0 +1,368 @@
+import hashlib
+import importlib.util
+import os
+import re
+import autograd.numpy as np
+from ode_model import ODEModel, register_model
+try:
+    import sympy
+    from sympy.printing.numpy import NumPyPrinter
+    from sympy.printing.pycode import PythonCodePrinter
+except ImportError:
+    sympy = None
+
+
+# The version of the generated code. It is part of the key of the cache, so
+# the cached kernels are generated again when the generator changes.
+GENERATOR_VERSION = 1
+
+# The folder of the generated kernels. It can be changed with the
+# ODE_KERNEL_CACHE environment variable.
+CACHE_DIR = os.environ.get(
+    'ODE_KERNEL_CACHE',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '__kernels__'))
+
+# The generated modules that are already loaded, keyed on their files, so the
+# kernels of a model are the same functions in all its instances (the
+# compiled numba loops of predict_batch() are keyed on them).
+KERNELS = {}
+
+HEADER = '''# Generated by ODEs/symbolic.py from the model %r. Do not edit.
+import math
+import autograd.numpy as numpy
+
+NAME = %r
+STATES = %r
+PARAMS = %r
+LINEAR = %r
+RHS = %r
+
+
+def _full(e, like):
+    return e + numpy.zeros_like(like)
+'''
+
+
+def require_sympy():
+    '''
+    This raises an ImportError if sympy is not installed.
+    '''
+
+    if(sympy is None):
+        raise ImportError('The generation of the kernels of a symbolic model '
+                          'requires sympy (pip install sympy). The kernels '
+                          'already in the cache are loaded without it.')
+
+
+def parse_rhs(states, params, rhs):
+    '''
+    This turns the right-hand side of a model into sympy expressions of the
+    internal symbols _x0, _x1, ... of the states and _p0, _p1, ... of the
+    parameters.
+
+    Input:
+        states: The names of the d states.
+        params: The names of the p parameters.
+        rhs: The d derivatives as strings or sympy expressions of the names.
+    Output:
+        X: The d symbols of the states.
+        P: The p symbols of the parameters.
+        exprs: The d expressions of the derivatives.
+    '''
+
+    require_sympy()
+    X = sympy.symbols(['_x%d' % i for i in range(len(states))])
+    P = sympy.symbols(['_p%d' % i for i in range(len(params))])
+    names = {n: sympy.Symbol(n) for n in list(states) + list(params)}
+    subs = dict(zip([names[n] for n in list(states) + list(params)], X + P))
+    exprs = []
+    for f in rhs:
+        if(isinstance(f, str)):
+            f = sympy.parse_expr(f, local_dict=dict(names))
+        f = sympy.sympify(f)
+        unknown = f.free_symbols - set(names.values())
+        if(unknown):
+            raise ValueError('Unknown symbols in %s: %s' % (
+                f, ', '.join(sorted(str(s) for s in unknown))))
+        exprs.append(f.xreplace(subs))
+    return X, P, exprs
+
+
+def is_linear(exprs, P):
+    '''
+    True if all the expressions are linear in the symbols P.
+    '''
+
+    for f in exprs:
+        for p in P:
+            for q in P:
+                if(sympy.expand(sympy.diff(f, p, q)) != 0):
+                    return False
+    return True
+
+
+def vector_function(fname, args, inputs, outputs, printer, reduce=False):
+    '''
+    This writes a function of arrays with any leading (batch and time) axes.
+    The inputs are the last axes of the arguments, and the outputs are
+    stacked on new last axes. The common subexpressions of all the outputs
+    are computed once.
+
+    Input:
+        fname: Name of the function.
+        args: Names of the arguments.
+        inputs: (symbols, argument) pairs: symbols[i] is argument[..., i].
+        outputs: A list of expressions, or a list of lists for a matrix.
+        printer: The sympy printer of the expressions.
+        reduce: If True, the outputs are summed over the leading axes.
+    Output:
+        The source of the function.
+    '''
+
+    matrix = isinstance(outputs[0], list)
+    flat = [f for row in outputs for f in row] if matrix else list(outputs)
+    # the constant outputs can be Python numbers
+    flat = [sympy.sympify(f) for f in flat]
+    lines = ['def %s(%s):' % (fname, ', '.join(args))]
+    for symbols, arg in inputs:
+        lines += ['    %s = %s[..., %d]' % (s, arg, i)
+                  for i, s in enumerate(symbols)]
+    like = inputs[0][0][0]
+    varying = set(s for symbols, arg in inputs if arg != 'p'
+                  for s in symbols)
+    replacements, reduced = sympy.cse(
+        flat, symbols=sympy.numbered_symbols('_t'))
+    lines += ['    %s = %s' % (s, printer.doprint(e))
+              for s, e in replacements]
+    # the outputs that do not depend on the states are broadcast to them
+    code = [printer.doprint(e) if f.free_symbols & varying else
+            '_full(%s, %s)' % (printer.doprint(e), like)
+            for f, e in zip(flat, reduced)]
+    if(matrix):
+        n = len(outputs[0])
+        rows = ['numpy.stack((%s,), -1)' % ', '.join(code[i:i + n])
+                for i in range(0, len(code), n)]
+        out = 'numpy.stack((%s,), -2)' % ', '.join(rows)
+    else:
+        out = 'numpy.stack((%s,), -1)' % ', '.join(code)
+    if(reduce):
+        out = 'numpy.sum(numpy.reshape(%s, (-1, %d)), 0)' % (out, len(code))
+    lines.append('    return %s' % out)
+    return '\n'.join(lines) + '\n'
+
+
+def kernel_function(X, P, exprs):
+    '''
+    This writes kernel(x, params, out), the derivative of a single state
+    with scalar operations only, so it can be compiled with numba.
+    '''
+
+    printer = PythonCodePrinter()
+    lines = ['def kernel(x, p, out):']
+    lines += ['    %s = x[%d]' % (s, i) for i, s in enumerate(X)]
+    lines += ['    %s = p[%d]' % (s, i) for i, s in enumerate(P)]
+    replacements, reduced = sympy.cse(
+        exprs, symbols=sympy.numbered_symbols('_t'))
+    lines += ['    %s = %s' % (s, printer.doprint(e))
+              for s, e in replacements]
+    lines += ['    out[%d] = %s' % (i, printer.doprint(e))
+              for i, e in enumerate(reduced)]
+    return '\n'.join(lines) + '\n'
+
+
+def generate_source(name, states, params, rhs):
+    '''
+    This differentiates the right-hand side of a model symbolically and
+    returns the source of the module of its kernels:
+        rhs(x, p): the derivatives, for any leading axes of x and p;
+        jac_x(x, p), jac_params(x, p): the Jacobians, ...*d*d and ...*d*p;
+        vjp_x(x, p, g), vjp_params(x, p, g): the vector-Jacobian products,
+            without the Jacobians (the latter is summed over the rows);
+        features(x): Phi and c, for the models that are linear in the
+            parameters;
+        kernel(x, p, out): the derivative of a single state, for numba.
+
+    Input:
+        name: Name of the model.
+        states, params, rhs: As in parse_rhs().
+    Output:
+        The source code as a string.
+    '''
+
+    X, P, exprs = parse_rhs(states, params, rhs)
+    d = len(X)
+    G = sympy.symbols(['_g%d' % i for i in range(d)])
+    Jx = [[sympy.diff(f, x) for x in X] for f in exprs]
+    Jp = [[sympy.diff(f, p) for p in P] for f in exprs]
+    linear = is_linear(exprs, P)
+    printer = NumPyPrinter()
+
+    xp = [(X, 'x'), (P, 'p')]
+    parts = [HEADER % (name, name, list(states), list(params), linear,
+                       [str(f) for f in rhs])]
+    parts.append(vector_function('rhs', ('x', 'p'), xp, exprs, printer))
+    parts.append(vector_function('jac_x', ('x', 'p'), xp, Jx, printer))
+    parts.append(vector_function('jac_params', ('x', 'p'), xp, Jp, printer))
+    vjp_x = [sum(g * J[j] for g, J in zip(G, Jx)) for j in range(d)]
+    vjp_params = [sum(g * J[k] for g, J in zip(G, Jp))
+                  for k in range(len(P))]
+    xpg = xp + [(G, 'g')]
+    parts.append(vector_function('vjp_x', ('x', 'p', 'g'), xpg, vjp_x,
+                                 printer))
+    parts.append(vector_function('vjp_params', ('x', 'p', 'g'), xpg,
+                                 vjp_params, printer, reduce=True))
+    if(linear):
+        zero = dict((p, sympy.S.Zero) for p in P)
+        parts.append(vector_function('phi', ('x',), [(X, 'x')], Jp, printer))
+        parts.append(vector_function('offset', ('x',), [(X, 'x')],
+                                     [sympy.sympify(f.xreplace(zero))
+                                      for f in exprs],
+                                     printer))
+        parts.append('def features(x):\n    return phi(x), offset(x)\n')
+    parts.append(kernel_function(X, P, exprs))
+    return '\n\n'.join(parts)
+
+
+def spec_key(name, states, params, rhs):
+    '''
+    The key of the generated module in the cache: a hash of the model and
+    of the version of the generator. The expressions given as strings are
+    hashed as they are, so the cached kernels are found without sympy.
+    '''
+
+    rhs = [f if isinstance(f, str) else sympy.srepr(f) for f in rhs]
+    text = repr((GENERATOR_VERSION, name, list(states), list(params), rhs))
+    return hashlib.sha256(text.encode()).hexdigest()[0:16]
+
+
+def load_kernels(path):
+    '''
+    This imports the generated module in the file path, once per process.
+    '''
+
+    if(path not in KERNELS):
+        module_name = '_kernels_' + os.path.splitext(os.path.basename(path))[0]
+        spec = importlib.util.spec_from_file_location(module_name, path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        KERNELS[path] = module
+    return KERNELS[path]
+
+
+class SymbolicModel(ODEModel):
+    '''
+    A model whose kernels are generated from its right-hand side by
+    symbolic_model(). The instances are pickled as the name of the file of
+    the kernels, e.g. for the processes of the segmented state step.
+    '''
+
+    has_jacobians = True
+
+    def __init__(self, path):
+        '''
+        Input:
+            path: The file of the generated kernels.
+        '''
+
+        self.path = path
+        self.kernels = load_kernels(path)
+        self.name = self.kernels.NAME
+        self.states = self.kernels.STATES
+        self.params = self.kernels.PARAMS
+        self.dim = len(self.states)
+        self.n_params = len(self.params)
+        self.linear_in_params = self.kernels.LINEAR
+        self.rhs_kernel = self.kernels.kernel
+
+    def __reduce__(self):
+        return (SymbolicModel, (self.path,))
+
+    def rhs(self, t, x, params):
+        return self.kernels.rhs(x, np.asarray(params))
+
+    def rhs_vec(self, X, params):
+        T = X.shape[-2]
+        return self.kernels.rhs(X[..., 0:T - 1, :], params)
+
+    def features(self, X):
+        if(not self.linear_in_params):
+            raise NotImplementedError
+        T = X.shape[-2]
+        return self.kernels.features(X[..., 0:T - 1, :])
+
+    def jac_x(self, X, params):
+        T = X.shape[-2]
+        return self.kernels.jac_x(X[..., 0:T - 1, :], params)
+
+    def jac_params(self, X, params):
+        T = X.shape[-2]
+        return self.kernels.jac_params(X[..., 0:T - 1, :], params)
+
+    def vjp_x(self, X, params, G):
+        T = X.shape[-2]
+        return self.kernels.vjp_x(X[..., 0:T - 1, :], params, G)
+
+    def vjp_params(self, X, params, G):
+        T = X.shape[-2]
+        return self.kernels.vjp_params(X[..., 0:T - 1, :], params, G)
+
+
+def symbolic_model(name, states, params, rhs, register=True, cache_dir=None):
+    '''
+    This defines a model from its right-hand side only. The derivatives for
+    a single state and for the batches of states, the Jacobians with respect
+    to the states and to the parameters, their vector products, the features
+    of the models that are linear in the parameters and the numba kernel are
+    all generated from the same expressions, with common subexpression
+    elimination (sympy.cse). The generated module is written to cache_dir,
+    keyed on a hash of the model, and later calls only import it, so sympy
+    is only needed the first time.
+
+    Example:
+        model = symbolic_model('cubosc', ['x', 'y'], ['a', 'b'],
+                               ['-a*x**3 + b*y**3', '-b*x**3 - a*y**3'])
+        params, X, pred_X = fit_direct(Y, dt, init_params, 'cubosc')
+
+    Input:
+        name: Name of the model, under which it is registered.
+        states: The names of the d states (strings or sympy symbols).
+        params: The names of the p parameters.
+        rhs: The d derivatives dx/dt as 1) strings of Python expressions of
+            the names, with the functions of sympy (sin, exp, sqrt, ...),
+            2) sympy expressions of symbols with these names, or 3) a
+            function rhs(x, params) of the lists of the symbols of the states
+            and the parameters, that returns the list of the derivatives
+            with arithmetic and sympy functions only.
+        register: If True, the model is registered with register_model(), so
+            it can be selected by its name.
+        cache_dir: The folder of the generated kernels, CACHE_DIR by default.
+    Output:
+        model: The SymbolicModel instance.
+    '''
+
+    states = [str(s) for s in states]
+    params = [str(p) for p in params]
+    if(callable(rhs)):
+        require_sympy()
+        rhs = rhs([sympy.Symbol(s) for s in states],
+                  [sympy.Symbol(p) for p in params])
+    rhs = list(rhs)
+    if(len(rhs) != len(states)):
+        raise ValueError('The model has %d states but %d derivatives.'
+                         % (len(states), len(rhs)))
+
+    cache_dir = CACHE_DIR if cache_dir is None else cache_dir
+    path = os.path.join(cache_dir, '%s_%s.py' % (
+        re.sub(r'\W', '_', name), spec_key(name, states, params, rhs)))
+    if(not os.path.exists(path)):
+        source = generate_source(name, states, params, rhs)
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp = '%s.%d.tmp' % (path, os.getpid())
+        with open(tmp, 'w') as f:
+            f.write(source)
+        os.replace(tmp, path)
+
+    model = SymbolicModel(path)
+    if(register):
+        register_model(model)
+    return model
@@ -0,0 +1,400 @@
+import numpy as np
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'AUX'))
+from fit_direct import fit_direct
+from simulate import simulate, predict
+from objectives import X_obj, param_obj, X_obj_and_grad, param_obj_and_grad
+from generate import generate_corpus
+from ode_model import get_model
+from autograd import grad
+
+# Run this file to benchmark the fits, objectives and simulations of all the
+# models, e.g.
+#   python benchmark.py --out results.json
+#   python benchmark.py --baseline results.json --out new.json
+# The second command reports the cases that got slower or less accurate than
+# the results in results.json. The baselines depend on the machine, so they
+# are not part of the repository.
+
+
+# The problems of the benchmark, the same as in demo.py where possible.
+# x0 is a function of the dimension d, which is only used by lorenz96. The
+# predictions have to be stable with every discretization: from x0 = [2, 0],
+# the Euler method diverges on cubosc with dt = .05.
+CASES = {
+    'fitzhugh_nagumo': {'x0': lambda d: [-1, 1], 'true_param': [.2, .5, 3],
+                        'end_t': 20, 'dt': .05, 'init_param': [2, 2, 5]},
+    'lotka_volterra': {'x0': lambda d: [5, 3], 'true_param': [2, 1, 4, 1],
+                       'end_t': 4, 'dt': .1, 'init_param': [2, 2, 5, 2]},
+    'rossler': {'x0': lambda d: [1.13293, -1.74953, 0.02207],
+                'true_param': [.2, .2, 3], 'end_t': 20, 'dt': .1,
+                'init_param': [2, 2, 5]},
+    'lorenz': {'x0': lambda d: [1, 1, 1], 'true_param': [10, 28, 8 / 3],
+               'end_t': 2, 'dt': .01, 'init_param': [5, 20, 5]},
+    'cubosc': {'x0': lambda d: [1, 0], 'true_param': [.1, 2], 'end_t': 10,
+               'dt': .05, 'init_param': [1, 1]},
+    'lorenz96': {'x0': lambda d: 8 + .001 * (np.arange(d) == d // 2),
+                 'true_param': [8], 'end_t': 2, 'dt': .01,
+                 'init_param': [1000], 'burn_in': 50},
+}
+
+# Sizes of the problems: multipliers of end_t (i.e. of T), and the
+# dimensions of lorenz96.
+SIZES = {
+    'quick': {'t_scales': (1,), 'dims': (10,)},
+    'full': {'t_scales': (1, 4), 'dims': (10, 20, 40)},
+}
+
+
+def make_problem(ODE_str, d, t_scale, noise_var, seed=0):
+    '''
+    This creates the clean states and noisy observations of one case.
+
+    Output:
+        X, Y: T*d numpy arrays of the clean states and the observations.
+        dt: Time interval between the observations.
+        case: The dictionary of the case in CASES.
+    '''
+
+    case = CASES[ODE_str]
+    x0 = np.asarray(case['x0'](d), dtype=float)
+    X, Y, dt = generate_corpus(ODE_str, x0, case['true_param'],
+                               case['end_t'] * t_scale, case['dt'],
+                               [noise_var], seed=seed,
+                               burn_in=case.get('burn_in', 0))
+    return X[0], Y[0, 0, 0], dt, case
+
+
+def timeit(fun, repeat):
+    '''
+    This returns the smallest wall time of repeat calls of fun().
+    '''
+
+    times = []
+    for r in range(repeat):
+        start = time.perf_counter()
+        fun()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def peak_memory(fun):
+    '''
+    This returns the peak memory in bytes allocated by fun(), as measured
+    by tracemalloc (numpy reports its arrays to tracemalloc).
+    '''
+
+    tracemalloc.start()
+    try:
+        fun()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def bench_objectives(X, Y, dt, case, ODE_str, appr, repeat):
+    '''
+    Time of one evaluation of the value and gradient of X_obj() and
+    param_obj(), with the analytic gradients if the model has them and with
+    autograd otherwise.
+    '''
+
+    model = get_model(ODE_str)
+    T, d = Y.shape
+    params = np.asarray(case['true_param'], dtype=float)
+    x = Y.flatten('F')
+    if(model.has_jacobians):
+        X_fun = lambda: X_obj_and_grad(x, params, dt, x, 1., d, appr, model)
+        p_fun = lambda: param_obj_and_grad(params, Y, dt, appr, model)
+    else:
+        X_grad, p_grad = grad(X_obj), grad(param_obj)
+        X_fun = lambda: (X_obj(x, params, dt, x, 1., d, appr, model),
+                         X_grad(x, params, dt, x, 1., d, appr, model))
+        p_fun = lambda: (param_obj(params, Y, dt, appr, model),
+                         p_grad(params, Y, dt, appr, model))
+    return {'X_obj_time': timeit(X_fun, repeat),
+            'param_obj_time': timeit(p_fun, repeat)}
+
+
+def bench_simulation(X, Y, dt, case, ODE_str, appr, repeat):
+    '''
+    Time of simulate() and predict() over the same horizon.
+    '''
+
+    T = X.shape[0]
+    end_t = (T - 1) * dt
+    params = case['true_param']
+    sim = lambda: simulate(ODE_str, X[0], params, end_t, dt, 0.)
+    pred = lambda: predict(X[0], end_t, dt, params, ODE_str, appr)
+    return {'simulate_time': timeit(sim, repeat),
+            'predict_time': timeit(pred, repeat)}
+
+
+def bench_fit(X, Y, dt, case, ODE_str, appr, max_iters, tol, memory,
+              **fit_kwargs):
+    '''
+    Wall time, iterations, peak memory and errors of fit_direct(). The peak
+    memory is measured in a second run, only if memory is True, because
+    tracemalloc slows the fit down and would distort the wall time.
+    '''
+
+    init_param = np.asarray(case['init_param'], dtype=float)
+    true_param = np.asarray(case['true_param'], dtype=float)
+    fit = lambda: fit_direct(Y, dt, init_param, ODE_str, appr, lam=1,
+                             max_iters=max_iters, tol=tol, return_info=True,
+                             **fit_kwargs)
+    # hide the progress messages of fit_direct()
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        params, est_X, pred_X, info = fit()
+        wall = time.perf_counter() - start
+        peak = peak_memory(fit) if memory else None
+    param_error = (np.linalg.norm(params - true_param) /
+                   np.linalg.norm(true_param))
+    return {'fit_time': wall, 'n_iters': info['n_iters'],
+            'converged': info['converged'], 'peak_memory': peak,
+            'param_error': float(param_error),
+            'pred_error': float(np.mean((pred_X - X) ** 2)),
+            'state_error': float(np.mean((est_X - X) ** 2))}
+
+
+def bench_precision(X, Y, dt, case, ODE_str, appr, max_iters, tol, memory,
+                    **fit_kwargs):
+    '''
+    Accuracy, wall time and peak memory of fit_direct() with
+    precision="mixed", relative to the float64 fit with the same options.
+    The models without analytic Jacobians are skipped.
+    '''
+
+    if(not get_model(ODE_str).has_jacobians):
+        return {}
+    init_param = np.asarray(case['init_param'], dtype=float)
+    fits = {}
+    for precision in ('double', 'mixed'):
+        fit = lambda: fit_direct(Y, dt, init_param, ODE_str, appr, lam=1,
+                                 max_iters=max_iters, tol=tol,
+                                 return_info=True, workspace=True,
+                                 precision=precision, **fit_kwargs)
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            result = fit()
+            wall = time.perf_counter() - start
+            peak = peak_memory(fit) if memory else None
+        fits[precision] = result, wall, peak
+    (params, est_X, pred_X, info), wall, peak = fits['mixed']
+    ref_params, ref_X = fits['double'][0][0:2]
+    return {'mixed_fit_time': wall, 'double_fit_time': fits['double'][1],
+            'mixed_peak_memory': peak,
+            'double_peak_memory': fits['double'][2],
+            'mixed_n_iters': info['n_iters'],
+            'mixed_param_diff': float(np.linalg.norm(params - ref_params) /
+                                      np.linalg.norm(ref_params)),
+            'mixed_state_diff': float(np.linalg.norm(est_X - ref_X) /
+                                      np.linalg.norm(ref_X))}
+
+
+def case_key(result):
+    '''
+    The fields that identify a case, used to match a result with the
+    baseline.
+    '''
+
+    return (result['model'], result['appr'], result['T'], result['d'],
+            result['noise_var'])
+
+
+def run(models, apprs, noise_vars, size='quick', repeat=3, max_iters=2000,
+        tol=1e-8, memory=False, fit=True, verbose=True, precision=False,
+        **fit_kwargs):
+    '''
+    This runs the benchmark over all the combinations of models,
+    discretizations, problem sizes and noise levels.
+
+    Input:
+        models: A list of model names.
+        apprs: A list of discretizations (e.g. "euler", "ad3" or "bdf2").
+        noise_vars: A list of noise levels.
+        size: A key of SIZES.
+        repeat: Number of repetitions of the fast timings (the smallest time
+            is reported).
+        max_iters, tol: The same as in fit_direct().
+        memory: If True, the peak memory of fit_direct() is measured in a
+            second run of each fit, which doubles the time of the
+            benchmark. Otherwise it is None.
+        fit: If False, fit_direct() is not benchmarked.
+        precision: If True, the fits with precision="mixed" are compared
+            with the float64 ones (see bench_precision()).
+        verbose: If True, print one line per case.
+        fit_kwargs: Other arguments of fit_direct(), e.g. X_solver.
+    Output:
+        results: A list of dictionaries, one per case.
+    '''
+
+    results = []
+    for ODE_str in models:
+        dims = SIZES[size]['dims'] if ODE_str == 'lorenz96' else (None,)
+        for d in dims:
+            for t_scale in SIZES[size]['t_scales']:
+                for noise_var in noise_vars:
+                    X, Y, dt, case = make_problem(ODE_str, d, t_scale,
+                                                  noise_var)
+                    for appr in apprs:
+                        result = {'model': ODE_str, 'appr': appr,
+                                  'T': X.shape[0], 'd': X.shape[1],
+                                  'noise_var': noise_var}
+                        result.update(bench_objectives(X, Y, dt, case,
+                                                       ODE_str, appr, repeat))
+                        result.update(bench_simulation(X, Y, dt, case,
+                                                       ODE_str, appr, repeat))
+                        if(fit):
+                            result.update(bench_fit(X, Y, dt, case, ODE_str,
+                                                    appr, max_iters, tol,
+                                                    memory, **fit_kwargs))
+                        if(precision):
+                            result.update(bench_precision(
+                                X, Y, dt, case, ODE_str, appr, max_iters, tol,
+                                memory, **fit_kwargs))
+                        if(verbose):
+                            print(format_result(result))
+                        results.append(result)
+    return results
+
+
+def format_result(result):
+    '''
+    One line summary of a result.
+    '''
+
+    line = '%-16s %-5s T=%-5d d=%-3d noise=%-5g X_obj=%.2es param_obj=%.2es' \
+           % (result['model'], result['appr'], result['T'], result['d'],
+              result['noise_var'], result['X_obj_time'],
+              result['param_obj_time'])
+    if('fit_time' in result):
+        line += ' fit=%.2fs iters=%d param_err=%.2e' % (
+            result['fit_time'], result['n_iters'], result['param_error'])
+    if('mixed_fit_time' in result):
+        line += ' mixed=%.2fs/%.2fs param_diff=%.1e state_diff=%.1e' % (
+            result['mixed_fit_time'], result['double_fit_time'],
+            result['mixed_param_diff'], result['mixed_state_diff'])
+    return line
+
+
+def compare(results, baseline, time_factor=1.25, error_factor=1.5):
+    '''
+    This compares the results with a baseline and returns the regressions:
+    the times that grew by more than time_factor, and the errors and
+    iterations that grew by more than error_factor. A metric that is not
+    finite (e.g. the error of a prediction that diverged) is always a
+    regression, also for the cases missing from the baseline, whose other
+    metrics are skipped.
+
+    Input:
+        results: The list returned by run().
+        baseline: A list of results of an earlier run.
+    Output:
+        regressions: A list of (key, metric, baseline value, new value).
+    '''
+
+    old = {case_key(r): r for r in baseline}
+    regressions = []
+    for r in results:
+        b = old.get(case_key(r))
+        for metric, value in r.items():
+            if(isinstance(value, float) and not np.isfinite(value)):
+                regressions.append((case_key(r), metric,
+                                    None if b is None else b.get(metric),
+                                    value))
+        if(b is None):
+            continue
+        for metric, value in r.items():
+            if(not isinstance(value, float) or not np.isfinite(value) or
+                    b.get(metric) is None or metric == 'noise_var'):
+                continue
+            factor = time_factor if metric.endswith('_time') else error_factor
+            # errors close to the machine precision are not compared
+            if(value > factor * b[metric] and value > 1e-12):
+                regressions.append((case_key(r), metric, b[metric], value))
+        if(r.get('n_iters', 0) > error_factor * b.get('n_iters', np.inf)):
+            regressions.append((case_key(r), 'n_iters', b['n_iters'],
+                                r['n_iters']))
+        if(b.get('converged') and r.get('converged') is False):
+            regressions.append((case_key(r), 'converged', True, False))
+    return regressions
+
+
+def json_safe(results):
+    '''
+    A copy of the results with None instead of the values that are not
+    finite, which are not valid JSON.
+    '''
+
+    return [{key: None if isinstance(value, float) and
+             not np.isfinite(value) else value
+             for key, value in r.items()} for r in results]
+
+
+def environment():
+    '''
+    Information about the machine, saved with the results.
+    '''
+
+    import scipy
+    return {'python': platform.python_version(), 'numpy': np.__version__,
+            'scipy': scipy.__version__, 'platform': platform.platform(),
+            'processor': platform.processor(), 'cpu_count': os.cpu_count(),
+            'date': time.strftime('%Y-%m-%d %H:%M:%S')}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark of the fits, '
+                                     'objectives and simulations.')
+    parser.add_argument('--models', nargs='+', default=sorted(CASES))
+    parser.add_argument('--apprs', nargs='+', default=['euler', 'ad2', 'ad3'])
+    parser.add_argument('--noise', nargs='+', type=float, default=[.1, .5])
+    parser.add_argument('--size', choices=sorted(SIZES), default='quick')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--max-iters', type=int, default=2000)
+    parser.add_argument('--tol', type=float, default=1e-8)
+    parser.add_argument('--memory', action='store_true',
+                        help='also measure the peak memory (runs each fit '
+                        'twice)')
+    parser.add_argument('--no-fit', action='store_true',
+                        help='only benchmark the objectives and simulations')
+    parser.add_argument('--precision', action='store_true',
+                        help='compare the mixed precision fits with the '
+                        'float64 ones')
+    parser.add_argument('--out', help='save the results to this JSON file')
+    parser.add_argument('--baseline', help='JSON file of an earlier run')
+    args = parser.parse_args(argv)
+
+    results = run(args.models, args.apprs, args.noise, args.size,
+                  args.repeat, args.max_iters, args.tol,
+                  memory=args.memory, fit=not args.no_fit,
+                  precision=args.precision)
+    if(args.out is not None):
+        with open(args.out, 'w') as f:
+            json.dump({'environment': environment(),
+                       'results': json_safe(results)}, f, indent=1,
+                      allow_nan=False)
+    if(args.baseline is not None):
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline)
+        for key, metric, old, new in regressions:
+            print('REGRESSION', key, metric, old, '->', new)
+        if(regressions):
+            return 1
+        print('no regressions')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,10 +1,11 @@
 import autograd.numpy as np
 import matplotlib.pyplot as plt
 import matplotlib
+import os
 import sys
-sys.path.append('./AUX/')
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'AUX'))
 from fit_direct import fit_direct
-from simulate import *
+from simulate import simulate
 
 # Set ODE_str to 'fitzhugh_nagumo' or 'lotka_volterra' or 'rossler' or 'lorenz96'
 ODE_str = 'fitzhugh_nagumo' # it takes 30-40 seconds
@@ -0,0 +1,6 @@
+import os
+import sys
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.append(os.path.join(ROOT, 'AUX'))
+sys.path.append(os.path.join(ROOT, 'ODEs'))
+sys.path.append(ROOT)
@@ -0,0 +1,24 @@
+import contextlib
+import io
+import numpy as np
+from fit_direct import fit_direct
+from simulate import simulate
+
+
+def test_adaptive_lam_is_not_worse_than_fixed():
+    # with a lambda that grew without bound, this fit stopped on tol with
+    # twice the prediction error of the fixed lambda
+    np.random.seed(0)
+    X, Y, dt = simulate('fitzhugh_nagumo', np.array([-1., 1.]), [.2, .5, 3],
+                        10, .05, noise_var=.5)
+    errors, lams = [], []
+    for schedule in (None, 'adaptive'):
+        with contextlib.redirect_stdout(io.StringIO()):
+            params, X_hat, pred_X = fit_direct(
+                Y, dt, np.array([2., 2., 5.]), 'fitzhugh_nagumo', 'ad3',
+                max_iters=3000, tol=1e-8, acceleration='anderson',
+                lam_schedule=schedule,
+                callback=lambda record: lams.append(record['lam']))
+        errors.append(np.sum((pred_X - X) ** 2))
+    assert max(lams) <= 100
+    assert errors[1] <= 1.1 * errors[0]
@@ -0,0 +1,41 @@
+import json
+import numpy as np
+import pytest
+import benchmark
+from simulate import predict
+
+
+def result(**metrics):
+    r = {'model': 'cubosc', 'appr': 'euler', 'T': 201, 'd': 2,
+         'noise_var': .1, 'fit_time': 1., 'pred_error': 1e-3}
+    r.update(metrics)
+    return r
+
+
+@pytest.mark.parametrize('appr', ['euler', 'ad2', 'ad3', 'bdf2'])
+@pytest.mark.parametrize('name', sorted(set(benchmark.CASES) - {'lorenz96'}))
+def test_cases_are_stable(name, appr):
+    case = benchmark.CASES[name]
+    pX = predict(np.asarray(case['x0'](None), dtype=float), case['end_t'],
+                 case['dt'], case['true_param'], name, appr)
+    assert np.all(np.isfinite(pX))
+
+
+def test_compare_flags_non_finite_metrics():
+    baseline = [result()]
+    assert benchmark.compare([result()], baseline) == []
+    regressions = benchmark.compare([result(pred_error=np.nan)], baseline)
+    assert [r[1] for r in regressions] == ['pred_error']
+    # also without a baseline
+    regressions = benchmark.compare([result(fit_time=np.inf)], [])
+    assert [r[1] for r in regressions] == ['fit_time']
+
+
+def test_results_are_valid_json(tmp_path):
+    safe = benchmark.json_safe([result(pred_error=np.nan)])
+    assert safe[0]['pred_error'] is None
+    text = json.dumps(safe, allow_nan=False)
+
+    def reject(constant):
+        raise ValueError(constant)
+    assert json.loads(text, parse_constant=reject) == safe
@@ -0,0 +1,99 @@
+import numpy as np
+import pytest
+from fit_direct import fit_direct
+from simulate import simulate
+from convergence import ConvergenceMonitor
+
+
+@pytest.fixture(scope='module')
+def data():
+    np.random.seed(0)
+    X, Y, dt = simulate('lorenz', np.array([-8., 7., 27.]),
+                        [10., 28., 8 / 3.], 6, .01, noise_var=.5)
+    return Y[0:501], Y[501:551], dt
+
+
+def fit(Y, dt, monitor, max_iters=2000, **kwargs):
+    return fit_direct(Y, dt, np.array([5., 20., 2.]), 'lorenz', 'ad3',
+                      max_iters=max_iters, convergence=monitor,
+                      return_info=True, **kwargs)
+
+
+@pytest.mark.parametrize('restore_best', [True, False])
+def test_holdout_stop_returns_the_best_iterate(data, restore_best):
+    Y, Y_h, dt = data
+    monitor = ConvergenceMonitor(rtol=None, param_rtol=None, holdout=Y_h,
+                                 eval_every=5, holdout_patience=3,
+                                 restore_best=restore_best)
+    params, X, pred_X, info = fit(Y, dt, monitor)
+    assert info['stop_reason'] == 'holdout'
+    report = info['convergence']
+    assert report['best_holdout_iter'] < info['n_iters'] - 1
+    assert report['restored'] == restore_best
+    error = monitor.holdout_error(params, X)
+    if(restore_best):
+        np.testing.assert_array_equal(params, monitor.best_params)
+        assert error == report['best_holdout_error']
+    else:
+        assert error > report['best_holdout_error']
+
+
+def test_budgets(data):
+    Y, Y_h, dt = data
+    info = fit(Y, dt, ConvergenceMonitor(rtol=None, param_rtol=None,
+                                         max_evals=200))[3]
+    assert info['stop_reason'] == 'eval_budget'
+    assert info['convergence']['evals'] >= 200
+    info = fit(Y, dt, ConvergenceMonitor(rtol=None, param_rtol=None,
+                                         max_time=0.))[3]
+    assert info['stop_reason'] == 'time_budget'
+    assert info['n_iters'] == 1
+
+
+def test_resume_continues_the_monitor(data, tmp_path):
+    # a fit interrupted by max_iters and resumed from its checkpoint stops
+    # at the same iteration, with the same best iterate, as without the
+    # interruption
+    Y, Y_h, dt = data
+    options = dict(rtol=None, param_rtol=None, holdout=Y_h, eval_every=5,
+                   holdout_patience=3)
+    monitor = ConvergenceMonitor(**options)
+    params, X, pred_X, info = fit(Y, dt, monitor)
+    assert info['stop_reason'] == 'holdout'
+    path = str(tmp_path / 'fit.npz')
+    n = info['n_iters'] - 7
+    monitor_r = ConvergenceMonitor(**options)
+    assert fit(Y, dt, monitor_r, max_iters=n,
+               checkpoint=path)[3]['stop_reason'] == 'max_iters'
+    assert len(monitor_r.history) == n
+    monitor_r = ConvergenceMonitor(**options)
+    params_r, X_r, pred_X_r, info_r = fit(Y, dt, monitor_r, resume=path)
+    assert info_r['stop_reason'] == 'holdout'
+    assert info_r['n_iters'] == info['n_iters']
+    np.testing.assert_array_equal(params_r, params)
+    np.testing.assert_array_equal(X_r, X)
+    report, report_r = info['convergence'], info_r['convergence']
+    for key in ('n_iters', 'evals', 'best_holdout_error',
+                'best_holdout_iter', 'restored', 'joint_cost'):
+        assert report_r[key] == report[key]
+    strip = lambda h: [{k: v for k, v in r.items() if k != 'time'}
+                       for r in h]
+    assert strip(monitor_r.history) == strip(monitor.history)
+    # the clock continues from the elapsed time of the first run
+    assert monitor_r.history[n]['time'] >= monitor_r.history[n - 1]['time']
+
+
+def test_state_round_trip(data):
+    Y, Y_h, dt = data
+    monitor = ConvergenceMonitor(holdout=Y_h, eval_every=3)
+    fit(Y, dt, monitor, max_iters=10)
+    copy = ConvergenceMonitor(holdout=Y_h, eval_every=3)
+    copy.start(monitor.model, monitor.appr, dt)
+    copy.set_state(monitor.get_state())
+    assert copy.history == monitor.history
+    assert copy.report()['time'] == monitor.report()['time']
+    for key in ('n_evals', 'n_small', 'n_worse', 'best_error', 'best_iter',
+                'prev_cost', 'stop_reason'):
+        assert getattr(copy, key) == getattr(monitor, key)
+    np.testing.assert_array_equal(copy.best_X, monitor.best_X)
+    np.testing.assert_array_equal(copy.prev_params, monitor.prev_params)
@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+from discretization import lmm_coefficients, step_weights, window_weights
+
+
+SCHEMES = ['euler', 'ad2', 'ad3', 'ab4', 'am2', 'am3', 'bdf2', 'bdf3']
+
+
+@pytest.mark.parametrize('family, k, order', [
+    ('ab', 1, 1), ('ab', 2, 2), ('ab', 4, 4), ('am', 0, 1), ('am', 1, 2),
+    ('am', 3, 4), ('bdf', 1, 1), ('bdf', 2, 2), ('bdf', 5, 5)])
+def test_lmm_order(family, k, order):
+    # the method is exact for the polynomials x(s) = s^q, q <= order
+    alpha, beta = lmm_coefficients(family, k)
+    s = 1. - np.arange(len(alpha))
+    for q in range(order + 1):
+        dx = q * s ** (q - 1) if q > 0 else 0 * s
+        assert abs(np.dot(alpha, s ** q) - np.dot(beta, dx)) < 1e-10
+    q = order + 1
+    assert abs(np.dot(alpha, s ** q) - np.dot(beta, q * s ** (q - 1))) > 1e-6
+
+
+@pytest.mark.parametrize('appr', SCHEMES)
+def test_uniform_array_matches_scalar(appr):
+    A, H = step_weights(appr, 30, 0.05)
+    A_v, H_v = step_weights(appr, 30, np.full(30, 0.05))
+    np.testing.assert_allclose(A_v, A, atol=1e-12)
+    np.testing.assert_allclose(H_v, H, rtol=1e-10, atol=1e-14)
+
+
+@pytest.mark.parametrize('appr', SCHEMES)
+@pytest.mark.parametrize('dt', [0.05, 'random'])
+def test_window_matches_full(appr, dt):
+    if(dt == 'random'):
+        dt = 0.05 * (1 + np.random.RandomState(0).rand(30))
+    A, H = step_weights(appr, 30, dt)
+    A_w, H_w = window_weights(appr, dt, 7, 19)
+    np.testing.assert_allclose(A_w, A[7:18], atol=1e-12)
+    np.testing.assert_allclose(H_w, H[7:18], atol=1e-12)
+
+
+def test_wrong_number_of_intervals():
+    with pytest.raises(ValueError):
+        step_weights('ad3', 30, np.full(29, 0.05))
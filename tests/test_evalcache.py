@@ -0,0 +1,29 @@
+import numpy as np
+from discretization import model_input
+from evalcache import EvalCache
+from ode_model import get_model
+
+
+def test_versions_of_the_states():
+    model = get_model('fitzhugh_nagumo')
+    rng = np.random.RandomState(0)
+    X = rng.randn(20, 2)
+    params = np.array([.2, .5, 3.])
+    cache = EvalCache(model, 'ad3', .05)
+    cost = cache.param_obj(params, X, .05, 'ad3', model)
+    Z = cache.Z
+
+    # the first evaluation of the state step reuses the cache
+    cache.state_step()
+    assert cache.terms(X.copy(), params)[0] is Z
+    # the next ones are at new states
+    X_new = X + 1
+    Z_new, terms = cache.terms(X_new, params)
+    np.testing.assert_array_equal(Z_new, model_input(X_new, 'ad3'))
+    np.testing.assert_array_equal(terms, model.rhs_vec(Z_new, params))
+
+    # the same array modified in place is a new version
+    X += 1
+    cache.new_states()
+    assert cache.param_obj(params, X, .05, 'ad3', model) != cost
+    np.testing.assert_array_equal(cache.Z, model_input(X, 'ad3'))
@@ -0,0 +1,67 @@
+import contextlib
+import io
+import numpy as np
+import pytest
+from fit_batch import fit_direct_batch
+from fit_direct import fit_direct
+from simulate import simulate
+
+CASES = {'lorenz': (np.array([-8., 7., 27.]), [10., 28., 8 / 3.], 1, .01,
+                    np.array([5., 20., 2.])),
+         'fitzhugh_nagumo': (np.array([-1., 1.]), [.2, .5, 3], 5, .05,
+                             np.array([1., 1., 1.]))}
+
+
+def series(ODE_str, B):
+    x0, true_params, end, dt, init = CASES[ODE_str]
+    np.random.seed(0)
+    Ys = np.stack([simulate(ODE_str, x0, true_params, end, dt,
+                            noise_var=.1)[1] for b in range(B)])
+    return Ys, dt, init
+
+
+@pytest.mark.parametrize('ODE_str', ['lorenz', 'fitzhugh_nagumo'])
+def test_batch_equals_fit_direct_per_series(ODE_str):
+    # the series are independent problems with unique solutions per step,
+    # so the joint L-BFGS steps reach the per-series ones, up to the
+    # tolerance of the inner solver
+    Ys, dt, init = series(ODE_str, 3)
+    with contextlib.redirect_stdout(io.StringIO()):
+        params, X = fit_direct_batch(Ys, dt, init, ODE_str, 'ad3',
+                                     max_iters=10, tol=-np.inf)[0:2]
+        for b in range(3):
+            params_b, X_b = fit_direct(Ys[b], dt, init, ODE_str, 'ad3',
+                                       max_iters=10, tol=-np.inf)[0:2]
+            np.testing.assert_allclose(params[b], params_b, rtol=1e-3)
+            np.testing.assert_allclose(X[b], X_b, rtol=1e-3, atol=1e-3)
+
+
+@pytest.mark.parametrize('ODE_str', ['lorenz', 'fitzhugh_nagumo'])
+def test_shared_params_of_copies_equal_fit_direct(ODE_str):
+    # B copies of a series multiply the objective by B, so the shared
+    # parameters and the states are those of the single series
+    Ys, dt, init = series(ODE_str, 1)
+    with contextlib.redirect_stdout(io.StringIO()):
+        params, X = fit_direct_batch(np.repeat(Ys, 2, 0), dt, init, ODE_str,
+                                     'ad3', max_iters=10, tol=-np.inf,
+                                     shared_params=True)[0:2]
+        params_1, X_1 = fit_direct(Ys[0], dt, init, ODE_str, 'ad3',
+                                   max_iters=10, tol=-np.inf)[0:2]
+    np.testing.assert_allclose(params, params_1, rtol=1e-3)
+    for b in range(2):
+        np.testing.assert_allclose(X[b], X_1, rtol=1e-3, atol=1e-3)
+
+
+@pytest.mark.parametrize('shared_params', [False, True])
+def test_batch_solvers_agree(shared_params):
+    Ys, dt, init = series('lorenz', 2)
+    fits = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for param_solver, gradients in [('auto', 'auto'),
+                                        ('lbfgs', 'autograd')]:
+            fits.append(fit_direct_batch(
+                Ys, dt, init, 'lorenz', 'bdf2', max_iters=10, tol=-np.inf,
+                shared_params=shared_params, param_solver=param_solver,
+                gradients=gradients)[0:2])
+    np.testing.assert_allclose(fits[0][0], fits[1][0], rtol=1e-3)
+    np.testing.assert_allclose(fits[0][1], fits[1][1], rtol=1e-3, atol=1e-3)
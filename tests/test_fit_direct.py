@@ -0,0 +1,128 @@
+import numpy as np
+import pytest
+from fit_direct import fit_direct
+from ode_model import get_model
+from simulate import simulate
+
+
+@pytest.fixture(scope='module')
+def data():
+    np.random.seed(0)
+    X, Y, dt = simulate('fitzhugh_nagumo', np.array([-1., 1.]),
+                        [.2, .5, 3], 5, .05, noise_var=.1)
+    return Y, dt
+
+
+def fit(Y, dt, **kwargs):
+    options = {'max_iters': 30, 'tol': -np.inf, 'return_info': True}
+    options.update(kwargs)
+    return fit_direct(Y, dt, np.array([2., 2., 5.]), 'fitzhugh_nagumo',
+                      'ad3', **options)
+
+
+def test_uniform_array_dt_matches_scalar(data):
+    Y, dt = data
+    params, X = fit(Y, dt)[0:2]
+    params_v, X_v = fit(Y, np.full(Y.shape[0] - 1, dt))[0:2]
+    np.testing.assert_allclose(params_v, params, rtol=1e-6)
+    np.testing.assert_allclose(X_v, X, atol=1e-6)
+
+
+def test_full_mask_matches_unmasked(data):
+    Y, dt = data
+    params, X = fit(Y, dt)[0:2]
+    params_m, X_m = fit(Y, dt, mask=np.ones(Y.shape, dtype=bool))[0:2]
+    np.testing.assert_allclose(params_m, params, rtol=1e-6)
+    np.testing.assert_allclose(X_m, X, atol=1e-6)
+
+
+def test_eval_cache_does_not_change_the_fit(data):
+    Y, dt = data
+    params, X = fit(Y, dt, eval_cache=True)[0:2]
+    params_n, X_n = fit(Y, dt, eval_cache=False)[0:2]
+    np.testing.assert_allclose(params_n, params, rtol=1e-8)
+    np.testing.assert_allclose(X_n, X, atol=1e-8)
+
+
+@pytest.mark.parametrize('ODE_str, x0, true_params, dt', [
+    ('fitzhugh_nagumo', [-1., 1.], [.2, .5, 3], .05),
+    ('lorenz', [-8., 7., 27.], [10., 28., 8 / 3.], .01)])
+def test_eval_cache_saves_two_evaluations_per_iteration(
+        ODE_str, x0, true_params, dt, monkeypatch):
+    # the objective value of the iteration and the first evaluation of the
+    # state step
+    np.random.seed(0)
+    Y = simulate(ODE_str, np.array(x0), true_params, 100 * dt, dt,
+                 noise_var=.1)[1]
+    model = get_model(ODE_str)
+    calls = []
+    rhs_vec = model.rhs_vec
+    monkeypatch.setattr(model, 'rhs_vec',
+                        lambda *args: calls.append(1) or rhs_vec(*args))
+    counts = []
+    for eval_cache in [True, False]:
+        del calls[:]
+        info = fit_direct(Y, dt, np.ones(model.n_params), model, 'ad3',
+                          max_iters=20, tol=-np.inf, eval_cache=eval_cache,
+                          return_info=True)[3]
+        counts.append(len(calls))
+    assert counts[1] - counts[0] == 2 * info['n_iters']
+
+
+def test_resume_matches_uninterrupted(data, tmp_path):
+    Y, dt = data
+    path = str(tmp_path / 'fit.npz')
+    params, X, pred_X, info = fit(Y, dt, max_iters=30)
+    fit(Y, dt, max_iters=12, checkpoint=path, checkpoint_every=5)
+    params_r, X_r, pred_X_r, info_r = fit(Y, dt, max_iters=30, resume=path)
+    np.testing.assert_array_equal(params_r, params)
+    np.testing.assert_array_equal(X_r, X)
+    assert info_r['n_iters'] == info['n_iters']
+    np.testing.assert_array_equal(info_r['costs'], info['costs'])
+
+
+def test_mixed_precision_warm_lbfgs(data):
+    Y, dt = data
+    params = fit(Y, dt, X_solver='lbfgs_warm')[0]
+    params_m = fit(Y, dt, X_solver='lbfgs_warm', precision='mixed')[0]
+    np.testing.assert_allclose(params_m, params, rtol=1e-3)
+
+
+@pytest.mark.parametrize('options', [
+    {'workspace': True, 'X_solver': 'gauss_newton'},
+    {'workspace': True, 'X_solver': 'segmented'},
+    {'precision': 'mixed', 'X_solver': 'gauss_newton'},
+    {'precision': 'mixed', 'X_solver': 'segmented'},
+    {'precision': 'mixed', 'gradients': 'autograd'},
+])
+def test_unsupported_combinations(data, options):
+    Y, dt = data
+    with pytest.raises(ValueError):
+        fit(Y, dt, max_iters=2, **options)
+
+
+@pytest.mark.parametrize('acceleration', ['anderson', 'nesterov'])
+def test_tol_stops_after_a_plain_step(data, acceleration):
+    Y, dt = data
+    records = []
+    info = fit(Y, dt, tol=np.inf, acceleration=acceleration,
+               callback=records.append)[3]
+    # The test passes at the first allowed iteration (k = 2), which is
+    # extrapolated, so the fit stops at the next, plain iteration.
+    assert info['stop_reason'] == 'tol'
+    assert info['n_iters'] == 4
+    assert not records[-1]['restarted']
+
+
+def test_resume_converged_fit(data, tmp_path):
+    Y, dt = data
+    path = str(tmp_path / 'fit.npz')
+    params, X, pred_X, info = fit(Y, dt, max_iters=1000, tol=1e-3,
+                                  checkpoint=path)
+    assert info['stop_reason'] == 'tol'
+    params_r, X_r, pred_X_r, info_r = fit(Y, dt, max_iters=1000, tol=1e-3,
+                                          resume=path)
+    assert info_r['stop_reason'] == 'tol'
+    assert info_r['n_iters'] == info['n_iters']
+    np.testing.assert_array_equal(params_r, params)
+    np.testing.assert_array_equal(X_r, X)
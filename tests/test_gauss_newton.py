@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+from scipy.optimize import minimize
+from discretization import model_input
+from gauss_newton import (gauss_newton_X_step, residual_jacobian,
+                          state_jacobians, stencil_operators)
+from objectives import X_obj_and_grad
+from ode_model import get_model
+from simulate import simulate
+
+
+@pytest.mark.parametrize('appr', ['euler', 'ad3', 'bdf2'])
+def test_sparse_jacobian_matches_stencil_products(appr):
+    model = get_model('lorenz96')
+    rng = np.random.RandomState(0)
+    T, d = 15, 6
+    X = rng.randn(T, d)
+    params = np.array([8.])
+    dt = .01 * (1 + rng.rand(T - 1))
+    Z = model_input(X, appr)
+    A = residual_jacobian(state_jacobians(Z, params, model), dt, appr, T)
+    matvec, rmatvec = stencil_operators(model.jac_stencil(Z, params),
+                                        model.stencil, dt, appr, T)
+    V, G = rng.randn(T, d), rng.randn(T - 1, d)
+    np.testing.assert_allclose(A.dot(V.ravel()), matvec(V).ravel(),
+                               rtol=1e-12, atol=1e-12)
+    np.testing.assert_allclose(A.T.dot(G.ravel()), rmatvec(G).ravel(),
+                               rtol=1e-12, atol=1e-12)
+
+
+@pytest.mark.parametrize('appr', ['euler', 'ad3', 'bdf2'])
+def test_X_step_reaches_the_lbfgs_optimum(appr):
+    np.random.seed(0)
+    model = get_model('lorenz96')
+    x0 = 8 + np.random.randn(6)
+    X, Y, dt = simulate('lorenz96', x0, [8.], .5, .01, noise_var=.5)
+    params, lam = np.array([7.]), 1.
+    T, d = Y.shape
+    # X_obj() flattens the states column by column
+    y = Y.flatten('F')
+    res = minimize(X_obj_and_grad, y, method='L-BFGS-B', jac=True,
+                   args=(params, dt, y, lam, d, appr, model),
+                   options={'maxiter': 100000, 'ftol': 1e-15, 'gtol': 1e-10})
+    for linear_solver in ['banded', 'cg']:
+        gn = gauss_newton_X_step(Y, params, dt, Y, lam, appr, model,
+                                 linear_solver=linear_solver, cg_tol=1e-10)
+        assert gn['success']
+        assert gn['fun'] <= res['fun'] * (1 + 1e-9)
+        np.testing.assert_allclose(gn['x'], res['x'].reshape((d, T)).T,
+                                   rtol=1e-5, atol=1e-5)
@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+from scipy.integrate import solve_ivp
+import generate
+from generate import generate_corpus, integrate_batch
+from ode_model import get_model
+
+
+def reference(ODE_str, x0, params, t_eval):
+    model = get_model(ODE_str)
+    sol = solve_ivp(model.rhs, (0, t_eval[-1]), x0, method='DOP853',
+                    t_eval=t_eval, args=(params,), rtol=1e-12, atol=1e-12)
+    return sol.y.T
+
+
+@pytest.mark.parametrize('method, rtol', [('dopri5', 1e-5), ('rk4', 1e-6)])
+def test_integrate_batch_matches_solve_ivp(method, rtol):
+    x0s = np.array([[-8., 7., 27.], [1., 1., 1.]])
+    params = np.array([[10., 28., 8 / 3.], [10., 15., 2.]])
+    X = integrate_batch('lorenz', x0s, params, 2, .01, method,
+                        rtol=1e-9, atol=1e-12)
+    t = .01 * np.arange(X.shape[1])
+    for b in range(2):
+        np.testing.assert_allclose(X[b], reference('lorenz', x0s[b],
+                                                   params[b], t),
+                                   rtol=rtol, atol=rtol)
+
+
+def test_dopri5_step_sizes_are_per_state():
+    # the second member is stiff, but the first one is integrated as if it
+    # were alone
+    x0s = np.array([[-1., 1.], [-1., 1.]])
+    params = np.array([[.2, .5, 3.], [.2, .5, 300.]])
+    X = integrate_batch('fitzhugh_nagumo', x0s, params, 1, .05)
+    for b in range(2):
+        np.testing.assert_array_equal(
+            X[b], integrate_batch('fitzhugh_nagumo', x0s[b:b + 1],
+                                  params[b], 1, .05)[0])
+
+
+def test_burn_in_is_not_rounded_to_the_samples():
+    x0 = np.array([-8., 7., 27.])
+    params = np.array([10., 28., 8 / 3.])
+    X = generate_corpus('lorenz', x0, params, .1, .1, noise_vars=(0.,),
+                        burn_in=.25)[0]
+    np.testing.assert_allclose(X[0, 0], reference('lorenz', x0, params,
+                                                  [.25])[-1], rtol=1e-5)
+
+
+def test_corpus_cache_hit(tmp_path, monkeypatch):
+    args = ('lorenz', np.array([[-8., 7., 27.]]), [10., 28., 8 / 3.], 1, .01)
+    X, Y, dt = generate_corpus(*args, n_noise=2, cache_dir=str(tmp_path))
+    assert len(list(tmp_path.iterdir())) == 1
+
+    def fail(*a, **k):
+        raise AssertionError('the corpus was integrated again')
+
+    monkeypatch.setattr(generate, 'integrate_batch', fail)
+    X_c, Y_c, dt_c = generate_corpus(*args, n_noise=2,
+                                     cache_dir=str(tmp_path))
+    np.testing.assert_array_equal(X_c, X)
+    np.testing.assert_array_equal(Y_c, Y)
+    assert dt_c == dt
+    # another seed is another corpus
+    with pytest.raises(AssertionError):
+        generate_corpus(*args, n_noise=2, seed=1, cache_dir=str(tmp_path))
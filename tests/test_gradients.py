@@ -0,0 +1,30 @@
+import numpy as np
+import pytest
+from ode_model import get_model
+from gradcheck import check_gradients
+
+
+MODELS = ['cubosc', 'fitzhugh_nagumo', 'lorenz', 'lorenz96', 'lotka_volterra',
+          'rossler']
+SCHEMES = ['euler', 'ad3', 'ab4', 'am2', 'bdf2', 'bdf3']
+
+
+@pytest.mark.parametrize('appr', SCHEMES)
+@pytest.mark.parametrize('name', MODELS)
+def test_analytic_gradients(name, appr):
+    model = get_model(name)
+    rng = np.random.RandomState(0)
+    d = 6 if model.dim is None else model.dim
+    X = rng.randn(20, d)
+    params = rng.rand(model.n_params) + 0.5
+    errors = check_gradients(name, X, params, dt=0.01, appr=appr)
+    assert max(errors.values()) < 1e-8, errors
+
+
+def test_nonuniform_gradients():
+    rng = np.random.RandomState(1)
+    X = rng.randn(20, 3)
+    dt = 0.01 * (1 + rng.rand(19))
+    errors = check_gradients('lorenz', X, np.array([10., 28., 8 / 3.]), dt=dt,
+                             appr='ad3')
+    assert max(errors.values()) < 1e-8, errors
@@ -0,0 +1,23 @@
+import numpy as np
+from lbfgs import LBFGS
+
+
+def test_float32_pairs_have_float64_products():
+    rng = np.random.RandomState(0)
+    low, ref = LBFGS(maxcor=4, dtype=np.float32), LBFGS(maxcor=4)
+    for _ in range(6):
+        s, y = 1e3 * rng.randn(50000), rng.randn(50000)
+        low.update(s, y)
+        # the reference stores the same rounded pairs in float64
+        ref.update(s.astype(np.float32).astype(float),
+                   y.astype(np.float32).astype(float))
+    np.testing.assert_allclose(low.SY, ref.SY, rtol=1e-12, atol=1e-9)
+    np.testing.assert_allclose(low.YY, ref.YY, rtol=1e-12, atol=1e-9)
+
+
+def test_minimize_quadratic():
+    A = np.diag(np.arange(1., 11.))
+    solver = LBFGS(maxcor=5, gtol=1e-10, ftol=0.)
+    res = solver.minimize(lambda x: (0.5 * x.dot(A).dot(x) - x.sum(),
+                                     A.dot(x) - 1), np.zeros(10))
+    np.testing.assert_allclose(res['x'], 1 / np.arange(1., 11.), rtol=1e-6)
@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+from autograd import grad
+from scipy.optimize import minimize
+import linear_params
+from linear_params import linear_param_step
+from objectives import param_obj
+from ode_model import get_model
+from simulate import simulate
+
+
+@pytest.mark.parametrize('appr', ['euler', 'ad3', 'bdf2'])
+@pytest.mark.parametrize('uniform', [True, False])
+def test_closed_form_matches_lbfgs(appr, uniform):
+    np.random.seed(0)
+    model = get_model('lorenz')
+    X, Y, dt = simulate('lorenz', np.array([-8., 7., 27.]),
+                        [10., 28., 8 / 3.], 1, .01, noise_var=.1)
+    if(not uniform):
+        dt = dt * (1 + .5 * np.random.rand(Y.shape[0] - 1))
+    params = linear_param_step(Y, dt, appr, model)
+    res = minimize(param_obj, np.array([5., 20., 2.]), method='L-BFGS-B',
+                   jac=grad(param_obj), args=(Y, dt, appr, model),
+                   options={'maxiter': 100000, 'ftol': 1e-15, 'gtol': 1e-10})
+    assert param_obj(params, Y, dt, appr, model) <= res['fun'] * (1 + 1e-9)
+    np.testing.assert_allclose(params, res['x'], rtol=1e-5)
+
+
+def test_rank_deficient_system_uses_lstsq(monkeypatch):
+    # with x0 = x1, the feature of sigma is zero and the normal equations
+    # are singular
+    calls = []
+    lstsq = linear_params.np.linalg.lstsq
+
+    def spy(*args, **kwargs):
+        calls.append(1)
+        return lstsq(*args, **kwargs)
+
+    monkeypatch.setattr(linear_params.np.linalg, 'lstsq', spy)
+    model = get_model('lorenz')
+    X = np.random.RandomState(0).randn(30, 3)
+    X[:, 1] = X[:, 0]
+    params = linear_param_step(X, .01, 'ad3', model)
+    assert len(calls) == 1
+    # minimum norm solution: sigma is not determined and set to 0
+    assert params[0] == 0
+    assert np.all(np.isfinite(params))
+    g = grad(param_obj)(params, X, .01, 'ad3', model)
+    np.testing.assert_allclose(g, 0, atol=1e-8)
@@ -0,0 +1,54 @@
+import contextlib
+import io
+import numpy as np
+from fit_direct import fit_direct
+from multilevel import fit_multilevel
+from simulate import simulate
+
+
+def test_closed_form_param_step_skips_the_coarse_levels():
+    np.random.seed(0)
+    X, Y, dt = simulate('lorenz', np.array([-8., 7., 27.]),
+                        [10., 28., 8 / 3.], 2, .01, noise_var=.1)
+    init = np.array([5., 20., 2.])
+    params, X_d = fit_direct(Y, dt, init, 'lorenz', 'ad3', max_iters=20,
+                             tol=-np.inf)[0:2]
+    params_m, X_m, pred_X, info = fit_multilevel(
+        Y, dt, init, 'lorenz', 'ad3', n_levels=3, max_iters=20,
+        tol=-np.inf, return_info=True)
+    assert len(info['levels']) == 1
+    np.testing.assert_array_equal(params_m, params)
+    np.testing.assert_array_equal(X_m, X_d)
+
+
+def test_coarse_levels_help_an_inexact_param_step():
+    # From a far initialization with a few L-BFGS iterations per parameter
+    # step, fit_direct() has not converged after 1000 iterations, while the
+    # finest level of fit_multilevel() stops on tol before.
+    np.random.seed(0)
+    X, Y, dt = simulate('fitzhugh_nagumo', np.array([-1., 1.]), [.2, .5, 3],
+                        10, .05, noise_var=.1)
+    init = np.array([20., 20., 50.])
+    with contextlib.redirect_stdout(io.StringIO()):
+        pred_X, info = fit_direct(Y, dt, init, 'fitzhugh_nagumo', 'ad3',
+                                  max_iters=1000, inner_maxiter=3,
+                                  return_info=True)[2:4]
+        pred_X_m, info_m = fit_multilevel(
+            Y, dt, init, 'fitzhugh_nagumo', 'ad3', n_levels=2,
+            coarse_iters=100, max_iters=1000, inner_maxiter=3,
+            return_info=True)[2:4]
+    assert len(info_m['levels']) == 2
+    assert info_m['stop_reason'] == 'tol'
+    assert info_m['n_iters'] < info['n_iters']
+    assert np.sum((pred_X_m - X) ** 2) < 0.1 * np.sum((pred_X - X) ** 2)
+
+
+def test_states_transfer_delays_the_tol_test():
+    np.random.seed(0)
+    X, Y, dt = simulate('fitzhugh_nagumo', np.array([-1., 1.]), [.2, .5, 3],
+                        10, .05, noise_var=.1)
+    info = fit_multilevel(Y, dt, np.array([2., 2., 5.]), 'fitzhugh_nagumo',
+                          'ad3', n_levels=2, coarse_iters=30, max_iters=100,
+                          tol=np.inf, transfer='states', return_info=True)[3]
+    assert info['stop_reason'] == 'tol'
+    assert info['n_iters'] == 31
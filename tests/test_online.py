@@ -0,0 +1,138 @@
+import numpy as np
+import autograd.numpy as anp
+import pytest
+from autograd import jacobian
+from scipy.optimize import check_grad
+from simulate import simulate
+from discretization import residuals, model_input, n_steps
+from online import OnlineFit
+
+
+@pytest.fixture(scope='module')
+def stream():
+    np.random.seed(0)
+    X, Y, dt = simulate('lorenz', np.array([-8., 7., 27.]),
+                        [10., 28., 8 / 3.], 1, .01, noise_var=.1)
+    return Y, dt
+
+
+@pytest.mark.parametrize('start', [0, 4])
+@pytest.mark.parametrize('appr', ['euler', 'ad3', 'bdf2'])
+@pytest.mark.parametrize('name, params', [('lorenz', [10., 28., 8 / 3.]),
+                                          ('fitzhugh_nagumo', [.2, .2, 3.])])
+def test_marginal_prior_is_the_schur_complement(name, params, appr, start):
+    dt = .05
+    K = n_steps(appr)
+    fit = OnlineFit(dt, params, name, appr, lam=.5, window=K + 1)
+    d = fit.model.dim
+    rng = np.random.RandomState(1)
+    fit.X = rng.randn(K + 1, d)
+    fit.n_samples = start + K + 1
+    L, g, center = rng.randn(K * d, K * d), rng.randn(K * d), rng.randn(K * d)
+    if(start > 0):
+        fit.prior = (center, np.dot(L, L.T), g)
+    center, H, b = fit.marginalize()
+
+    # the residuals of the whole history whose oldest state is X[0]
+    history = rng.randn(start, d)
+    rows = list(range(K)) if start == 0 else [start + K - 1]
+
+    def r(z):
+        X = anp.concatenate((history, z.reshape(K + 1, d)), 0)
+        terms = fit.model.rhs_vec(model_input(X, appr), fit.params)
+        return residuals(X, terms, dt, appr)[rows].ravel()
+    z = fit.X.ravel()
+    r0, J = r(z), jacobian(r)(z)
+
+    # min over the step dx0 of X[0] of |r0 + J dx|^2 + lam*|dx0|^2 plus the
+    # prior (dx+u)'LL'(dx+u) + 2g'(dx+u) on the states 0, ..., K-1
+    def brute(dx):
+        B = [J[:, 0:d], np.sqrt(fit.lam) * np.eye(d)]
+        c = [r0 + np.dot(J[:, d:], dx), np.zeros(d)]
+        if(start > 0):
+            u = z[0:K * d] - fit.prior[0]
+            B.append(L.T[:, 0:d])
+            c.append(np.dot(L.T, np.concatenate((np.zeros(d),
+                                                 dx[0:(K - 1) * d])) + u) +
+                     np.linalg.solve(L, g))
+        B, c = np.concatenate(B, 0), np.concatenate(c)
+        res = c - np.dot(B, np.linalg.lstsq(B, c, rcond=None)[0])
+        return np.sum(res ** 2)
+
+    for k in range(3):
+        dx = rng.randn(K * d)
+        quad = np.dot(dx, np.dot(H, dx)) + 2 * np.dot(b, dx)
+        np.testing.assert_allclose(quad, brute(dx) - brute(0 * dx),
+                                   rtol=1e-7, atol=1e-8)
+    np.testing.assert_array_equal(center, fit.X[1:K + 1].ravel())
+    assert np.all(np.linalg.eigvalsh(H) > 0)
+
+
+@pytest.mark.parametrize('appr', ['euler', 'ad3', 'bdf2'])
+def test_window_is_the_marginal_of_the_history(appr, tmp_path):
+    # For a model that is linear in the states, the objective of the window
+    # plus the prior is the objective of the whole history minimized over
+    # the states that left the window, up to a constant.
+    pytest.importorskip('sympy')
+    from symbolic import symbolic_model
+    model = symbolic_model('linosc', ['x', 'y'], ['a', 'b'],
+                           ['y', '-a*x - b*y'], register=False,
+                           cache_dir=str(tmp_path))
+    dt, lam, W, N = .1, .5, 6, 14
+    rng = np.random.RandomState(0)
+    Y = rng.randn(N, 2)
+    fit = OnlineFit(dt, [2., .3], model, appr, lam=lam, window=W, n_iters=0)
+    fit.update(Y)
+    x0 = rng.randn(W * 2)
+
+    def history(x):
+        def r(z):
+            X = anp.concatenate((z.reshape(-1, 2), x.reshape(W, 2)), 0)
+            terms = model.rhs_vec(model_input(X, appr), fit.params)
+            return anp.concatenate((residuals(X, terms, dt, appr).ravel(),
+                                    np.sqrt(lam) * (z - Y[0:N - W].ravel())))
+        z = Y[0:N - W].ravel()
+        c, B = r(z), jacobian(r)(z)
+        res = c - np.dot(B, np.linalg.lstsq(B, c, rcond=None)[0])
+        return np.sum(res ** 2) + lam * np.sum((x - x0) ** 2)
+
+    xs = [rng.randn(W * 2) for k in range(3)]
+    window = [fit.state_obj(x, x0)[0] for x in xs]
+    full = [history(x) for x in xs]
+    np.testing.assert_allclose(np.diff(window), np.diff(full), rtol=1e-8)
+
+
+def test_state_obj_gradient_with_prior(stream):
+    Y, dt = stream
+    fit = OnlineFit(dt, [5., 20., 2.], 'lorenz', 'ad3', window=10,
+                    n_iters=1, inner_maxiter=5)
+    fit.update(Y[0:30])
+    assert fit.prior is not None
+    x = fit.X.ravel()
+    x0 = x + 0.1
+    error = check_grad(lambda v: fit.state_obj(v, x0)[0],
+                       lambda v: fit.state_obj(v, x0)[1], x)
+    assert error < 1e-4 * np.linalg.norm(fit.state_obj(x, x0)[1])
+
+
+def test_window_and_estimates(stream):
+    Y, dt = stream
+    fit = OnlineFit(dt, [5., 20., 2.], 'lorenz', 'ad3', window=20)
+    params, x = fit.update(Y)
+    assert fit.X.shape == (20, 3)
+    assert fit.n_samples == Y.shape[0]
+    np.testing.assert_allclose(params, [10., 28., 8 / 3.], rtol=.1)
+
+
+def test_window_matches_the_full_history(stream):
+    # The window only estimates the parameters from its own residuals, so
+    # the estimates are close to those of the whole history, not equal.
+    Y, dt = stream
+    args = (dt, [5., 20., 2.], 'lorenz', 'ad3')
+    window = OnlineFit(*args, window=60)
+    full = OnlineFit(*args, window=Y.shape[0])
+    params = window.update(Y)[0]
+    full_params = full.update(Y)[0]
+    assert full.prior is None and window.prior is not None
+    np.testing.assert_allclose(params, full_params, rtol=.01)
+    np.testing.assert_allclose(window.X, full.X[-60:], atol=.05)
@@ -0,0 +1,34 @@
+import contextlib
+import io
+import numpy as np
+import pytest
+from fit_direct import fit_direct
+from simulate import simulate
+
+
+@pytest.mark.parametrize('ODE_str, x0, init', [
+    ('lorenz', np.array([-8., 7., 27.]), np.array([5., 20., 2.])),
+    ('fitzhugh_nagumo', np.array([-1., 1.]), np.array([1., 1., 1.]))])
+def test_memmap_fit_equals_the_in_memory_blockwise_fit(tmp_path, ODE_str,
+                                                       x0, init):
+    np.random.seed(0)
+    true_params = {'lorenz': [10., 28., 8 / 3.],
+                   'fitzhugh_nagumo': [.2, .5, 3]}[ODE_str]
+    Y, dt = simulate(ODE_str, x0, true_params, 1, .01, noise_var=.1)[1:3]
+    Y_path = str(tmp_path / 'Y.npy')
+    np.save(Y_path, Y)
+    kwargs = dict(appr='ad3', max_iters=10, tol=-np.inf, block_size=30)
+    with contextlib.redirect_stdout(io.StringIO()):
+        params, X, pred_X = fit_direct(Y, dt, init, ODE_str,
+                                       X_solver='blockwise', **kwargs)[0:3]
+        params_m, X_m, pred_X_m = fit_direct(
+            Y_path, dt, init, ODE_str, out=str(tmp_path / 'X.npy'),
+            pred_out=str(tmp_path / 'pred_X.npy'), **kwargs)[0:3]
+    assert isinstance(X_m, np.memmap)
+    np.testing.assert_array_equal(params_m, params)
+    np.testing.assert_array_equal(X_m, X)
+    np.testing.assert_array_equal(pred_X_m, pred_X)
+    # the results are in the files
+    np.testing.assert_array_equal(np.load(str(tmp_path / 'X.npy')), X)
+    np.testing.assert_array_equal(np.load(str(tmp_path / 'pred_X.npy')),
+                                  pred_X)
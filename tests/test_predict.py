@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+import simulate
+from ode_model import get_model
+from simulate import predict, predict_batch
+
+
+def baseline_predict(init_state, end_t, dt, params, ODE_str, appr):
+    # predict() before predict_batch()
+    T = int((end_t / dt) + 1)
+    ode_fun = get_model(ODE_str).rhs
+    pX = np.zeros((T, init_state.shape[0]))
+    pX[0, :] = init_state
+    for i in range(1, T):
+        if(appr == 'euler'):
+            temp1 = ode_fun(0, pX[i - 1, :], params)
+            pX[i, :] = pX[i - 1, :] + temp1 * dt
+        elif(appr == 'ad2'):
+            if (i == 1):
+                temp1 = ode_fun(0, pX[i - 1, :], params)
+                pX[i, :] = pX[i - 1, :] + temp1 * dt
+            else:
+                temp2 = ode_fun(0, pX[i - 1, :], params)
+                pX[i, :] = pX[i - 1, :] + ((3 / 2) * (temp2 * dt))\
+                           - ((1 / 2) * dt * (temp1))
+                temp1 = temp2
+        else:
+            if (i == 1):
+                temp1 = ode_fun(0, pX[i - 1, :], params)
+                pX[i, :] = pX[i - 1, :] + temp1 * dt
+            elif (i == 2):
+                temp2 = ode_fun(0, pX[i - 1, :], params)
+                pX[i, :] = pX[i - 1, :] + ((3 / 2) * (temp2 * dt)) - \
+                           ((1 / 2) * dt * (temp1))
+            else:
+                temp3 = ode_fun(0, pX[i - 1, :], params)
+                pX[i, :] = pX[i - 1, :] + ((23 / 12) * (temp3 * dt)) - \
+                           ((4 / 3) * dt * (temp2)) + ((5 / 12) * dt * (temp1))
+                temp1, temp2 = temp2, temp3
+    return pX
+
+
+@pytest.mark.parametrize('appr', ['euler', 'ad2', 'ad3'])
+@pytest.mark.parametrize('ODE_str, x0, params', [
+    ('lorenz', np.array([-8., 7., 27.]), np.array([10., 28., 8 / 3.])),
+    ('fitzhugh_nagumo', np.array([-1., 1.]), np.array([.2, .5, 3.])),
+    ('lorenz96', 8 + np.linspace(-1, 1, 6), np.array([8.]))])
+@pytest.mark.parametrize('engine', ['auto', 'numpy'])
+def test_predict_equals_the_baseline(ODE_str, x0, params, appr, engine,
+                                     monkeypatch):
+    if(engine == 'numpy'):
+        monkeypatch.setattr(simulate, 'numba', None)
+    np.testing.assert_allclose(predict(x0, 2, .01, params, ODE_str, appr),
+                               baseline_predict(x0, 2, .01, params, ODE_str,
+                                                appr),
+                               rtol=1e-9, atol=1e-9)
+
+
+@pytest.mark.skipif(simulate.numba is None, reason='numba is not installed')
+@pytest.mark.parametrize('appr', ['euler', 'ad3', 'ab4'])
+@pytest.mark.parametrize('uniform', [True, False])
+def test_numba_engine_matches_numpy(appr, uniform):
+    # more than the 10000 steps of a block of weights, with parameters of
+    # stable fixed points (x = F), so that the rounding errors do not grow
+    rng = np.random.RandomState(0)
+    init_states = rng.randn(3, 6)
+    params = np.array([[.3], [.5], [.7]])
+    dt = .01 if uniform else .01 * (1 + rng.rand(12000))
+    end_t = 120 if uniform else np.sum(dt)
+    X = predict_batch(init_states, end_t, dt, params, 'lorenz96', appr,
+                      engine='numba')
+    X_np = predict_batch(init_states, end_t, dt, params, 'lorenz96', appr,
+                         engine='numpy')
+    assert X.shape[1] > 10001
+    np.testing.assert_allclose(X, X_np, rtol=1e-10, atol=1e-10)
@@ -0,0 +1,86 @@
+import numpy as np
+import pytest
+from scipy.optimize import minimize
+from objectives import X_obj_and_grad
+from ode_model import get_model
+from segments import SegmentedXStep, chunk_bounds
+from simulate import simulate
+
+
+@pytest.mark.parametrize('K', [1, 2, 3, 4])
+def test_chunk_bounds_cover_the_series(K):
+    for T in range(1, 60):
+        for n_chunks in range(1, 20):
+            bounds = chunk_bounds(T, n_chunks, K)
+            assert bounds[0][0] == 0 and bounds[-1][1] == T
+            assert all(e == s for (a, e), (s, b) in zip(bounds, bounds[1:]))
+            # red/black chunks of the same color never share a residual
+            lengths = [e - s for s, e in bounds]
+            assert min(lengths) >= min(K, T)
+            assert len(bounds) <= n_chunks
+
+
+def test_more_chunks_than_states():
+    assert chunk_bounds(5, 10, 3) == [(0, 5)]
+    assert chunk_bounds(5, 10, 1) == [(0, 1), (1, 2), (2, 3), (3, 4), (4, 5)]
+
+
+def lbfgs_X_step(Y, params, dt, lam, appr, model):
+    T, d = Y.shape
+    y = Y.flatten('F')
+    res = minimize(X_obj_and_grad, y, method='L-BFGS-B', jac=True,
+                   args=(params, dt, y, lam, d, appr, model),
+                   options={'maxiter': 100000, 'ftol': 1e-15, 'gtol': 1e-10})
+    return res['x'].reshape((d, T)).T, res['fun']
+
+
+@pytest.mark.parametrize('appr', ['euler', 'ad3', 'bdf2'])
+@pytest.mark.parametrize('n_chunks', [3, 4, 200])
+def test_red_black_sweeps_match_the_unsegmented_step(appr, n_chunks):
+    # T = 51 leaves a shorter chunk with 4 chunks, and 200 chunks are more
+    # than the states
+    np.random.seed(0)
+    model = get_model('lorenz')
+    X, Y, dt = simulate('lorenz', np.array([-8., 7., 27.]),
+                        [10., 28., 8 / 3.], .5, .01, noise_var=.1)
+    params = np.array([10., 28., 8 / 3.])
+    X_ref, fun = lbfgs_X_step(Y, params, dt, 1., appr, model)
+    step = SegmentedXStep(Y.shape[0], 3, dt, appr, model, n_chunks=n_chunks,
+                          max_workers=1, n_sweeps=100, min_chunk_size=0)
+    if(n_chunks == 4):
+        lengths = [e - s for s, e in step.bounds]
+        assert len(set(lengths)) == 2
+    X_seg, res = step(Y, params, Y, 1.)
+    step.close()
+    assert len(step.bounds) > 1
+    assert res['fun'] <= fun * (1 + 1e-6)
+    np.testing.assert_allclose(X_seg, X_ref, rtol=1e-4, atol=1e-4)
+
+
+def test_small_problems_use_one_chunk():
+    np.random.seed(0)
+    model = get_model('lorenz')
+    X, Y, dt = simulate('lorenz', np.array([-8., 7., 27.]),
+                        [10., 28., 8 / 3.], .5, .01, noise_var=.1)
+    step = SegmentedXStep(Y.shape[0], 3, dt, 'ad3', model, n_chunks=8,
+                          max_workers=4)
+    assert step.bounds == [(0, Y.shape[0])]
+    assert step.executor is None
+    step.close()
+
+
+def test_workers_match_the_serial_sweeps():
+    np.random.seed(0)
+    model = get_model('lorenz')
+    X, Y, dt = simulate('lorenz', np.array([-8., 7., 27.]),
+                        [10., 28., 8 / 3.], .5, .01, noise_var=.1)
+    params = np.array([10., 28., 8 / 3.])
+    out = []
+    for max_workers in [1, 2]:
+        step = SegmentedXStep(Y.shape[0], 3, dt, 'ad3', model, n_chunks=4,
+                              max_workers=max_workers, n_sweeps=2,
+                              min_chunk_size=0)
+        assert (step.executor is None) == (max_workers == 1)
+        out.append(step(Y, params, Y, 1.)[0])
+        step.close()
+    np.testing.assert_array_equal(out[1], out[0])
@@ -0,0 +1,102 @@
+import numpy as np
+import pytest
+from fit_direct import fit_direct
+from simulate import simulate
+from shared import SHARED
+from sweep import make_grid, run_config, sweep, validation_error
+
+
+@pytest.fixture(scope='module')
+def data():
+    np.random.seed(0)
+    X, Y, dt = simulate('fitzhugh_nagumo', np.array([-1., 1.]),
+                        [.2, .2, 3.], 5, .05, noise_var=.1)
+    return Y[0:80], Y[80:], dt
+
+
+@pytest.fixture
+def shared(data):
+    Y, Y_val, dt = data
+    # two runs, checks after 5, 10 and 15 iterations
+    SHARED.update(Y=Y, Y_val=Y_val, errors=np.full((2, 3), np.inf))
+    yield SHARED
+    SHARED.clear()
+
+
+def continue_probe(data, shared, tmp_path, errors):
+    dt = data[2]
+    config = {'init_params': np.array([2., 2., 5.]), 'appr': 'ad3'}
+    kwargs = {'tol': -np.inf}
+    path = str(tmp_path / 'run0.npz')
+    probe = run_config(config, dt, 'fitzhugh_nagumo',
+                       dict(kwargs, max_iters=5), checkpoint=path)
+    shared['errors'][:] = errors
+    shared['errors'][0, 0] = probe['val_error']
+    probe = {'index': 0, 'iters': 5, 'params': probe['params'],
+             'val_error': probe['val_error']}
+    return run_config(config, dt, 'fitzhugh_nagumo',
+                      dict(kwargs, max_iters=20), probe, 10., None, path)
+
+
+def test_continued_run_matches_an_uninterrupted_fit(data, shared, tmp_path):
+    Y, Y_val, dt = data
+    result = continue_probe(data, shared, tmp_path, np.inf)
+    params, X = fit_direct(Y, dt, np.array([2., 2., 5.]), 'fitzhugh_nagumo',
+                           'ad3', max_iters=20, tol=-np.inf)[0:2]
+    assert 'stage' not in result and result['n_iters'] == 20
+    np.testing.assert_array_equal(result['params'], params)
+    np.testing.assert_array_equal(result['X'], X)
+    # the errors of the checks after 10 and 15 iterations
+    assert np.all(np.isfinite(shared['errors'][0]))
+
+
+def test_runs_are_compared_at_the_same_iteration(data, shared, tmp_path):
+    # the other run is only better after 15 iterations
+    errors = np.array([[np.inf] * 3, [np.inf, np.inf, 0.]])
+    result = continue_probe(data, shared, tmp_path, errors)
+    assert result['stage'] == 'pruned' and result['n_iters'] == 15
+
+
+def test_running_run_stops_when_dominated(data, shared, tmp_path):
+    # the other run dominates the probe, the callback stops the fit at its
+    # first iteration
+    errors = np.array([[np.inf] * 3, [0., np.inf, np.inf]])
+    result = continue_probe(data, shared, tmp_path, errors)
+    assert result['stage'] == 'pruned' and result['n_iters'] == 6
+    assert result['val_error'] > 0
+
+
+def test_sweep_keeps_the_configs(data, capfd):
+    Y, Y_val, dt = data
+    configs = make_grid([[2., 2., 5.], [1., 1., 1.]], apprs=('ad3',))
+    inits = [c['init_params'].copy() for c in configs]
+    best, results = sweep(Y, dt, configs, 'fitzhugh_nagumo', Y_val,
+                          max_workers=2, probe_iters=3, prune_factor=1e6,
+                          max_iters=10)
+    assert capfd.readouterr().out == ''
+    for c, init in zip(configs, inits):
+        np.testing.assert_array_equal(c['init_params'], init)
+    init = best['config']['init_params']
+    assert any(np.array_equal(init, i) for i in inits)
+    probes = [r for r in results if r['stage'] == 'probe' and
+              np.array_equal(r['config']['init_params'], init)]
+    np.testing.assert_array_equal(best['probe_params'], probes[0]['params'])
+    assert not np.array_equal(best['probe_params'], init)
+    assert len([r for r in results if r['stage'] == 'final']) == 2
+
+
+def test_validation_error_on_a_nonuniform_grid(data):
+    Y, Y_val, dt = data
+    params = np.array([.2, .2, 3.])
+    X = Y.copy()
+    err = validation_error(params, X, None, Y, Y_val, dt, 'fitzhugh_nagumo',
+                           'ad3')
+    # the same uniform intervals, given as arrays
+    dts = np.full(Y.shape[0] - 1, dt)
+    val_dt = np.full(Y_val.shape[0], dt)
+    err_v = validation_error(params, X, None, Y, Y_val, dts,
+                             'fitzhugh_nagumo', 'ad3', val_dt)
+    np.testing.assert_allclose(err_v, err, rtol=1e-10)
+    with pytest.raises(ValueError):
+        validation_error(params, X, None, Y, Y_val, dts, 'fitzhugh_nagumo',
+                         'ad3')
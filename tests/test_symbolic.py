@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+from ode_model import get_model
+from gradcheck import check_gradients
+
+sympy = pytest.importorskip('sympy')
+from symbolic import symbolic_model
+
+
+def test_matches_handwritten_model(tmp_path):
+    model = symbolic_model('cubosc_symbolic', ['x', 'y'], ['a', 'b'],
+                           ['-a*x**3 + b*y**3', '-b*x**3 - a*y**3'],
+                           register=False, cache_dir=str(tmp_path))
+    ref = get_model('cubosc')
+    X = np.random.RandomState(0).randn(30, 2)
+    params = np.array([0.1, 2.])
+    assert model.linear_in_params
+    np.testing.assert_allclose(model.rhs_vec(X, params),
+                               ref.rhs_vec(X, params))
+    np.testing.assert_allclose(model.jac_x(X, params), ref.jac_x(X, params))
+    for a, b in zip(model.features(X), ref.features(X)):
+        np.testing.assert_allclose(a, b)
+
+
+def test_constant_and_parameter_entries(tmp_path):
+    model = symbolic_model('drift', ['x', 'y', 'z'], ['k', 'w'],
+                           ['k', '-y + w*x', '2'], register=False,
+                           cache_dir=str(tmp_path))
+    X = np.random.RandomState(1).randn(25, 3)
+    params = np.array([0.7, -1.3])
+    terms = model.rhs_vec(X, params)
+    assert terms.shape == (24, 3)
+    np.testing.assert_allclose(terms[:, 0], 0.7)
+    np.testing.assert_allclose(terms[:, 2], 2.)
+    Phi, c = model.features(X)
+    np.testing.assert_allclose(c[:, 0], 0.)
+    np.testing.assert_allclose(c[:, 2], 2.)
+    errors = check_gradients(model, X, params, appr='ad3')
+    assert max(errors.values()) < 1e-8, errors
+    out = np.zeros(3)
+    model.rhs_kernel(X[0], params, out)
+    np.testing.assert_allclose(out, model.rhs(0., X[0], params))
+
+
+def test_cached_kernels_are_reused(tmp_path):
+    args = ('cached', ['u'], ['r'], ['r*u*(1 - u)'])
+    first = symbolic_model(*args, register=False, cache_dir=str(tmp_path))
+    second = symbolic_model(*args, register=False, cache_dir=str(tmp_path))
+    assert second.path == first.path
+    assert second.kernels is first.kernels
+    assert len(list(tmp_path.iterdir())) == 1
@@ -0,0 +1,95 @@
+import csv
+import json
+import logging
+import numpy as np
+import pytest
+from fit_direct import fit_direct
+from simulate import simulate
+from telemetry import FIELDS, FitTrace
+
+
+@pytest.fixture(scope='module')
+def data():
+    np.random.seed(0)
+    X, Y, dt = simulate('fitzhugh_nagumo', np.array([-1., 1.]),
+                        [.2, .5, 3], 5, .05, noise_var=.1)
+    return Y, dt
+
+
+def fit(Y, dt, **kwargs):
+    options = {'max_iters': 10, 'tol': -np.inf, 'return_info': True}
+    options.update(kwargs)
+    return fit_direct(Y, dt, np.array([2., 2., 5.]), 'fitzhugh_nagumo',
+                      'ad3', **options)
+
+
+def read_csv(path):
+    with open(path, newline='') as f:
+        reader = csv.DictReader(f)
+        return reader.fieldnames, list(reader)
+
+
+def test_csv_rows(data, tmp_path):
+    path = str(tmp_path / 'fit.csv')
+    trace = FitTrace(csv_path=path, every=4)
+    info = fit(*data, callback=trace)[3]
+    trace.close()
+    fields, rows = read_csv(path)
+    assert fields == FIELDS
+    # every 4th record and the last one
+    assert [int(r['iter']) for r in rows] == [0, 4, 8, 9]
+    assert rows[-1]['stop_reason'] == info['stop_reason'] == 'max_iters'
+    assert all(r['stop_reason'] == '' for r in rows[:-1])
+    assert len(trace.records) == 10
+    summary = trace.summary()
+    assert summary['n_iters'] == 10
+    assert summary['stop_reason'] == 'max_iters'
+    assert summary['X_nfev'] == int(np.sum(trace.column('X_nfev')))
+    trace.to_csv(str(tmp_path / 'all.csv'))
+    assert len(read_csv(str(tmp_path / 'all.csv'))[1]) == 10
+
+
+def test_logger_messages(data, caplog):
+    trace = FitTrace(keep=False, logger='fit.trace', every=5)
+    with caplog.at_level(logging.INFO, logger='fit.trace'):
+        fit(*data, callback=trace)
+    records = [json.loads(r.getMessage()) for r in caplog.records
+               if r.name == 'fit.trace']
+    assert [r['iter'] for r in records] == [0, 5, 9]
+    assert records[-1]['stop_reason'] == 'max_iters'
+    assert trace.records == []
+
+
+def test_max_time_stops_the_fit(data, tmp_path):
+    path = str(tmp_path / 'fit.csv')
+    trace = FitTrace(csv_path=path, every=100, max_time=0.)
+    info = fit(*data, callback=trace)[3]
+    trace.close()
+    assert info['stop_reason'] == 'callback'
+    assert info['n_iters'] == 1
+    assert trace.stop_reason == 'callback'
+    assert trace.records[-1]['stop_reason'] == 'callback'
+    rows = read_csv(path)[1]
+    assert [r['stop_reason'] for r in rows] == ['callback']
+
+
+def test_callback_stop_is_recorded(data):
+    records = []
+
+    def callback(record):
+        records.append(record)
+        return record['iter'] == 3
+
+    info = fit(*data, callback=callback)[3]
+    assert info['stop_reason'] == 'callback'
+    assert len(records) == 4
+    assert records[-1]['stop_reason'] == 'callback'
+    assert all('stop_reason' not in r for r in records[:-1])
+
+
+def test_callback_stop_at_the_last_iteration(data):
+    records = []
+    info = fit(*data, callback=lambda r: records.append(r) or True,
+               max_iters=1)[3]
+    assert info['stop_reason'] == 'max_iters'
+    assert records[-1]['stop_reason'] == 'max_iters'
@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+from ode_model import get_model
+from discretization import model_input, residuals
+from objectives import X_obj_and_grad
+from workspace import StateWorkspace
+
+
+# mixed precision evaluates the model in float32
+TOLERANCES = {float: 1e-10, np.float32: 1e-6}
+
+
+def problem(name, nonuniform, T=30):
+    model = get_model(name)
+    rng = np.random.RandomState(0)
+    d = 6 if model.dim is None else model.dim
+    X = rng.randn(T, d)
+    params = rng.rand(model.n_params) + 0.5
+    dt = 0.01 * (1 + rng.rand(T - 1)) if nonuniform else 0.01
+    mask = rng.rand(T, d) > .3
+    return model, X, params, dt, mask
+
+
+@pytest.mark.parametrize('dtype', [float, np.float32])
+@pytest.mark.parametrize('masked', [False, True])
+@pytest.mark.parametrize('nonuniform', [False, True])
+@pytest.mark.parametrize('appr', ['euler', 'ad3', 'bdf2'])
+@pytest.mark.parametrize('name', ['lorenz', 'fitzhugh_nagumo', 'lorenz96'])
+def test_workspace_matches_X_obj_and_grad(name, appr, nonuniform, masked,
+                                          dtype):
+    model, X, params, dt, mask = problem(name, nonuniform)
+    T, d = X.shape
+    lam = .5
+    X0 = X + 0.1 * np.random.RandomState(1).randn(T, d)
+    mask = mask if masked else None
+    ws = StateWorkspace(T, d, dt, appr, model, mask, dtype=dtype)
+    tol = TOLERANCES[dtype]
+
+    # the reference flattens the states column by column
+    val, grad = X_obj_and_grad(X.flatten('F'), params, dt, X0.flatten('F'),
+                               lam, d, appr, model,
+                               None if mask is None else mask.flatten('F'))
+    # two evaluations, so that the second one reads the reused buffers
+    ws.X_obj_and_grad(X0.ravel(), params, X.ravel(), lam)
+    ws_val, ws_grad = ws.X_obj_and_grad(X.ravel(), params, X0.ravel(), lam)
+
+    R = residuals(X, model.rhs_vec(model_input(X, appr), params), dt, appr)
+    np.testing.assert_allclose(ws.R, R, rtol=tol,
+                               atol=tol * np.abs(R).max())
+    np.testing.assert_allclose(ws_val, val, rtol=tol)
+    assert ws.G.dtype == dtype and ws_grad.dtype == np.float64
+    np.testing.assert_allclose(ws_grad, grad.reshape((d, T)).T.ravel(),
+                               rtol=tol, atol=tol * np.abs(grad).max())